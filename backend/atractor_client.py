@@ -0,0 +1,225 @@
+"""
+Cliente HTTP asíncrono para Atractor (informe de ventas).
+- Un httpx.AsyncClient compartido: pool de conexiones persistente (keep-alive), sin un handshake TLS por informe.
+- Tiempos configurables: ATRACTOR_CONNECT_TIMEOUT_SECONDS (conexión) y ATRACTOR_TIMEOUT_SECONDS (lectura).
+- ATRACTOR_MAX_CONCURRENCY: peticiones simultáneas a Atractor; el resto esperan su turno sin ocupar hilos.
+- Las peticiones son corrutinas: si el navegador se desconecta se cancela la tarea y se cierra la conexión.
+- transport opcional (p. ej. httpx.MockTransport) o una URL local para probar contra un servidor de pruebas.
+- Rangos largos: month_ranges los divide en meses naturales y SalesRowMerger suma las filas de cada tramo.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+from datetime import date, timedelta
+
+import httpx
+
+ATRACTOR_TIMEOUT_SECONDS = float(os.environ.get("ATRACTOR_TIMEOUT_SECONDS", "30") or 30)
+ATRACTOR_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("ATRACTOR_CONNECT_TIMEOUT_SECONDS", "10") or 10)
+ATRACTOR_MAX_CONCURRENCY = max(1, int(os.environ.get("ATRACTOR_MAX_CONCURRENCY", "4") or 4))
+ATRACTOR_POOL_SIZE = max(1, int(os.environ.get("ATRACTOR_POOL_SIZE", "8") or 8))
+# Columnas numéricas que identifican la fila (no se suman al juntar tramos); además id*, cod*, ref* y *_id
+ATRACTOR_KEY_FIELDS = {
+    f.strip().lower()
+    for f in (os.environ.get("ATRACTOR_KEY_FIELDS") or "articulo,cliente,familia,tienda,almacen,ean,sku,mes,anio,año").split(",")
+    if f.strip()
+}
+# Medidas aditivas (unidades, importes): las únicas columnas numéricas que se suman al juntar meses. Una columna
+# numérica que no es de clave ni está aquí (precio medio, margen %...) no se puede sumar: se pide el rango completo.
+ATRACTOR_SUM_FIELDS = {
+    f.strip().lower()
+    for f in (
+        os.environ.get("ATRACTOR_SUM_FIELDS")
+        or "unidades,uds,cantidad,importe,importe_total,total,ventas,base,base_imponible,iva,coste,beneficio,descuento,tickets"
+    ).split(",")
+    if f.strip()
+}
+
+
+class AtractorError(Exception):
+    """Error al consultar Atractor; detail es el mensaje para el usuario (se devuelve como 502)."""
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def _ssl_verify() -> bool:
+    return os.environ.get("ATRACTOR_SSL_VERIFY", "1").lower() not in ("0", "false")
+
+
+class AtractorClient:
+    """Cliente compartido (uno por proceso) con límite de concurrencia y métricas básicas."""
+
+    def __init__(
+        self,
+        timeout: float = ATRACTOR_TIMEOUT_SECONDS,
+        connect_timeout: float = ATRACTOR_CONNECT_TIMEOUT_SECONDS,
+        max_concurrency: int = ATRACTOR_MAX_CONCURRENCY,
+        pool_size: int = ATRACTOR_POOL_SIZE,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max(1, max_concurrency)
+        self.pool_size = max(1, pool_size)
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "cancelled": 0, "in_flight": 0, "waiting": 0}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+                verify=_ssl_verify(),
+                transport=self._transport,
+                headers={"Accept": "application/json"},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _count(self, key: str, delta: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += delta
+
+    async def get_text(self, url: str, user: str = "", password: str = "") -> str:
+        """GET con autenticación básica opcional; devuelve el cuerpo. AtractorError si falla o responde con error."""
+        client = self._get_client()
+        auth = httpx.BasicAuth(user, password) if (user or password) else None
+        acquired = False
+        self._count("waiting")
+        try:
+            async with self._semaphore:
+                acquired = True
+                self._count("waiting", -1)
+                self._count("in_flight")
+                self._count("requests")
+                try:
+                    resp = await client.get(url, auth=auth)
+                finally:
+                    self._count("in_flight", -1)
+        except asyncio.CancelledError:
+            self._count("cancelled")
+            raise
+        except httpx.TimeoutException:
+            self._count("errors")
+            raise AtractorError("Atractor no respondió a tiempo. Inténtalo de nuevo o reduce el rango de fechas.")
+        except httpx.HTTPError as e:
+            self._count("errors")
+            raise AtractorError(f"No se pudo conectar con Atractor: {e}")
+        finally:
+            if not acquired:
+                self._count("waiting", -1)
+        if resp.status_code >= 400:
+            self._count("errors")
+            raise AtractorError(f"Atractor respondió con error: {resp.status_code}. {resp.text[:500]}")
+        return resp.text
+
+    async def get_json(self, url: str, user: str = "", password: str = ""):
+        """Como get_text, pero decodifica JSON; si no es JSON devuelve {"raw": texto}."""
+        raw = await self.get_text(url, user, password)
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return {"raw": raw}
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def status(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+        out["max_concurrency"] = self.max_concurrency
+        out["pool_size"] = self.pool_size
+        return out
+
+
+def month_ranges(desde: str, hasta: str) -> list[tuple[str, str]]:
+    """Divide [desde, hasta] (YYYY-MM-DD, ambos incluidos) en tramos por mes natural. ValueError si no son fechas."""
+    start = date.fromisoformat(desde)
+    end = date.fromisoformat(hasta)
+    if end < start:
+        return [(desde, hasta)]
+    out = []
+    cur = start
+    while cur <= end:
+        next_month = date(cur.year + (cur.month == 12), cur.month % 12 + 1, 1)
+        out.append((cur.isoformat(), min(end, next_month - timedelta(days=1)).isoformat()))
+        cur = next_month
+    return out
+
+
+class SalesRowMerger:
+    """
+    Suma los informes de varios tramos (listas de filas). Dos filas son la misma si coinciden en todas las columnas
+    no numéricas y en las de clave; las medidas aditivas (sum_fields) se suman. Si aparece otra columna numérica
+    (media, precio, porcentaje) el tramo no se puede sumar sin falsear el resultado y add devuelve False.
+    Solo guarda las filas ya sumadas.
+    """
+
+    def __init__(self, key_fields: set[str] | None = None, sum_fields: set[str] | None = None):
+        self.key_fields = ATRACTOR_KEY_FIELDS if key_fields is None else key_fields
+        self.sum_fields = ATRACTOR_SUM_FIELDS if sum_fields is None else sum_fields
+        self._rows: dict[tuple, dict] = {}
+        self.input_rows = 0
+
+    @staticmethod
+    def _is_number(value) -> bool:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def _is_key(self, name) -> bool:
+        n = str(name).lower()
+        return n in self.key_fields or n.startswith(("id", "cod", "ref")) or n.endswith("_id")
+
+    def _is_sum(self, name, value) -> bool:
+        return self._is_number(value) and str(name).lower() in self.sum_fields
+
+    def mergeable(self, data) -> bool:
+        """Lista de filas cuyas columnas numéricas son todas de clave o medidas aditivas."""
+        if not isinstance(data, list):
+            return False
+        for row in data:
+            if not isinstance(row, dict):
+                return False
+            for k, v in row.items():
+                if self._is_number(v) and not self._is_key(k) and not self._is_sum(k, v):
+                    return False
+        return True
+
+    def add(self, data) -> bool:
+        """Suma un tramo. False (sin tocar nada) si no es una lista de filas o tiene columnas que no se pueden sumar."""
+        if not self.mergeable(data):
+            return False
+        for row in data:
+            key = tuple(sorted(
+                (str(k), json.dumps(v, sort_keys=True, default=str)) for k, v in row.items() if not self._is_sum(k, v)
+            ))
+            acc = self._rows.get(key)
+            if acc is None:
+                self._rows[key] = dict(row)
+                continue
+            for k, v in row.items():
+                if self._is_sum(k, v):
+                    prev = acc.get(k)
+                    acc[k] = prev + v if self._is_sum(k, prev) else v
+        self.input_rows += len(data)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def rows(self):
+        """Filas sumadas en orden de primera aparición (los decimales se redondean para evitar restos de coma flotante)."""
+        for row in self._rows.values():
+            yield {k: round(v, 6) if isinstance(v, float) else v for k, v in row.items()}
@@ -2,13 +2,20 @@
 Autenticación: registro con verificación por correo (código enviado a @approx.es) y login (JWT).
 Usuarios en base de datos SQLite. Usa bcrypt directamente (compatible con bcrypt 5.x).
 """
+import asyncio
 import os
 import random
 import string
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import bcrypt
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from jose import jwt, JWTError
@@ -33,43 +40,206 @@ DEV_EMAIL_CODE_IN_RESPONSE = os.environ.get("DEV_EMAIL_CODE_IN_RESPONSE", "").lo
 SECRET_KEY = os.environ.get("JWT_SECRET", "garantia-sat-secret-cambiar-en-produccion")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 días
+# Token de un solo uso para abrir un stream SSE: EventSource no envía cabeceras y el token va en la URL, que acaba en
+# los logs de uvicorn y del proxy; así lo que queda en ellos no sirve para nada (ya usado o caducado)
+STREAM_TOKEN_EXPIRE_SECONDS = float(os.environ.get("AUTH_STREAM_TOKEN_EXPIRE_SECONDS", "60") or 60)
+# Segundos que se reutiliza el usuario resuelto (id, username, is_admin) sin volver a la BD; 0 = sin caché
+PRINCIPAL_TTL_SECONDS = float(os.environ.get("AUTH_PRINCIPAL_TTL_SECONDS", "30") or 0)
+# bcrypt en un pool propio y acotado: una ráfaga de logins no ocupa los hilos del resto de endpoints
+HASH_WORKERS = max(1, int(os.environ.get("AUTH_HASH_WORKERS", "2") or 2))
+HASH_QUEUE_MAX = max(1, int(os.environ.get("AUTH_HASH_QUEUE_MAX", "32") or 32))  # pendientes; más -> 503
+# Intentos de login por usuario en la ventana; al superarlos -> 429 (0 = sin límite)
+LOGIN_MAX_ATTEMPTS = int(os.environ.get("AUTH_LOGIN_MAX_ATTEMPTS", "10") or 0)
+LOGIN_WINDOW_SECONDS = float(os.environ.get("AUTH_LOGIN_WINDOW_SECONDS", "60") or 60)
 
 
 def _hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
 
 
-def get_password_hash(password: str) -> str:
-    """Hash de contraseña para uso desde otras rutas (p. ej. crear usuario desde Configuración)."""
-    return _hash_password(password)
-
-
 def _verify_password(password: str, password_hash: str) -> bool:
     if not password_hash:
         return False
     h = password_hash.encode("utf-8") if isinstance(password_hash, str) else password_hash
     return bcrypt.checkpw(password.encode("utf-8"), h)
 
+
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_lock = threading.Lock()
+_hash_stats = {"pending": 0, "peak": 0, "completed": 0, "rejected": 0}
+
+
+def _hash_done(_future: Future) -> None:
+    with _hash_lock:
+        _hash_stats["pending"] -= 1
+        _hash_stats["completed"] += 1
+
+
+def _submit_hash(fn, *args) -> Future:
+    """Encola fn (hash/verificación bcrypt) en el pool de hashing. Lanza 503 si la cola está llena."""
+    with _hash_lock:
+        if _hash_stats["pending"] >= HASH_QUEUE_MAX:
+            _hash_stats["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="El servidor está procesando muchos inicios de sesión. Inténtalo de nuevo en unos segundos.",
+                headers={"Retry-After": "2"},
+            )
+        _hash_stats["pending"] += 1
+        _hash_stats["peak"] = max(_hash_stats["peak"], _hash_stats["pending"])
+    future = _hash_executor.submit(fn, *args)
+    future.add_done_callback(_hash_done)
+    return future
+
+
+async def _run_hash(fn, *args):
+    """Versión para rutas async: espera al pool de hashing sin bloquear el bucle de eventos."""
+    return await asyncio.wrap_future(_submit_hash(fn, *args))
+
+
+def get_password_hash(password: str) -> str:
+    """Hash de contraseña para uso desde otras rutas (p. ej. crear usuario desde Configuración)."""
+    return _submit_hash(_hash_password, password).result()
+
+
+_login_attempts: dict[str, deque] = {}  # usuario (minúsculas) -> instantes de los intentos en la ventana
+_login_lock = threading.Lock()
+_login_rate_limited = 0
+
+
+def _check_login_rate(username: str) -> None:
+    """Registra un intento de login del usuario; 429 si ya agotó LOGIN_MAX_ATTEMPTS en la ventana."""
+    global _login_rate_limited
+    if LOGIN_MAX_ATTEMPTS <= 0:
+        return
+    key = (username or "").strip().lower()
+    now = time.monotonic()
+    with _login_lock:
+        for k in [k for k, q in _login_attempts.items() if not q or now - q[-1] >= LOGIN_WINDOW_SECONDS]:
+            del _login_attempts[k]
+        attempts = _login_attempts.setdefault(key, deque())
+        while attempts and now - attempts[0] >= LOGIN_WINDOW_SECONDS:
+            attempts.popleft()
+        if len(attempts) >= LOGIN_MAX_ATTEMPTS:
+            _login_rate_limited += 1
+            retry = max(1, int(LOGIN_WINDOW_SECONDS - (now - attempts[0])) + 1)
+            raise HTTPException(
+                status_code=429,
+                detail="Demasiados intentos de inicio de sesión. Espera un momento antes de volver a intentarlo.",
+                headers={"Retry-After": str(retry)},
+            )
+        attempts.append(now)
+
+
+def _reset_login_rate(username: str) -> None:
+    with _login_lock:
+        _login_attempts.pop((username or "").strip().lower(), None)
+
+
+def hash_pool_status() -> dict:
+    """Métricas del pool de bcrypt (profundidad de cola, pico, completadas, rechazadas) y del límite de login."""
+    with _hash_lock:
+        out = dict(_hash_stats)
+    with _login_lock:
+        out["login_rate_limited"] = _login_rate_limited
+        out["login_users_tracked"] = len(_login_attempts)
+    out["workers"] = HASH_WORKERS
+    out["queue_max"] = HASH_QUEUE_MAX
+    return out
+
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 _http_bearer = HTTPBearer(auto_error=True)
 
 
-def get_current_username(
-    credentials: HTTPAuthorizationCredentials = Depends(_http_bearer),
-) -> str:
-    """Obtiene el nombre de usuario del JWT (Bearer). Lanza 401 si no válido."""
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(
-            credentials.credentials,
+            token,
             SECRET_KEY,
             algorithms=[ALGORITHM],
         )
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=401, detail="Token inválido")
-        return str(username)
     except JWTError:
         raise HTTPException(status_code=401, detail="No autorizado")
+    if not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return payload
+
+
+def get_username_from_token(token: str) -> str:
+    """Nombre de usuario del JWT de sesión. Lanza 401 si no válido (un token de stream no sirve como sesión)."""
+    payload = _decode_token(token)
+    if payload.get("scope"):
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return str(payload["sub"])
+
+
+_used_stream_tokens: dict[str, float] = {}  # jti -> caducidad (epoch) de los tokens de stream ya usados
+_used_stream_tokens_lock = threading.Lock()
+
+
+def create_stream_token(username: str, scope: str) -> str:
+    """Token de un solo uso, válido STREAM_TOKEN_EXPIRE_SECONDS y solo para el stream indicado (scope)."""
+    expire = datetime.utcnow() + timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    payload = {"sub": username, "exp": expire, "scope": scope, "jti": uuid.uuid4().hex}
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def get_username_from_stream_token(token: str, scope: str) -> str:
+    """Nombre de usuario de un token de stream (create_stream_token). Lanza 401 si no es de ese stream o ya se usó."""
+    payload = _decode_token(token)
+    jti = payload.get("jti")
+    if payload.get("scope") != scope or not jti:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    now = time.time()
+    with _used_stream_tokens_lock:
+        for old in [k for k, exp in _used_stream_tokens.items() if exp < now]:
+            del _used_stream_tokens[old]
+        if jti in _used_stream_tokens:
+            raise HTTPException(status_code=401, detail="Token ya usado")
+        _used_stream_tokens[jti] = float(payload.get("exp") or now)
+    return str(payload["sub"])
+
+
+def get_current_username(
+    credentials: HTTPAuthorizationCredentials = Depends(_http_bearer),
+) -> str:
+    """Obtiene el nombre de usuario del JWT (Bearer). Lanza 401 si no válido."""
+    return get_username_from_token(credentials.credentials)
+
+
+_principals: dict[str, tuple[float, dict]] = {}  # username -> (cargado_en, {id, username, is_admin})
+_principals_lock = threading.Lock()
+
+
+def invalidate_principal(username: str | None = None) -> None:
+    """Olvida el usuario en caché (todos si username es None). Llamar tras modificar, borrar o cambiar contraseña."""
+    with _principals_lock:
+        if username is None:
+            _principals.clear()
+        else:
+            _principals.pop(username.strip(), None)
+
+
+def get_current_user(username: str = Depends(get_current_username)) -> dict:
+    """
+    Usuario actual como dict {id, username, is_admin}. Se guarda en memoria PRINCIPAL_TTL_SECONDS
+    para que las rutas frecuentes (notificaciones, push, ajustes) no repitan la consulta a users.
+    Lanza 404 si el usuario del token ya no existe.
+    """
+    now = time.monotonic()
+    with _principals_lock:
+        cached = _principals.get(username)
+        if cached and now - cached[0] < PRINCIPAL_TTL_SECONDS:
+            return cached[1]
+    with get_connection() as conn:
+        row = get_user_by_username(conn, username)
+    if not row:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    principal = {"id": row["id"], "username": row["username"], "is_admin": bool(row["is_admin"])}
+    if PRINCIPAL_TTL_SECONDS > 0:
+        with _principals_lock:
+            _principals[username] = (now, principal)
+    return principal
 
 
 class RegisterBody(BaseModel):
@@ -130,7 +300,7 @@ def register(body: RegisterBody):
 
         code = _generate_code(6)
         expires_at = (datetime.utcnow() + timedelta(minutes=CODE_EXPIRE_MINUTES)).strftime("%Y-%m-%d %H:%M:%S")
-        hashed = _hash_password(body.password)
+        hashed = get_password_hash(body.password)
         save_verification_code(conn, email_normalized, code, username_clean, hashed, expires_at)
 
     sent = False
@@ -177,12 +347,28 @@ def verify(body: VerifyBody):
     }
 
 
-@router.post("/login")
-def login(body: LoginBody):
+def _load_user(username: str):
+    """Lectura síncrona del usuario (get_connection inicializa el esquema): desde rutas async, en run_in_threadpool."""
     with get_connection() as conn:
-        user = get_user_by_username(conn, body.username)
-    if not user or not _verify_password(body.password, user["password_hash"]):
+        return get_user_by_username(conn, username)
+
+
+def _save_password_hash(username: str, password_hash: str) -> bool:
+    with get_connection() as conn:
+        return update_password_by_username(conn, username, password_hash)
+
+
+@router.post("/login")
+async def login(body: LoginBody):
+    """
+    Login con usuario y contraseña. La BD se consulta en el pool de hilos y bcrypt en el pool de hashing: el bucle
+    de eventos no se bloquea durante una ráfaga de logins. Límite de intentos por usuario.
+    """
+    _check_login_rate(body.username)
+    user = await run_in_threadpool(_load_user, body.username)
+    if not user or not await _run_hash(_verify_password, body.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Usuario o contraseña incorrectos")
+    _reset_login_rate(body.username)
     token = _create_token(user["username"])
     is_admin = bool(user["is_admin"]) if "is_admin" in user.keys() else False
     return {
@@ -194,15 +380,11 @@ def login(body: LoginBody):
 
 
 @router.get("/me")
-def me(username: str = Depends(get_current_username)):
+def me(user: dict = Depends(get_current_user)):
     """Devuelve el usuario actual (username, is_admin) para el frontend."""
-    with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return {
         "username": user["username"],
-        "is_admin": bool(user["is_admin"]) if "is_admin" in user.keys() else False,
+        "is_admin": user["is_admin"],
     }
 
 
@@ -212,18 +394,20 @@ class ChangePasswordBody(BaseModel):
 
 
 @router.post("/change-password")
-def change_password(
+async def change_password(
     body: ChangePasswordBody,
     username: str = Depends(get_current_username),
 ):
     """Cambia la contraseña del usuario actual. Requiere la contraseña actual."""
-    with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-        if not user or not _verify_password(body.current_password, user["password_hash"]):
-            raise HTTPException(status_code=401, detail="Contraseña actual incorrecta")
-        if not body.new_password or len(body.new_password.strip()) < 4:
-            raise HTTPException(status_code=400, detail="La nueva contraseña debe tener al menos 4 caracteres")
-        new_hash = _hash_password(body.new_password.strip())
-        if not update_password_by_username(conn, username, new_hash):
-            raise HTTPException(status_code=500, detail="Error al actualizar la contraseña")
+    _check_login_rate(username)
+    user = await run_in_threadpool(_load_user, username)
+    if not user or not await _run_hash(_verify_password, body.current_password, user["password_hash"]):
+        raise HTTPException(status_code=401, detail="Contraseña actual incorrecta")
+    _reset_login_rate(username)
+    if not body.new_password or len(body.new_password.strip()) < 4:
+        raise HTTPException(status_code=400, detail="La nueva contraseña debe tener al menos 4 caracteres")
+    new_hash = await _run_hash(_hash_password, body.new_password.strip())
+    if not await run_in_threadpool(_save_password_hash, username, new_hash):
+        raise HTTPException(status_code=500, detail="Error al actualizar la contraseña")
+    invalidate_principal(username)
     return {"message": "Contraseña actualizada"}
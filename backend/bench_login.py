@@ -0,0 +1,104 @@
+"""
+Prueba de carga de /api/auth/login (ráfaga de inicios de sesión) sin servidor: la app se llama en proceso con
+httpx.ASGITransport sobre una BD temporal (no toca garantia.db).
+Mide la latencia de los logins (p50/p99), la de peticiones ligeras (/api/auth/me) lanzadas durante la ráfaga y el
+retraso máximo del bucle de eventos (si algo síncrono lo bloquea, sube el retraso y el p99 de /me).
+Ejecutar desde la carpeta backend: python bench_login.py [logins] [peticiones_me]
+"""
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import bcrypt
+import httpx
+
+import database
+
+USERNAME = "bench"
+PASSWORD = "bench-password"
+
+
+def _pct(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _fmt(name: str, values: list[float]) -> str:
+    ms = [v * 1000 for v in values]
+    return f"{name}: n={len(ms)} p50={statistics.median(ms):.1f} ms p99={_pct(ms, 99):.1f} ms max={max(ms):.1f} ms"
+
+
+async def _timed(client: httpx.AsyncClient, method: str, url: str, out: list[float], statuses: dict, **kwargs) -> None:
+    t0 = time.perf_counter()
+    resp = await client.request(method, url, **kwargs)
+    out.append(time.perf_counter() - t0)
+    statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+
+async def _loop_lag(stop: asyncio.Event, lags: list[float], interval: float = 0.005) -> None:
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - t0 - interval)
+
+
+async def run(logins: int, me_requests: int) -> None:
+    from main import app
+    from auth import LOGIN_MAX_ATTEMPTS, hash_pool_status
+
+    with database.get_connection() as conn:
+        hashed = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        database.create_user(conn, USERNAME, hashed, f"{USERNAME}@approx.es")
+        # Usuarios distintos: el límite de intentos por usuario no debe cortar la ráfaga
+        for i in range(logins):
+            database.create_user(conn, f"{USERNAME}{i}", hashed, f"{USERNAME}{i}@approx.es")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        resp = await client.post("/api/auth/login", json={"username": USERNAME, "password": PASSWORD})
+        token = resp.json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        login_times: list[float] = []
+        me_times: list[float] = []
+        lags: list[float] = []
+        statuses: dict[int, int] = {}
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(_loop_lag(stop, lags))
+        t0 = time.perf_counter()
+        burst = [
+            _timed(client, "POST", "/api/auth/login", login_times, statuses,
+                   json={"username": f"{USERNAME}{i}", "password": PASSWORD})
+            for i in range(logins)
+        ]
+
+        async def me_probe() -> None:
+            for _ in range(me_requests):
+                await _timed(client, "GET", "/api/auth/me", me_times, {}, headers=headers)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*burst, me_probe())
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        await lag_task
+
+    print(f"Ráfaga de {logins} logins en {elapsed:.2f} s ({logins / elapsed:.1f} logins/s); respuestas: {statuses}")
+    print(_fmt("login", login_times))
+    print(_fmt("/api/auth/me durante la ráfaga", me_times))
+    print(f"retraso del bucle de eventos: max={max(lags) * 1000:.1f} ms p99={_pct(lags, 99) * 1000:.1f} ms")
+    print(f"pool de hashing: {hash_pool_status()} (límite de intentos por usuario: {LOGIN_MAX_ATTEMPTS})")
+
+
+def main() -> None:
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    me_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = Path(tmp) / "bench.db"
+        asyncio.run(run(logins, me_requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Medidas del escaneo de RMA especiales sobre una carpeta sintética (año / mes / RMA*.xlsx) y una BD temporal
+(no toca garantia.db ni la carpeta real).
+- scan: lectura de cada Excel como antes (pandas: hoja para el formato, rejilla de cabecera y hoja entera, tres
+  lecturas del libro) frente a _read_rma_especial_file (un solo _ExcelWorkbook por archivo). Comprueba que salen
+  las mismas líneas, cuenta cuántas veces se carga cada libro y mide el escaneo completo (primero y
+  repetido, con el manifiesto).
+- import: escritura en BD como antes (una get_connection por archivo, borrar el RMA e insertar las líneas de una en
+  una) frente a _write_rma_especial_imports por lotes de RMA_ESPECIALES_IMPORT_BATCH en una transacción (upsert).
+  Primera importación y reimportación con cambios (líneas modificadas, quitadas y añadidas); comprueba que las dos
+  BD quedan con los mismos RMA y líneas.
+Ejecutar desde la carpeta backend:
+  python bench_rma_especiales.py scan [archivos] [lineas_por_archivo]
+  python bench_rma_especiales.py import [rma] [lineas_por_rma]
+"""
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+from openpyxl import Workbook
+
+import database
+
+HEADER = ["Ref. proveedor", "Nº serie", "Fallo", "Resolución", "Observaciones"]
+HEADER_ROW = 1  # fila 0: título del documento, como en los Excel reales
+
+
+def _make_folder(base: Path, files: int, lines: int) -> list[Path]:
+    """Crea base / 2025 / MM / RMA25MMnnnnn.xlsx con un título, la cabecera y lines líneas."""
+    paths = []
+    for n in range(files):
+        month = f"{n % 12 + 1:02d}"
+        folder = base / "2025" / month
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"RMA25{month}{n:05d}.xlsx"
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("RMA")
+        ws.append([f"Devolución {path.stem}"])
+        ws.append(HEADER)
+        for i in range(lines):
+            ws.append([f"REF-{i % 50:03d}", f"SN{n:05d}{i:04d}", "No enciende" if i % 3 else "Pantalla rota",
+                       "Sustitución" if i % 2 else None, None])
+        wb.save(path)
+        paths.append(path)
+    return paths
+
+
+class _WorkbookLoads:
+    """Cuenta las veces que se carga un libro con openpyxl (pandas lo usa para cada lectura de un .xlsx)."""
+
+    def __init__(self):
+        self.count = 0
+        self._orig = openpyxl.load_workbook
+
+    def __enter__(self):
+        orig = self._orig
+
+        def counting_load(*args, **kwargs):
+            self.count += 1
+            return orig(*args, **kwargs)
+
+        openpyxl.load_workbook = counting_load
+        return self
+
+    def __exit__(self, *exc):
+        openpyxl.load_workbook = self._orig
+
+
+def _legacy_read(app_main, path: Path) -> list[dict]:
+    """Lectura anterior: formato (primeras filas), rejilla de cabecera otra vez y la hoja entera con header=None."""
+    g = app_main._read_excel_with_engine(str(path), sheet_name=0, header=None, nrows=20)
+    app_main._grid_from_df(g.replace({np.nan: None}), 20, 30)
+    g = app_main._read_excel_with_engine(str(path), sheet_name=0, header=None, nrows=20)
+    app_main._grid_from_df(g.replace({np.nan: None}), 20, 30)
+    df = app_main._read_excel_with_engine(str(path), sheet_name=0, header=None).replace({np.nan: None})
+    serial_col, fallo_col, resolucion_col = 1, 2, 3
+
+    def cell(ri: int, ci: int):
+        if ci < 0 or ci >= len(df.columns):
+            return None
+        v = df.iloc[ri, ci]
+        if v is None or (isinstance(v, float) and np.isnan(v)):
+            return None
+        return str(v).strip() or None
+
+    lineas = []
+    for ri in range(HEADER_ROW + 1, len(df)):
+        ref = None
+        for ci in range(len(df.columns)):
+            if ci in (serial_col, fallo_col, resolucion_col):
+                continue
+            ref = cell(ri, ci)
+            if ref:
+                break
+        lineas.append({"ref_proveedor": ref, "serial": cell(ri, serial_col), "fallo": cell(ri, fallo_col),
+                       "resolucion": cell(ri, resolucion_col)})
+    return lineas
+
+
+def bench_scan(files: int, lines: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = Path(tmp) / "bench.db"
+        import main as app_main
+
+        base = Path(tmp) / "rma_especiales"
+        t0 = time.perf_counter()
+        paths = _make_folder(base, files, lines)
+        print(f"{files} Excel de {lines} líneas generados en {time.perf_counter() - t0:.1f} s")
+        with database.get_connection() as conn:
+            database.add_rma_especial_format(conn, HEADER, 1, 2, 3, header_row=HEADER_ROW, sheet="0")
+            aliases = app_main._get_rma_especiales_aliases(conn)
+            formats = database.get_all_rma_especial_formats(conn)
+        index = app_main._FormatIndex(formats)
+
+        with _WorkbookLoads() as opens:
+            t0 = time.perf_counter()
+            legacy = [_legacy_read(app_main, p) for p in paths]
+            t_legacy = time.perf_counter() - t0
+        legacy_opens = opens.count
+        with _WorkbookLoads() as opens:
+            t0 = time.perf_counter()
+            items = [app_main._read_rma_especial_file(p, p.stem, aliases, index) for p in paths]
+            t_new = time.perf_counter() - t0
+        new_opens = opens.count
+        same = all(
+            "_import" in item and list(item["_import"]["lineas"]) == old for item, old in zip(items, legacy)
+        )
+        print(f"lectura anterior (3 lecturas pandas): {t_legacy:.2f} s, {legacy_opens / files:.1f} cargas del libro por archivo")
+        print(f"lectura con _ExcelWorkbook:            {t_new:.2f} s, {new_opens / files:.1f} cargas del libro por archivo")
+        print(f"aceleración: x{t_legacy / t_new:.1f}; mismas líneas: {same}")
+
+        t0 = time.perf_counter()
+        out = app_main._scan_rma_especiales_folder_impl(str(base), None)
+        t_scan = time.perf_counter() - t0
+        imported = sum(1 for item in out if item.get("imported"))
+        t0 = time.perf_counter()
+        app_main._scan_rma_especiales_folder_impl(str(base), None)
+        t_rescan = time.perf_counter() - t0
+        print(f"escaneo completo: {t_scan:.2f} s ({files / t_scan:.0f} archivos/s, {imported} importados, "
+              f"{app_main.RMA_ESPECIALES_SCAN_WORKERS} hilos de lectura); repetido sin cambios: {t_rescan:.2f} s")
+
+
+def _rmas(count: int, lines: int, reimport: bool = False) -> list[dict]:
+    """RMA ya leídos. En la reimportación cambia el fallo de una línea de cada 5, se quita la última y se añade otra."""
+    out = []
+    for n in range(count):
+        lineas = [
+            {"ref_proveedor": f"REF-{i % 50:03d}", "serial": f"SN{n:05d}{i:04d}",
+             "fallo": ("Revisado " if reimport and i % 5 == 0 else "") + ("No enciende" if i % 3 else "Pantalla rota"),
+             "resolucion": "Sustitución" if i % 2 else None}
+            for i in range(lines)
+        ]
+        if reimport:
+            lineas = lineas[:-1] + [{"ref_proveedor": "REF-NEW", "serial": f"SN{n:05d}NEW", "fallo": "Nuevo", "resolucion": None}]
+        out.append({"rma_number": f"RMA25{n:06d}", "source_path": f"/rma/2025/RMA25{n:06d}.xlsx", "lineas": lineas,
+                    "file_date": "2025-06-01T10:00:00" if not reimport else "2025-06-02T10:00:00"})
+    return out
+
+
+def _legacy_import(rmas: list[dict]) -> None:
+    """Escritura anterior: una conexión (con su _init_db) por archivo, borrar el RMA e insertar línea a línea."""
+    for rma in rmas:
+        with database.get_connection() as conn:
+            existing = database.get_rma_especial_by_rma_number(conn, rma["rma_number"])
+            if existing:
+                database.delete_rma_especial(conn, existing["id"])
+            cur = conn.execute(
+                "INSERT INTO rma_especiales (rma_number, source_path, estado, file_date) VALUES (?, ?, '', ?)",
+                (rma["rma_number"], rma["source_path"], rma["file_date"]),
+            )
+            for lin in rma["lineas"]:
+                conn.execute(
+                    """INSERT INTO rma_especial_lineas (rma_especial_id, ref_proveedor, serial, fallo, resolucion, estado)
+                       VALUES (?, ?, ?, ?, ?, '')""",
+                    (cur.lastrowid, *database._rma_especial_linea_values(lin)),
+                )
+
+
+def _batched_import(app_main, rmas: list[dict]) -> None:
+    """Escritura actual del escaneo: una conexión y un commit por lote de RMA_ESPECIALES_IMPORT_BATCH."""
+    items = [{"path": r["source_path"], "rma_number": r["rma_number"],
+              "_import": {"lineas": r["lineas"], "file_date": r["file_date"]}} for r in rmas]
+    batch = app_main.RMA_ESPECIALES_IMPORT_BATCH
+    with database.get_connection() as conn:
+        for i in range(0, len(items), batch):
+            part = items[i:i + batch]
+            app_main._write_rma_especial_imports(conn, part)
+            conn.commit()
+            failed = [item for item in part if not item.get("imported")]
+            if failed:
+                raise RuntimeError(f"{len(failed)} RMA sin importar: {failed[0].get('error')}")
+
+
+def _snapshot() -> list[tuple]:
+    """RMA y sus líneas (en orden de id) sin los ids, para comparar las dos BD."""
+    with database.get_connection() as conn:
+        rows = conn.execute(
+            """SELECT r.rma_number, r.source_path, r.file_date, l.ref_proveedor, l.serial, l.fallo, l.resolucion, l.estado
+               FROM rma_especiales r JOIN rma_especial_lineas l ON l.rma_especial_id = r.id
+               ORDER BY r.rma_number, l.id"""
+        ).fetchall()
+    return [tuple(r) for r in rows]
+
+
+def bench_import(count: int, lines: int) -> None:
+    first, second = _rmas(count, lines), _rmas(count, lines, reimport=True)
+    total_lines = sum(len(r["lineas"]) for r in first)
+    with tempfile.TemporaryDirectory() as tmp:
+        import main as app_main
+
+        times: dict[str, list[float]] = {}
+        snapshots = {}
+        for name, run in (("anterior", _legacy_import), ("por lotes", partial(_batched_import, app_main))):
+            database.DB_PATH = Path(tmp) / f"bench_{len(times)}.db"
+            with database.get_connection():
+                pass  # crea el esquema fuera de la medida
+            times[name] = []
+            for rmas in (first, second):
+                t0 = time.perf_counter()
+                run(rmas)
+                times[name].append(time.perf_counter() - t0)
+            snapshots[name] = _snapshot()
+    print(f"{count} RMA de {lines} líneas ({total_lines} líneas); lote: {app_main.RMA_ESPECIALES_IMPORT_BATCH} RMA por transacción")
+    for name, (t_first, t_second) in times.items():
+        print(f"{name:>9}: importación {t_first:.2f} s ({count / t_first:.0f} RMA/s, {total_lines / t_first:.0f} líneas/s), "
+              f"reimportación {t_second:.2f} s ({count / t_second:.0f} RMA/s)")
+    (old_first, old_second), (new_first, new_second) = times["anterior"], times["por lotes"]
+    print(f"aceleración: importación x{old_first / new_first:.1f}, reimportación x{old_second / new_second:.1f}; "
+          f"mismo resultado: {snapshots['anterior'] == snapshots['por lotes']} ({len(snapshots['por lotes'])} líneas)")
+
+
+def main() -> None:
+    mode = sys.argv[1] if len(sys.argv) > 1 else "scan"
+    if mode == "scan":
+        files = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+        lines = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+        bench_scan(files, lines)
+    elif mode == "import":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+        lines = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+        bench_import(count, lines)
+    else:
+        sys.exit(f"Modo desconocido: {mode} (usar scan o import)")
+
+
+if __name__ == "__main__":
+    main()
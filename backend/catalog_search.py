@@ -0,0 +1,166 @@
+"""
+Índice de búsqueda en memoria del catálogo de productos (se construye al refrescar el catálogo).
+- Prefijos de Nº serie base: claves normalizadas ordenadas + bisect (mismo resultado que un trie, sin nodos).
+- Búsqueda difusa por trigramas para series mal escritas (índice invertido trigrama -> productos).
+- "Contiene" con las mismas listas de trigramas: candidatos = intersección de las listas de los trigramas de la
+  búsqueda, y se comprueba la subcadena solo en esos (búsquedas de 1-2 caracteres: listas propias de subcadenas
+  cortas). No se recorre el catálogo entero en cada búsqueda.
+- Recuento por marca y por tipo (facetas) sobre el resultado filtrado, y paginación.
+Así Productos/Repuestos no necesitan descargar el catálogo entero para filtrar.
+"""
+from __future__ import annotations
+
+import bisect
+import re
+from collections import Counter, defaultdict
+
+FUZZY_MIN_SCORE = 0.5  # similitud mínima (Dice sobre trigramas) para aceptar una coincidencia difusa
+_NON_ALNUM = re.compile(r"[^0-9A-Z]+")
+
+
+def normalize_serial(value: str | None) -> str:
+    """Mayúsculas y solo letras/dígitos: 'app-500 /2' y 'APP500/2' se buscan igual."""
+    return _NON_ALNUM.sub("", (value or "").upper())
+
+
+def _trigrams(norm: str) -> set[str]:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _sorted_contains(ids: list[int], i: int) -> bool:
+    j = bisect.bisect_left(ids, i)
+    return j < len(ids) and ids[j] == i
+
+
+def _facet_key(value: str | None) -> str:
+    return (value or "").strip()
+
+
+class CatalogSearchIndex:
+    """Índice inmutable sobre una lista de productos (dicts de get_catalog_cache)."""
+
+    def __init__(self, productos: list[dict]):
+        self.productos = productos
+        self._norm = [normalize_serial(p.get("base_serial")) for p in productos]
+        self._keys = sorted((n, i) for i, n in enumerate(self._norm) if n)
+        self._key_strs = [k for k, _i in self._keys]
+        self._grams: dict[str, list[int]] = defaultdict(list)  # listas en orden creciente de id (bisect)
+        self._short: dict[str, list[int]] = defaultdict(list)  # subcadenas de 1-2 caracteres -> productos
+        self._gram_counts: list[int] = []
+        for i, n in enumerate(self._norm):
+            grams = _trigrams(n) if n else set()
+            self._gram_counts.append(len(grams))
+            for g in grams:
+                self._grams[g].append(i)
+            for sub in {n[j:j + k] for k in (1, 2) for j in range(len(n) - k + 1)}:
+                self._short[sub].append(i)
+        self._brand_lc = [_facet_key(p.get("brand")).lower() for p in productos]
+        self._type_lc = [_facet_key(p.get("product_type")).lower() for p in productos]
+
+    def __len__(self) -> int:
+        return len(self.productos)
+
+    def _prefix_ids(self, norm: str) -> list[int]:
+        lo = bisect.bisect_left(self._key_strs, norm)
+        hi = bisect.bisect_left(self._key_strs, norm + "\uffff")
+        return [i for _k, i in self._keys[lo:hi]]
+
+    def _substring_ids(self, norm: str) -> list[int]:
+        """Productos cuya serie contiene norm, sin recorrer el catálogo: se parte de la lista de trigramas más
+        corta, se descartan los que no están en las demás (bisect) y se comprueba la subcadena en los que quedan."""
+        if len(norm) < 3:
+            return list(self._short.get(norm, ()))
+        postings = sorted((self._grams.get(norm[j:j + 3], []) for j in range(len(norm) - 2)), key=len)
+        out = []
+        for i in postings[0]:
+            if all(_sorted_contains(ids, i) for ids in postings[1:]) and norm in self._norm[i]:
+                out.append(i)
+        return out
+
+    def _fuzzy_scores(self, norm: str) -> dict[int, float]:
+        """Similitud Dice de trigramas (2·comunes / (n_q + n_p)) para los productos que comparten alguno."""
+        q_grams = _trigrams(norm)
+        shared: Counter[int] = Counter()
+        for g in q_grams:
+            ids = self._grams.get(g)
+            if ids:
+                shared.update(ids)
+        nq = len(q_grams)
+        out = {}
+        for i, common in shared.items():
+            score = 2.0 * common / (nq + self._gram_counts[i])
+            if score >= FUZZY_MIN_SCORE:
+                out[i] = score
+        return out
+
+    def _match(self, q: str, fuzzy: bool) -> dict[int, float] | None:
+        """Productos que casan con la serie q -> puntuación (1 exacta, 0.9 prefijo, 0.8 contiene, <0.8 difusa).
+        None si no hay texto de búsqueda (todos los productos)."""
+        norm = normalize_serial(q)
+        if not norm:
+            return None
+        scores: dict[int, float] = {}
+        if fuzzy:
+            for i, s in self._fuzzy_scores(norm).items():
+                scores[i] = min(s, 0.79)
+        for i in self._substring_ids(norm):
+            scores[i] = 0.8
+        for i in self._prefix_ids(norm):
+            scores[i] = 1.0 if self._norm[i] == norm else 0.9
+        return scores
+
+    def search(
+        self,
+        q: str = "",
+        brand: str = "",
+        product_type: str = "",
+        limit: int = 20,
+        offset: int = 0,
+        fuzzy: bool = True,
+    ) -> dict:
+        """
+        Busca por serie (q) y filtra por marca y tipo (contiene, sin distinguir mayúsculas, como los filtros de la vista).
+        Las facetas de marca se cuentan sin aplicar el filtro de marca (y las de tipo sin el de tipo), para
+        poder mostrar cuántos productos habría al cambiar de marca/tipo.
+        """
+        scores = self._match(q, fuzzy)
+        ids = range(len(self.productos)) if scores is None else scores.keys()
+        brand_lc = _facet_key(brand).lower()
+        type_lc = _facet_key(product_type).lower()
+
+        brand_facets: Counter[str] = Counter()
+        type_facets: Counter[str] = Counter()
+        hits = []
+        for i in ids:
+            brand_ok = not brand_lc or brand_lc in self._brand_lc[i]
+            type_ok = not type_lc or type_lc in self._type_lc[i]
+            if type_ok:
+                brand_facets[_facet_key(self.productos[i].get("brand"))] += 1
+            if brand_ok:
+                type_facets[_facet_key(self.productos[i].get("product_type"))] += 1
+            if brand_ok and type_ok:
+                hits.append(i)
+
+        if scores is None:
+            hits.sort(key=lambda i: (self._norm[i], i))
+        else:
+            hits.sort(key=lambda i: (-scores[i], self._norm[i], i))
+        limit = max(1, limit)
+        offset = max(0, offset)
+        page = []
+        for i in hits[offset:offset + limit]:
+            item = dict(self.productos[i])
+            if scores is not None:
+                item["score"] = round(scores[i], 3)
+            page.append(item)
+        return {
+            "total": len(hits),
+            "limit": limit,
+            "offset": offset,
+            "productos": page,
+            "facets": {
+                "brand": [{"value": k, "count": c} for k, c in sorted(brand_facets.items())],
+                "product_type": [{"value": k, "count": c} for k, c in sorted(type_facets.items())],
+            },
+        }
@@ -2,7 +2,14 @@
 Base de datos SQLite para la aplicación.
 - users: usuarios (correo @approx.es).
 - rma_items: líneas RMA (productos, clientes, estado, ocultos). Sincronización con Excel añade solo registros nuevos.
-- catalog_cache: caché del catálogo de productos (QNAP) para no rescanearlo cada vez.
+- catalog_cache: fecha del último escaneo del catálogo de productos (QNAP).
+- catalog_products: productos del catálogo (una fila por Marca|Nº serie base) para no rescanearlo cada vez.
+- rma_especial_scan_manifest: último resultado del escaneo por Excel de RMA especiales (tamaño, mtime) para no reabrir
+  archivos sin cambios.
+- rma_especial_scan_results: entradas de cada escaneo de RMA especiales (se consultan paginadas por scan_id).
+- rma_especial_header_grids: primeras filas de cada hoja leída de los Excel de RMA especiales (recheck sin abrirlos).
+- rma_especial_estado_counts: líneas por estado de cada RMA especial, mantenida por triggers sobre rma_especial_lineas.
+- atractor_cache: respuestas del informe de ventas de Atractor por (URL, usuario, desde, hasta), con caducidad.
 """
 import json
 import math
@@ -11,6 +18,7 @@ import sqlite3
 import unicodedata
 from contextlib import contextmanager
 from datetime import date, datetime
+from itertools import islice
 from pathlib import Path
 
 DB_PATH = Path(__file__).resolve().parent / "garantia.db"
@@ -237,6 +245,28 @@ def _init_db(conn: sqlite3.Connection):
     rma_cols = [row[1] for row in conn.execute("PRAGMA table_info(rma_especiales)").fetchall()]
     if "file_date" not in rma_cols:
         conn.execute("ALTER TABLE rma_especiales ADD COLUMN file_date TEXT")
+    # Catálogo normalizado: una fila por producto (clave Marca|Nº serie base) en lugar de un JSON en catalog_cache
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_products (
+            product_ref TEXT PRIMARY KEY,
+            brand TEXT,
+            base_serial TEXT,
+            product_type TEXT,
+            product_type_manual INTEGER NOT NULL DEFAULT 0,
+            creation_date TEXT,
+            folder_rel TEXT,
+            excel_rel TEXT,
+            visual_pdf_rel TEXT,
+            visual_excel_rel TEXT,
+            position INTEGER NOT NULL DEFAULT 0,
+            scan_gen INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_products_type ON catalog_products(product_type)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_products_brand ON catalog_products(brand)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_products_pdf ON catalog_products(visual_pdf_rel)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_catalog_products_excel ON catalog_products(visual_excel_rel)")
+    _migrate_catalog_cache_blob(conn)
     # Formatos RMA especiales: firma de cabecera (celdas de la fila) + índices de columna para serial/fallo/resolución
     conn.execute("""
         CREATE TABLE IF NOT EXISTS rma_especial_formats (
@@ -250,6 +280,64 @@ def _init_db(conn: sqlite3.Connection):
             created_at TEXT NOT NULL DEFAULT (datetime('now'))
         )
     """)
+    # Manifiesto del escaneo de RMA especiales: tamaño y mtime de cada Excel y resultado con el que se evaluó.
+    # config_sig: firma de formatos + aliases usada (si cambia, los no reconocidos se vuelven a leer).
+    # result: JSON de la entrada del escaneo (no reconocidos) para devolverla sin abrir el Excel.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rma_especial_scan_manifest (
+            path TEXT PRIMARY KEY,
+            rma_number TEXT,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            outcome TEXT NOT NULL,
+            config_sig TEXT,
+            result TEXT,
+            scanned_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    """)
+    # Resultado de cada escaneo de RMA especiales (una fila por entrada, en el orden del listado).
+    # status: imported | missing (formato no reconocido) | error | ready (columnas reconocidas, falta importar).
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rma_especial_scan_results (
+            scan_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            rma_number TEXT,
+            status TEXT NOT NULL,
+            item TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (scan_id, seq)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_rma_especial_scan_results_status ON rma_especial_scan_results(scan_id, status, seq)"
+    )
+    # Caché de informes de Atractor. key: hash de (URL, usuario, desde, hasta); tiempos en segundos epoch.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS atractor_cache (
+            key TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            desde TEXT NOT NULL,
+            hasta TEXT NOT NULL,
+            body TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            fetched_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_atractor_cache_accessed ON atractor_cache(accessed_at)")
+    # Rejillas de cabecera (primeras filas/columnas) de cada Excel de RMA especiales, guardadas al escanear o previsualizar.
+    # sheet_names: JSON con los nombres de hojas; grids: JSON {"índice de hoja": [[celda, ...], ...]}.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rma_especial_header_grids (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            sheet_names TEXT,
+            grids TEXT NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    """)
     # Migraciones adicionales
     linea_cols = [row[1] for row in conn.execute("PRAGMA table_info(rma_especial_lineas)").fetchall()]
     if "estado" not in linea_cols:
@@ -260,6 +348,216 @@ def _init_db(conn: sqlite3.Connection):
         conn.execute("ALTER TABLE rma_especial_formats ADD COLUMN header_row INTEGER NOT NULL DEFAULT 0")
     if "sheet" not in fmt_cols:
         conn.execute("ALTER TABLE rma_especial_formats ADD COLUMN sheet TEXT")
+    _init_rma_especial_estado_counts(conn)
+    _init_notification_unread_counts(conn)
+    _init_notification_inbox_indexes(conn)
+    _run_data_migrations(conn)
+
+
+def _init_notification_inbox_indexes(conn: sqlite3.Connection) -> None:
+    """
+    Índices compuestos para paginar bandejas por cursor (created_at, id) con el filtro de categoría dentro del índice,
+    y tabla fría notifications_archive para los mensajes leídos antiguos (ver archive_old_notifications).
+    Borrado lógico: el '' antiguo se normaliza a NULL una sola vez (_DATA_MIGRATIONS) para que el índice del
+    remitente sirva con IS NULL / IS NOT NULL.
+    """
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_notifications_inbox ON notifications(to_user_id, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_notifications_inbox_cat ON notifications(to_user_id, category, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_notifications_sent
+            ON notifications(from_user_id, deleted_by_sender_at, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_notifications_sent_cat
+            ON notifications(from_user_id, category, deleted_by_sender_at, created_at, id);
+
+        CREATE TABLE IF NOT EXISTS notifications_archive (
+            id INTEGER PRIMARY KEY,
+            from_user_id INTEGER NOT NULL,
+            to_user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL DEFAULT 'sin_categoria',
+            reference_data TEXT NOT NULL,
+            message TEXT,
+            created_at TEXT NOT NULL,
+            read_at TEXT,
+            deleted_by_sender_at TEXT,
+            archived_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_notifications_archive_inbox
+            ON notifications_archive(to_user_id, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_notifications_archive_sent
+            ON notifications_archive(from_user_id, created_at, id);
+    """)
+
+
+def _init_notification_unread_counts(conn: sqlite3.Connection) -> None:
+    """
+    Contador de notificaciones sin leer por usuario (consulta O(1) para la barra de navegación).
+    Lo mantienen triggers sobre notifications; al crearlo por primera vez se rellena con las existentes.
+    version sube con cada cambio del contador: quien lo difunde (SSE) descarta valores leídos antes que uno ya enviado.
+    """
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notifications_to_user_read ON notifications(to_user_id, read_at)"
+    )
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notification_unread_counts'"
+    ).fetchone()
+    if exists is None:
+        conn.execute("""
+            CREATE TABLE notification_unread_counts (
+                user_id INTEGER PRIMARY KEY,
+                n INTEGER NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("""
+            INSERT INTO notification_unread_counts (user_id, n)
+            SELECT to_user_id, COUNT(*) FROM notifications WHERE read_at IS NULL GROUP BY to_user_id
+        """)
+    elif "version" not in [row[1] for row in conn.execute("PRAGMA table_info(notification_unread_counts)").fetchall()]:
+        # Migración: columna version; los triggers antiguos no la suben, se vuelven a crear abajo
+        conn.execute("ALTER TABLE notification_unread_counts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        conn.executescript("""
+            DROP TRIGGER IF EXISTS trg_notifications_unread_ins;
+            DROP TRIGGER IF EXISTS trg_notifications_unread_del;
+            DROP TRIGGER IF EXISTS trg_notifications_unread_upd;
+        """)
+    conn.executescript("""
+        CREATE TRIGGER IF NOT EXISTS trg_notifications_unread_ins
+        AFTER INSERT ON notifications
+        WHEN NEW.read_at IS NULL
+        BEGIN
+            INSERT INTO notification_unread_counts (user_id, n, version) VALUES (NEW.to_user_id, 1, 1)
+            ON CONFLICT(user_id) DO UPDATE SET n = n + 1, version = version + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_notifications_unread_del
+        AFTER DELETE ON notifications
+        WHEN OLD.read_at IS NULL
+        BEGIN
+            UPDATE notification_unread_counts SET n = n - 1, version = version + 1 WHERE user_id = OLD.to_user_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_notifications_unread_upd
+        AFTER UPDATE OF read_at, to_user_id ON notifications
+        WHEN (OLD.read_at IS NULL) != (NEW.read_at IS NULL) OR OLD.to_user_id != NEW.to_user_id
+        BEGIN
+            UPDATE notification_unread_counts SET n = n - 1, version = version + 1
+            WHERE user_id = OLD.to_user_id AND OLD.read_at IS NULL;
+            INSERT INTO notification_unread_counts (user_id, n, version)
+            SELECT NEW.to_user_id, 1, 1 WHERE NEW.read_at IS NULL
+            ON CONFLICT(user_id) DO UPDATE SET n = n + 1, version = version + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_users_unread_counts_del
+        AFTER DELETE ON users
+        BEGIN
+            DELETE FROM notification_unread_counts WHERE user_id = OLD.id;
+        END;
+    """)
+
+
+def _init_rma_especial_estado_counts(conn: sqlite3.Connection) -> None:
+    """
+    Resumen de líneas por estado de cada RMA especial (estado '' = sin asignar) para la lista, sin leer las líneas.
+    Lo mantienen triggers sobre rma_especial_lineas; al crearlo por primera vez se rellena con las líneas existentes.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rma_especial_estado_counts'"
+    ).fetchone()
+    if exists is None:
+        conn.execute("""
+            CREATE TABLE rma_especial_estado_counts (
+                rma_especial_id INTEGER NOT NULL,
+                estado TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (rma_especial_id, estado)
+            )
+        """)
+        conn.execute("""
+            INSERT INTO rma_especial_estado_counts (rma_especial_id, estado, n)
+            SELECT rma_especial_id, COALESCE(estado, ''), COUNT(*) FROM rma_especial_lineas
+            GROUP BY rma_especial_id, COALESCE(estado, '')
+        """)
+    conn.executescript("""
+        CREATE TRIGGER IF NOT EXISTS trg_rma_especial_lineas_estado_ins
+        AFTER INSERT ON rma_especial_lineas
+        BEGIN
+            INSERT INTO rma_especial_estado_counts (rma_especial_id, estado, n)
+            VALUES (NEW.rma_especial_id, COALESCE(NEW.estado, ''), 1)
+            ON CONFLICT(rma_especial_id, estado) DO UPDATE SET n = n + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_rma_especial_lineas_estado_del
+        AFTER DELETE ON rma_especial_lineas
+        BEGIN
+            UPDATE rma_especial_estado_counts SET n = n - 1
+            WHERE rma_especial_id = OLD.rma_especial_id AND estado = COALESCE(OLD.estado, '');
+            DELETE FROM rma_especial_estado_counts
+            WHERE rma_especial_id = OLD.rma_especial_id AND estado = COALESCE(OLD.estado, '') AND n <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_rma_especial_lineas_estado_upd
+        AFTER UPDATE OF estado, rma_especial_id ON rma_especial_lineas
+        WHEN COALESCE(OLD.estado, '') != COALESCE(NEW.estado, '') OR OLD.rma_especial_id != NEW.rma_especial_id
+        BEGIN
+            UPDATE rma_especial_estado_counts SET n = n - 1
+            WHERE rma_especial_id = OLD.rma_especial_id AND estado = COALESCE(OLD.estado, '');
+            DELETE FROM rma_especial_estado_counts
+            WHERE rma_especial_id = OLD.rma_especial_id AND estado = COALESCE(OLD.estado, '') AND n <= 0;
+            INSERT INTO rma_especial_estado_counts (rma_especial_id, estado, n)
+            VALUES (NEW.rma_especial_id, COALESCE(NEW.estado, ''), 1)
+            ON CONFLICT(rma_especial_id, estado) DO UPDATE SET n = n + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_rma_especiales_estado_counts_del
+        AFTER DELETE ON rma_especiales
+        BEGIN
+            DELETE FROM rma_especial_estado_counts WHERE rma_especial_id = OLD.id;
+        END;
+    """)
+
+
+def _migrate_catalog_cache_blob(conn: sqlite3.Connection) -> None:
+    """Migración: pasa el JSON antiguo de catalog_cache a catalog_products (solo una vez; luego data queda en '[]')."""
+    row = conn.execute(
+        "SELECT data FROM catalog_cache WHERE key = ? AND data != '[]'",
+        (_CATALOG_CACHE_KEY,),
+    ).fetchone()
+    if row is None:
+        return
+    try:
+        productos = json.loads(row[0]) if row[0] else []
+    except (TypeError, json.JSONDecodeError):
+        productos = []
+    if not isinstance(productos, list):
+        productos = []
+    # Los tipos asignados a mano no se distinguían en el JSON: se marcan como manuales los que no
+    # coinciden con el tipo que da la carpeta (segundo nivel de folder_rel), para que un reescaneo no los pise.
+    for p in productos:
+        parts = [x for x in (p.get("folder_rel") or "").split("/") if x]
+        folder_type = parts[1] if len(parts) >= 3 else None
+        p["product_type_manual"] = (p.get("product_type") or None) != folder_type
+    _upsert_catalog_products(conn, productos, scan_gen=1)
+    conn.execute("UPDATE catalog_cache SET data = '[]' WHERE key = ?", (_CATALOG_CACHE_KEY,))
+
+
+# Migraciones de datos que recorren tablas enteras: se aplican una sola vez y PRAGMA user_version guarda la última
+# aplicada (se escribe en la misma transacción, así que si algo falla se repite en la siguiente conexión).
+_DATA_MIGRATIONS = (
+    # 1: product_type recortado y NULL en lugar de vacío (las consultas por tipo comparan la columna y usan su índice)
+    "UPDATE catalog_products SET product_type = NULLIF(TRIM(product_type), '') WHERE product_type != TRIM(product_type) OR product_type = ''",
+    # 2: borrado lógico del remitente como NULL / fecha, nunca '' (ver _init_notification_inbox_indexes)
+    "UPDATE notifications SET deleted_by_sender_at = NULL WHERE deleted_by_sender_at = ''",
+)
+
+
+def _run_data_migrations(conn: sqlite3.Connection) -> None:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(_DATA_MIGRATIONS):
+        return
+    for sql in _DATA_MIGRATIONS[version:]:
+        conn.execute(sql)
+    conn.execute(f"PRAGMA user_version = {len(_DATA_MIGRATIONS)}")
 
 
 @contextmanager
@@ -401,23 +699,66 @@ def delete_user(conn: sqlite3.Connection, user_id: int) -> bool:
 # --- Notificaciones (compartir fila con otro usuario) ---
 
 
+NOTIFICATIONS_PAGE_SIZE = 50
+_NOTIFICATION_TABLES = {False: "notifications", True: "notifications_archive"}
+
+
+def _notification_cursor(row) -> str:
+    """Cursor opaco de la siguiente página: created_at|id del último elemento devuelto."""
+    return f"{row['created_at']}|{row['id']}"
+
+
+def _parse_notification_cursor(cursor: str | None) -> tuple[str, int] | None:
+    if not cursor or "|" not in cursor:
+        return None
+    created_at, _sep, nid = cursor.rpartition("|")
+    try:
+        return created_at, int(nid)
+    except ValueError:
+        return None
+
+
+def _notifications_page(
+    conn: sqlite3.Connection, q: str, params: list, limit: int, cursor: str | None
+) -> tuple[list[sqlite3.Row], str | None]:
+    """Añade el cursor (created_at, id) descendente y el límite; devuelve (filas, cursor siguiente o None)."""
+    after = _parse_notification_cursor(cursor)
+    if after is not None:
+        q += " AND (n.created_at < ? OR (n.created_at = ? AND n.id < ?))"
+        params.extend([after[0], after[0], after[1]])
+    q += " ORDER BY n.created_at DESC, n.id DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = conn.execute(q, params).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, _notification_cursor(rows[-1])
+    return rows, None
+
+
 def get_notifications_for_user(
-    conn: sqlite3.Connection, to_user_id: int, category: str | None = None
-) -> list[dict]:
-    """Lista notificaciones recibidas por el usuario, con from_username. Opcionalmente filtradas por category (abono, envio, sin_categoria)."""
-    q = """SELECT n.id, n.from_user_id, n.to_user_id, n.type, n.category, n.reference_data, n.message, n.created_at, n.read_at,
+    conn: sqlite3.Connection,
+    to_user_id: int,
+    category: str | None = None,
+    limit: int = NOTIFICATIONS_PAGE_SIZE,
+    cursor: str | None = None,
+    archived: bool = False,
+) -> tuple[list[dict], str | None]:
+    """Página de notificaciones recibidas por el usuario, con from_username, más recientes primero.
+    Opcionalmente filtradas por category (abono, envio, sin_categoria). cursor: el devuelto por la página anterior.
+    archived=True lee de la tabla fría (mensajes leídos antiguos). Devuelve (items, next_cursor)."""
+    table = _NOTIFICATION_TABLES[bool(archived)]
+    q = f"""SELECT n.id, n.from_user_id, n.to_user_id, n.type, n.category, n.reference_data, n.message, n.created_at, n.read_at,
                   u.username AS from_username
-           FROM notifications n
+           FROM {table} n
            JOIN users u ON u.id = n.from_user_id
            WHERE n.to_user_id = ?"""
     params: list = [to_user_id]
     if category and category.strip():
         q += " AND n.category = ?"
         params.append(category.strip())
-    q += " ORDER BY n.created_at DESC"
-    cur = conn.execute(q, params)
+    rows, next_cursor = _notifications_page(conn, q, params, limit, cursor)
     out = []
-    for row in cur.fetchall():
+    for row in rows:
         out.append({
             "id": row["id"],
             "from_user_id": row["from_user_id"],
@@ -430,7 +771,7 @@ def get_notifications_for_user(
             "created_at": row["created_at"],
             "read_at": row["read_at"],
         })
-    return out
+    return out, next_cursor
 
 
 def get_notifications_sent_by_user(
@@ -438,27 +779,30 @@ def get_notifications_sent_by_user(
     from_user_id: int,
     category: str | None = None,
     deleted_only: bool = False,
-) -> list[dict]:
-    """Lista notificaciones enviadas por el usuario, con to_username. Opcionalmente filtradas por category.
-    deleted_only=True: solo las que el remitente ha borrado (bandeja de borrados)."""
-    q = """SELECT n.id, n.from_user_id, n.to_user_id, n.type, n.category, n.reference_data, n.message, n.created_at, n.read_at,
+    limit: int = NOTIFICATIONS_PAGE_SIZE,
+    cursor: str | None = None,
+    archived: bool = False,
+) -> tuple[list[dict], str | None]:
+    """Página de notificaciones enviadas por el usuario, con to_username. Opcionalmente filtradas por category.
+    deleted_only=True: solo las que el remitente ha borrado (bandeja de borrados). Devuelve (items, next_cursor)."""
+    table = _NOTIFICATION_TABLES[bool(archived)]
+    q = f"""SELECT n.id, n.from_user_id, n.to_user_id, n.type, n.category, n.reference_data, n.message, n.created_at, n.read_at,
                   n.deleted_by_sender_at,
                   u.username AS to_username
-           FROM notifications n
+           FROM {table} n
            JOIN users u ON u.id = n.to_user_id
            WHERE n.from_user_id = ?"""
     params: list = [from_user_id]
-    if deleted_only:
-        q += " AND n.deleted_by_sender_at IS NOT NULL AND n.deleted_by_sender_at != ''"
-    else:
-        q += " AND (n.deleted_by_sender_at IS NULL OR n.deleted_by_sender_at = '')"
     if category and category.strip():
         q += " AND n.category = ?"
         params.append(category.strip())
-    q += " ORDER BY n.created_at DESC"
-    cur = conn.execute(q, params)
+    if deleted_only:
+        q += " AND n.deleted_by_sender_at IS NOT NULL"
+    else:
+        q += " AND n.deleted_by_sender_at IS NULL"
+    rows, next_cursor = _notifications_page(conn, q, params, limit, cursor)
     out = []
-    for row in cur.fetchall():
+    for row in rows:
         out.append({
             "id": row["id"],
             "from_user_id": row["from_user_id"],
@@ -472,16 +816,51 @@ def get_notifications_sent_by_user(
             "read_at": row["read_at"],
             "deleted_by_sender_at": row["deleted_by_sender_at"],
         })
-    return out
+    return out, next_cursor
+
+
+def archive_old_notifications(conn: sqlite3.Connection, older_than_days: int, batch: int = 1000) -> int:
+    """
+    Mueve a notifications_archive las notificaciones leídas cuya lectura tiene más de older_than_days días.
+    Las no leídas nunca se archivan (el contador de no leídas no cambia). Por lotes; devuelve cuántas movió.
+    """
+    if older_than_days <= 0:
+        return 0
+    cutoff = f"-{int(older_than_days)} days"
+    moved = 0
+    while True:
+        ids = [
+            r[0] for r in conn.execute(
+                """SELECT id FROM notifications
+                   WHERE read_at IS NOT NULL AND read_at < datetime('now', ?)
+                   LIMIT ?""",
+                (cutoff, batch),
+            ).fetchall()
+        ]
+        if not ids:
+            return moved
+        marks = ",".join("?" * len(ids))
+        conn.execute(
+            f"""INSERT OR REPLACE INTO notifications_archive
+                    (id, from_user_id, to_user_id, type, category, reference_data, message, created_at, read_at,
+                     deleted_by_sender_at)
+                SELECT id, from_user_id, to_user_id, type, category, reference_data, message, created_at, read_at,
+                       deleted_by_sender_at
+                FROM notifications WHERE id IN ({marks})""",
+            ids,
+        )
+        conn.execute(f"DELETE FROM notifications WHERE id IN ({marks})", ids)
+        moved += len(ids)
 
 
 def count_unread_notifications(conn: sqlite3.Connection, to_user_id: int) -> int:
-    """Cuenta notificaciones no leídas del usuario."""
+    """Cuenta notificaciones no leídas del usuario (contador mantenido por triggers, sin COUNT(*))."""
     cur = conn.execute(
-        "SELECT COUNT(*) FROM notifications WHERE to_user_id = ? AND read_at IS NULL",
+        "SELECT n FROM notification_unread_counts WHERE user_id = ?",
         (to_user_id,),
     )
-    return cur.fetchone()[0] or 0
+    row = cur.fetchone()
+    return max(0, row[0]) if row else 0
 
 
 def create_notification(
@@ -505,6 +884,64 @@ def create_notification(
     return cur.lastrowid
 
 
+def create_notifications(
+    conn: sqlite3.Connection,
+    from_user_id: int,
+    to_user_ids: list[int],
+    type_: str,
+    reference_data: str,
+    message: str | None = None,
+    category: str = "sin_categoria",
+) -> dict[int, int]:
+    """
+    Crea la misma notificación para varios destinatarios con un INSERT de varias filas por bloque; los ids salen
+    del propio INSERT (RETURNING), sin suponer nada de otras inserciones. Devuelve {to_user_id: id}.
+    """
+    if not to_user_ids:
+        return {}
+    cat = (category or "sin_categoria").strip() or "sin_categoria"
+    if cat not in ("abono", "envio", "sin_categoria", "fuera_garantia"):
+        cat = "sin_categoria"
+    msg = (message or "").strip() or None
+    out: dict[int, int] = {}
+    chunk_rows = _SQL_IN_CHUNK // 6  # 6 parámetros por fila
+    for i in range(0, len(to_user_ids), chunk_rows):
+        chunk = to_user_ids[i:i + chunk_rows]
+        params = [v for uid in chunk for v in (from_user_id, uid, type_, cat, reference_data, msg)]
+        rows = conn.execute(
+            f"""INSERT INTO notifications (from_user_id, to_user_id, type, category, reference_data, message)
+                VALUES {",".join(["(?, ?, ?, ?, ?, ?)"] * len(chunk))}
+                RETURNING id, to_user_id""",
+            params,
+        ).fetchall()
+        out.update({row["to_user_id"]: row["id"] for row in rows})
+    return out
+
+
+def get_unread_count_version(conn: sqlite3.Connection, to_user_id: int) -> tuple[int, int]:
+    """(no leídas, versión del contador) del usuario; (0, 0) si nunca ha tenido."""
+    row = conn.execute(
+        "SELECT n, version FROM notification_unread_counts WHERE user_id = ?",
+        (to_user_id,),
+    ).fetchone()
+    return (max(0, row["n"]), row["version"]) if row else (0, 0)
+
+
+def get_unread_counts_for_users(conn: sqlite3.Connection, user_ids: list[int]) -> dict[int, tuple[int, int]]:
+    """(no leídas, versión del contador) de varios usuarios en una consulta ((0, 0) si no tienen)."""
+    if not user_ids:
+        return {}
+    marks = ",".join("?" * len(user_ids))
+    cur = conn.execute(
+        f"SELECT user_id, n, version FROM notification_unread_counts WHERE user_id IN ({marks})",
+        list(user_ids),
+    )
+    out = {uid: (0, 0) for uid in user_ids}
+    for row in cur.fetchall():
+        out[row["user_id"]] = (max(0, row["n"]), row["version"])
+    return out
+
+
 def mark_notification_read(conn: sqlite3.Connection, notification_id: int, to_user_id: int) -> bool:
     """Marca una notificación como leída si pertenece al usuario. Devuelve True si se actualizó."""
     cur = conn.execute(
@@ -520,7 +957,7 @@ def soft_delete_notification_by_sender(
     """Marca la notificación como borrada por el remitente (va a bandeja de borrados). Solo el remitente puede borrar. Devuelve True si se actualizó."""
     cur = conn.execute(
         """UPDATE notifications SET deleted_by_sender_at = datetime('now')
-           WHERE id = ? AND from_user_id = ? AND (deleted_by_sender_at IS NULL OR deleted_by_sender_at = '')""",
+           WHERE id = ? AND from_user_id = ? AND deleted_by_sender_at IS NULL""",
         (notification_id, from_user_id),
     )
     return cur.rowcount > 0
@@ -569,12 +1006,42 @@ def get_push_subscriptions_for_user(conn: sqlite3.Connection, user_id: int) -> l
     ]
 
 
+def get_push_subscriptions_for_users(conn: sqlite3.Connection, user_ids: list[int]) -> list[dict]:
+    """Suscripciones push de varios usuarios en una consulta (envío de una notificación a varios destinatarios)."""
+    if not user_ids:
+        return []
+    marks = ",".join("?" * len(user_ids))
+    cur = conn.execute(
+        f"SELECT endpoint, p256dh, auth FROM push_subscriptions WHERE user_id IN ({marks})",
+        list(user_ids),
+    )
+    return [
+        {"endpoint": row["endpoint"], "keys": {"p256dh": row["p256dh"], "auth": row["auth"]}}
+        for row in cur.fetchall()
+    ]
+
+
+def delete_push_subscription(conn: sqlite3.Connection, endpoint: str) -> bool:
+    """Borra una suscripción push (p. ej. caducada: el servicio push respondió 404/410). True si existía."""
+    cur = conn.execute("DELETE FROM push_subscriptions WHERE endpoint = ?", (endpoint.strip(),))
+    return cur.rowcount > 0
+
+
 def get_user_by_id(conn: sqlite3.Connection, user_id: int) -> sqlite3.Row | None:
     """Obtiene un usuario por id."""
     cur = conn.execute("SELECT id, username FROM users WHERE id = ?", (user_id,))
     return cur.fetchone()
 
 
+def get_users_by_ids(conn: sqlite3.Connection, user_ids: list[int]) -> dict[int, sqlite3.Row]:
+    """Usuarios (id, username) de una lista de ids en una consulta. Los que no existen no aparecen."""
+    if not user_ids:
+        return {}
+    marks = ",".join("?" * len(user_ids))
+    cur = conn.execute(f"SELECT id, username FROM users WHERE id IN ({marks})", list(user_ids))
+    return {row["id"]: row for row in cur.fetchall()}
+
+
 # --- Códigos de verificación por correo ---
 
 
@@ -1129,16 +1596,22 @@ def set_serial_warranty(
 
 
 def get_all_rma_especiales(conn: sqlite3.Connection) -> list[dict]:
-    """Lista todos los RMA especiales con número de líneas. Orden: más recientes primero."""
+    """
+    Lista todos los RMA especiales con número de líneas y líneas por estado (estado_counts, de
+    rma_especial_estado_counts; '' = sin estado). Orden: más recientes primero.
+    """
+    counts: dict[int, dict[str, int]] = {}
+    for row in conn.execute("SELECT rma_especial_id, estado, n FROM rma_especial_estado_counts WHERE n > 0"):
+        counts.setdefault(row[0], {})[row[1]] = row[2]
     cur = conn.execute(
         """SELECT e.id, e.rma_number, e.source_path, e.estado, e.date_received, e.date_sent, e.date_pickup,
-                  e.created_at, e.updated_at, e.file_date,
-                  (SELECT COUNT(*) FROM rma_especial_lineas l WHERE l.rma_especial_id = e.id) AS line_count
+                  e.created_at, e.updated_at, e.file_date
            FROM rma_especiales e
            ORDER BY e.updated_at DESC, e.id DESC"""
     )
     out = []
     for row in cur.fetchall():
+        estado_counts = counts.get(row["id"], {})
         out.append({
             "id": row["id"],
             "rma_number": row["rma_number"],
@@ -1150,7 +1623,8 @@ def get_all_rma_especiales(conn: sqlite3.Connection) -> list[dict]:
             "created_at": row["created_at"],
             "updated_at": row["updated_at"],
             "file_date": row["file_date"],
-            "line_count": row["line_count"] or 0,
+            "line_count": sum(estado_counts.values()),
+            "estado_counts": estado_counts,
         })
     return out
 
@@ -1194,6 +1668,50 @@ def get_rma_especial_by_id(conn: sqlite3.Connection, rma_especial_id: int) -> di
     }
 
 
+def get_rma_especial_lineas_page(
+    conn: sqlite3.Connection,
+    rma_especial_id: int,
+    after_id: int = 0,
+    limit: int = 200,
+    estado: str | None = None,
+) -> list[dict]:
+    """
+    Página de líneas de un RMA especial por keyset: las de id > after_id en orden de id (usa el índice por
+    rma_especial_id, sin OFFSET). estado: filtra por estado ('' = sin estado); None = todas.
+    """
+    sql = (
+        "SELECT id, ref_proveedor, serial, fallo, resolucion, estado FROM rma_especial_lineas "
+        "WHERE rma_especial_id = ? AND id > ?"
+    )
+    params: list = [rma_especial_id, int(after_id or 0)]
+    if estado is not None:
+        sql += " AND COALESCE(estado, '') = ?"
+        params.append(estado)
+    sql += " ORDER BY id LIMIT ?"
+    params.append(int(limit))
+    return [
+        {
+            "id": r["id"],
+            "ref_proveedor": r["ref_proveedor"] or "",
+            "serial": r["serial"] or "",
+            "fallo": r["fallo"] or "",
+            "resolucion": r["resolucion"] or "",
+            "estado": r["estado"] if r["estado"] is not None else "",
+        }
+        for r in conn.execute(sql, params).fetchall()
+    ]
+
+
+def get_rma_especial_estado_counts(conn: sqlite3.Connection, rma_especial_id: int) -> dict[str, int]:
+    """Líneas por estado de un RMA especial ('' = sin estado)."""
+    return {
+        row[0]: row[1]
+        for row in conn.execute(
+            "SELECT estado, n FROM rma_especial_estado_counts WHERE rma_especial_id = ? AND n > 0", (rma_especial_id,)
+        )
+    }
+
+
 def get_rma_especial_by_rma_number(conn: sqlite3.Connection, rma_number: str) -> dict | None:
     """Devuelve el id del RMA especial por número (para evitar duplicados)."""
     cur = conn.execute("SELECT id FROM rma_especiales WHERE rma_number = ?", (str(rma_number or "").strip(),))
@@ -1217,20 +1735,84 @@ def insert_rma_especial(
         (rma_number, source_path or None, file_date or None),
     )
     rma_especial_id = cur.lastrowid
-    for lin in lineas:
+    conn.executemany(
+        """INSERT INTO rma_especial_lineas (rma_especial_id, ref_proveedor, serial, fallo, resolucion, estado)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        [(rma_especial_id, *_rma_especial_linea_values(lin), (lin.get("estado") or "").strip() or "") for lin in lineas],
+    )
+    return rma_especial_id
+
+
+def _rma_especial_linea_values(lin: dict) -> tuple:
+    """(ref_proveedor, serial, fallo, resolucion) normalizados de una línea importada."""
+    return (
+        (lin.get("ref_proveedor") or "").strip() or None,
+        (lin.get("serial") or "").strip() or None,
+        (lin.get("fallo") or "").strip() or None,
+        (lin.get("resolucion") or "").strip() or None,
+    )
+
+
+_LINEA_CHUNK = 1000  # líneas de RMA especial que se escriben por executemany
+
+
+def upsert_rma_especiales(conn: sqlite3.Connection, rmas: list[dict]) -> list[int]:
+    """
+    Crea o actualiza varios RMA especiales importados de Excel (rma_number, source_path, lineas, file_date).
+    Si el RMA ya existe se conserva la fila (id, estado y fechas puestas en la app) y sus líneas se actualizan
+    en sitio: cada línea nueva reutiliza la primera línea existente con el mismo ref_proveedor + serial
+    (manteniendo id y estado); las que sobran se borran y las nuevas se añaden al final.
+    lineas puede ser cualquier iterable (p. ej. un generador que lee el Excel en streaming): se escriben por
+    bloques de _LINEA_CHUNK sin tenerlas todas en memoria.
+    No hace commit: quien llama agrupa varias llamadas en una transacción. Devuelve los ids en el mismo orden.
+    """
+    ids: list[int] = []
+    for rma in rmas:
+        rma_number = str(rma.get("rma_number") or "").strip()
+        if not rma_number:
+            raise ValueError("rma_number vacío")
         conn.execute(
-            """INSERT INTO rma_especial_lineas (rma_especial_id, ref_proveedor, serial, fallo, resolucion, estado)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (
-                rma_especial_id,
-                (lin.get("ref_proveedor") or "").strip() or None,
-                (lin.get("serial") or "").strip() or None,
-                (lin.get("fallo") or "").strip() or None,
-                (lin.get("resolucion") or "").strip() or None,
-                (lin.get("estado") or "").strip() or "",
-            ),
+            """INSERT INTO rma_especiales (rma_number, source_path, estado, file_date) VALUES (?, ?, '', ?)
+               ON CONFLICT(rma_number) DO UPDATE SET
+                   source_path = excluded.source_path,
+                   file_date = excluded.file_date,
+                   updated_at = datetime('now')""",
+            (rma_number, rma.get("source_path") or None, rma.get("file_date") or None),
         )
-    return rma_especial_id
+        rma_especial_id = conn.execute("SELECT id FROM rma_especiales WHERE rma_number = ?", (rma_number,)).fetchone()[0]
+        ids.append(rma_especial_id)
+        current: dict[tuple, list[int]] = {}
+        for row in conn.execute(
+            "SELECT id, ref_proveedor, serial FROM rma_especial_lineas WHERE rma_especial_id = ? ORDER BY id",
+            (rma_especial_id,),
+        ).fetchall():
+            current.setdefault((row["ref_proveedor"], row["serial"]), []).append(row["id"])
+        lineas = iter(rma.get("lineas") or [])
+        while True:
+            chunk = list(islice(lineas, _LINEA_CHUNK))
+            if not chunk:
+                break
+            inserts: list[tuple] = []
+            updates: list[tuple] = []
+            for lin in chunk:
+                values = _rma_especial_linea_values(lin)
+                reuse = current.get(values[:2])
+                if reuse:
+                    updates.append((values[2], values[3], reuse.pop(0)))
+                else:
+                    inserts.append((rma_especial_id, *values, ""))
+            if updates:
+                conn.executemany("UPDATE rma_especial_lineas SET fallo = ?, resolucion = ? WHERE id = ?", updates)
+            if inserts:
+                conn.executemany(
+                    """INSERT INTO rma_especial_lineas (rma_especial_id, ref_proveedor, serial, fallo, resolucion, estado)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    inserts,
+                )
+        deletes = [(lid,) for lids in current.values() for lid in lids]
+        if deletes:
+            conn.executemany("DELETE FROM rma_especial_lineas WHERE id = ?", deletes)
+    return ids
 
 
 def update_rma_especial_estado(conn: sqlite3.Connection, rma_especial_id: int, estado: str) -> bool:
@@ -1362,6 +1944,270 @@ def add_rma_especial_format(
     return cur.lastrowid
 
 
+def get_rma_especial_manifest(conn: sqlite3.Connection) -> dict[str, dict]:
+    """Manifiesto del escaneo de RMA especiales: path -> {rma_number, size, mtime, outcome, config_sig, result}."""
+    out = {}
+    for row in conn.execute(
+        "SELECT path, rma_number, size, mtime, outcome, config_sig, result FROM rma_especial_scan_manifest"
+    ).fetchall():
+        try:
+            result = json.loads(row["result"]) if row["result"] else None
+        except (TypeError, json.JSONDecodeError):
+            result = None
+        out[row["path"]] = {
+            "rma_number": row["rma_number"],
+            "size": row["size"],
+            "mtime": row["mtime"],
+            "outcome": row["outcome"],
+            "config_sig": row["config_sig"],
+            "result": result,
+        }
+    return out
+
+
+def upsert_rma_especial_manifest(conn: sqlite3.Connection, entries: list[dict]) -> None:
+    """Guarda (o sustituye) entradas del manifiesto: path, rma_number, size, mtime, outcome, config_sig, result."""
+    if not entries:
+        return
+    conn.executemany(
+        """INSERT INTO rma_especial_scan_manifest (path, rma_number, size, mtime, outcome, config_sig, result, scanned_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
+           ON CONFLICT(path) DO UPDATE SET
+               rma_number = excluded.rma_number,
+               size = excluded.size,
+               mtime = excluded.mtime,
+               outcome = excluded.outcome,
+               config_sig = excluded.config_sig,
+               result = excluded.result,
+               scanned_at = excluded.scanned_at""",
+        [
+            (
+                e["path"],
+                e.get("rma_number"),
+                int(e["size"]),
+                float(e["mtime"]),
+                e["outcome"],
+                e.get("config_sig"),
+                json.dumps(e["result"], ensure_ascii=False) if e.get("result") is not None else None,
+            )
+            for e in entries
+        ],
+    )
+
+
+def delete_rma_especial_manifest(conn: sqlite3.Connection, paths: list[str]) -> None:
+    """Quita del manifiesto los Excel que ya no están en la carpeta."""
+    paths = list(paths)
+    for i in range(0, len(paths), _SQL_IN_CHUNK):
+        chunk = paths[i:i + _SQL_IN_CHUNK]
+        conn.execute(
+            f"DELETE FROM rma_especial_scan_manifest WHERE path IN ({','.join('?' * len(chunk))})",
+            chunk,
+        )
+
+
+_ATRACTOR_CACHE_TOUCH_SECONDS = 60  # accessed_at solo se reescribe si es más antiguo: un acierto no es una escritura
+
+
+def get_atractor_cache(conn: sqlite3.Connection, key: str, now: float) -> dict | None:
+    """
+    Entrada de la caché de Atractor (body, fetched_at, expires_at) o None. Marca el acceso para el LRU solo si el
+    anterior tiene más de _ATRACTOR_CACHE_TOUCH_SECONDS, así un informe servido de la caché no escribe en la BD.
+    """
+    row = conn.execute(
+        "SELECT body, fetched_at, expires_at, accessed_at FROM atractor_cache WHERE key = ?",
+        (key,),
+    ).fetchone()
+    if row is None:
+        return None
+    if now - row["accessed_at"] >= _ATRACTOR_CACHE_TOUCH_SECONDS:
+        conn.execute("UPDATE atractor_cache SET accessed_at = ? WHERE key = ?", (now, key))
+    return {"body": row["body"], "fetched_at": row["fetched_at"], "expires_at": row["expires_at"]}
+
+
+def save_atractor_cache(
+    conn: sqlite3.Connection,
+    key: str,
+    url: str,
+    desde: str,
+    hasta: str,
+    body: str,
+    now: float,
+    expires_at: float,
+    max_bytes: int,
+) -> None:
+    """Guarda una respuesta de Atractor y expulsa las menos usadas recientemente hasta quedar por debajo de max_bytes."""
+    size = len(body.encode("utf-8"))
+    if size > max_bytes:
+        conn.execute("DELETE FROM atractor_cache WHERE key = ?", (key,))
+        return
+    conn.execute(
+        """INSERT INTO atractor_cache (key, url, desde, hasta, body, size, fetched_at, expires_at, accessed_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(key) DO UPDATE SET
+               body = excluded.body,
+               size = excluded.size,
+               fetched_at = excluded.fetched_at,
+               expires_at = excluded.expires_at,
+               accessed_at = excluded.accessed_at""",
+        (key, url, desde, hasta, body, size, now, expires_at, now),
+    )
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM atractor_cache").fetchone()[0]
+    if total <= max_bytes:
+        return
+    for row in conn.execute(
+        "SELECT key, size FROM atractor_cache WHERE key != ? ORDER BY accessed_at",
+        (key,),
+    ).fetchall():
+        conn.execute("DELETE FROM atractor_cache WHERE key = ?", (row["key"],))
+        total -= row["size"]
+        if total <= max_bytes:
+            break
+
+
+def get_atractor_cache_status(conn: sqlite3.Connection) -> dict:
+    row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM atractor_cache").fetchone()
+    return {"entries": row[0], "bytes": row[1]}
+
+
+def get_rma_especial_header_grids(conn: sqlite3.Connection, paths: list[str]) -> dict[str, dict]:
+    """Rejillas de cabecera guardadas: path -> {mtime, sheet_names (lista o None), grids {índice de hoja: filas}}."""
+    paths = list(dict.fromkeys(paths))
+    out = {}
+    for i in range(0, len(paths), _SQL_IN_CHUNK):
+        chunk = paths[i:i + _SQL_IN_CHUNK]
+        for row in conn.execute(
+            f"SELECT path, mtime, sheet_names, grids FROM rma_especial_header_grids WHERE path IN ({','.join('?' * len(chunk))})",
+            chunk,
+        ).fetchall():
+            try:
+                grids = {int(k): v for k, v in json.loads(row["grids"]).items()}
+                sheet_names = json.loads(row["sheet_names"]) if row["sheet_names"] else None
+            except (TypeError, ValueError):
+                continue
+            out[row["path"]] = {"mtime": row["mtime"], "sheet_names": sheet_names, "grids": grids}
+    return out
+
+
+def save_rma_especial_header_grids(conn: sqlite3.Connection, entries: list[dict]) -> None:
+    """
+    Guarda las rejillas de cabecera leídas de cada Excel (path, mtime, sheet_names, grids). Con el mismo mtime se
+    añaden las hojas nuevas a las ya guardadas; si el archivo cambió, se sustituyen.
+    """
+    if not entries:
+        return
+    existing = get_rma_especial_header_grids(conn, [e["path"] for e in entries])
+    rows = []
+    for e in entries:
+        grids = dict(e.get("grids") or {})
+        sheet_names = e.get("sheet_names")
+        prev = existing.get(e["path"])
+        if prev is not None and prev["mtime"] == float(e["mtime"]):
+            grids = {**prev["grids"], **grids}
+            if sheet_names is None:
+                sheet_names = prev["sheet_names"]
+        rows.append((
+            e["path"],
+            float(e["mtime"]),
+            json.dumps(sheet_names, ensure_ascii=False) if sheet_names is not None else None,
+            json.dumps({str(k): v for k, v in grids.items()}, ensure_ascii=False),
+        ))
+    conn.executemany(
+        """INSERT INTO rma_especial_header_grids (path, mtime, sheet_names, grids, updated_at)
+           VALUES (?, ?, ?, ?, datetime('now'))
+           ON CONFLICT(path) DO UPDATE SET
+               mtime = excluded.mtime,
+               sheet_names = excluded.sheet_names,
+               grids = excluded.grids,
+               updated_at = excluded.updated_at""",
+        rows,
+    )
+
+
+def delete_rma_especial_header_grids(conn: sqlite3.Connection, paths: list[str]) -> None:
+    """Quita las rejillas guardadas de los Excel que ya no están en la carpeta."""
+    paths = list(paths)
+    for i in range(0, len(paths), _SQL_IN_CHUNK):
+        chunk = paths[i:i + _SQL_IN_CHUNK]
+        conn.execute(
+            f"DELETE FROM rma_especial_header_grids WHERE path IN ({','.join('?' * len(chunk))})",
+            chunk,
+        )
+
+
+def save_rma_especial_scan_results(conn: sqlite3.Connection, scan_id: str, rows: list[tuple[int, str, dict]]) -> None:
+    """Guarda (o sustituye) entradas de un escaneo: (seq, status, entrada del escaneo)."""
+    if not rows:
+        return
+    conn.executemany(
+        """INSERT OR REPLACE INTO rma_especial_scan_results (scan_id, seq, path, rma_number, status, item)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        [
+            (scan_id, seq, item.get("path") or "", item.get("rma_number"), status, json.dumps(item, ensure_ascii=False))
+            for seq, status, item in rows
+        ],
+    )
+
+
+def get_rma_especial_scan_results(
+    conn: sqlite3.Connection,
+    scan_id: str,
+    status: str | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> tuple[list[dict], int]:
+    """Página de entradas de un escaneo (opcionalmente de un status) en el orden del listado, y total con ese filtro."""
+    where, params = "scan_id = ?", [scan_id]
+    if status:
+        where += " AND status = ?"
+        params.append(status)
+    total = conn.execute(f"SELECT COUNT(*) FROM rma_especial_scan_results WHERE {where}", params).fetchone()[0]
+    sql = f"SELECT item FROM rma_especial_scan_results WHERE {where} ORDER BY seq"
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [int(limit), max(0, int(offset))]
+    items = []
+    for row in conn.execute(sql, params).fetchall():
+        try:
+            items.append(json.loads(row["item"]))
+        except (TypeError, json.JSONDecodeError):
+            continue
+    return items, total
+
+
+def count_rma_especial_scan_results(conn: sqlite3.Connection, scan_id: str) -> dict[str, int]:
+    """Recuento por status de un escaneo: {"total", "imported", "missing", "error", "ready"}."""
+    rows = conn.execute(
+        "SELECT status, COUNT(*) FROM rma_especial_scan_results WHERE scan_id = ? GROUP BY status", (scan_id,)
+    ).fetchall()
+    counts = {"total": 0, "imported": 0, "missing": 0, "error": 0, "ready": 0}
+    for status, n in rows:
+        counts[status] = counts.get(status, 0) + n
+        counts["total"] += n
+    return counts
+
+
+def update_rma_especial_scan_result(conn: sqlite3.Connection, scan_id: str, path: str, status: str, item: dict) -> None:
+    """Sustituye la entrada de un archivo en un escaneo (p. ej. tras volver a reconocer sus columnas)."""
+    conn.execute(
+        "UPDATE rma_especial_scan_results SET status = ?, item = ? WHERE scan_id = ? AND path = ?",
+        (status, json.dumps(item, ensure_ascii=False), scan_id, path),
+    )
+
+
+def delete_rma_especial_scan_result(conn: sqlite3.Connection, scan_id: str, path: str) -> None:
+    """Quita de un escaneo la entrada de un archivo (ya importado desde la vista)."""
+    conn.execute("DELETE FROM rma_especial_scan_results WHERE scan_id = ? AND path = ?", (scan_id, path))
+
+
+def prune_rma_especial_scan_results(conn: sqlite3.Connection, keep_scan_id: str, max_age_hours: int = 24) -> None:
+    """Borra los resultados de escaneos anteriores con más de max_age_hours horas (se conserva keep_scan_id)."""
+    conn.execute(
+        "DELETE FROM rma_especial_scan_results WHERE scan_id != ? AND created_at < datetime('now', ?)",
+        (keep_scan_id, f"-{int(max_age_hours)} hours"),
+    )
+
+
 # --- Settings (paths QNAP, Excel) ---
 
 
@@ -1429,33 +2275,230 @@ def list_audit_log(
 # --- Caché catálogo productos (QNAP) ---
 
 _CATALOG_CACHE_KEY = "default"
+_CATALOG_PRODUCT_FIELDS = (
+    "base_serial",
+    "brand",
+    "product_type",
+    "creation_date",
+    "folder_rel",
+    "excel_rel",
+    "visual_pdf_rel",
+    "visual_excel_rel",
+)
+# Máximo de parámetros por IN (...) para no superar el límite de variables de SQLite
+_SQL_IN_CHUNK = 500
+
+
+def catalog_product_ref(brand: str | None, base_serial: str | None) -> str:
+    """Clave de producto del catálogo: 'Marca|Nº serie base' (igual que la construye el frontend)."""
+    return "|".join(v for v in ((brand or "").strip(), (base_serial or "").strip()) if v)
+
+
+def _clean_product_type(product_type: str | None) -> str | None:
+    """Tipo tal como se guarda: recortado y None si queda vacío (las consultas por tipo comparan la columna tal cual)."""
+    return (product_type or "").strip() or None
+
+
+def _catalog_row_to_api(row: sqlite3.Row) -> dict:
+    return {k: row[k] for k in _CATALOG_PRODUCT_FIELDS}
+
+
+def _upsert_catalog_products(
+    conn: sqlite3.Connection,
+    productos: list[dict],
+    scan_gen: int,
+    positions: list[int] | None = None,
+) -> None:
+    """
+    Inserta o actualiza los productos. Si el tipo de un producto se asignó a mano (product_type_manual=1)
+    se conserva aunque el escaneo traiga otro (y un producto que llega con tipo manual lo deja marcado así).
+    Productos repetidos (misma clave) en el escaneo: gana el primero.
+    positions: orden de cada producto en el listado (por defecto, su índice en productos).
+    """
+    rows = []
+    seen: set[str] = set()
+    for i, p in enumerate(productos):
+        pos = positions[i] if positions is not None else i
+        ref = catalog_product_ref(p.get("brand"), p.get("base_serial"))
+        if not ref or ref in seen:
+            continue
+        seen.add(ref)
+        rows.append((
+            ref,
+            p.get("brand"),
+            p.get("base_serial"),
+            _clean_product_type(p.get("product_type")),
+            1 if p.get("product_type_manual") else 0,
+            p.get("creation_date"),
+            p.get("folder_rel"),
+            p.get("excel_rel"),
+            p.get("visual_pdf_rel"),
+            p.get("visual_excel_rel"),
+            pos,
+            scan_gen,
+        ))
+    conn.executemany(
+        """INSERT INTO catalog_products (product_ref, brand, base_serial, product_type, product_type_manual,
+                                         creation_date, folder_rel, excel_rel, visual_pdf_rel, visual_excel_rel,
+                                         position, scan_gen)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(product_ref) DO UPDATE SET
+               brand = excluded.brand,
+               base_serial = excluded.base_serial,
+               product_type = CASE WHEN catalog_products.product_type_manual = 1
+                                   THEN catalog_products.product_type ELSE excluded.product_type END,
+               product_type_manual = MAX(catalog_products.product_type_manual, excluded.product_type_manual),
+               creation_date = excluded.creation_date,
+               folder_rel = excluded.folder_rel,
+               excel_rel = excluded.excel_rel,
+               visual_pdf_rel = excluded.visual_pdf_rel,
+               visual_excel_rel = excluded.visual_excel_rel,
+               position = excluded.position,
+               scan_gen = excluded.scan_gen""",
+        rows,
+    )
+
+
+def get_catalog_scanned_at(conn: sqlite3.Connection) -> str | None:
+    """Fecha/hora del último escaneo del catálogo o None si nunca se ha escaneado."""
+    cur = conn.execute("SELECT scanned_at FROM catalog_cache WHERE key = ?", (_CATALOG_CACHE_KEY,))
+    row = cur.fetchone()
+    return row[0] if row else None
 
 
 def get_catalog_cache(conn: sqlite3.Connection) -> tuple[str | None, list[dict]]:
     """Devuelve (scanned_at, lista de productos) si hay caché; si no, (None, [])."""
+    scanned_at = get_catalog_scanned_at(conn)
+    if scanned_at is None:
+        return None, []
     cur = conn.execute(
-        "SELECT scanned_at, data FROM catalog_cache WHERE key = ?",
-        (_CATALOG_CACHE_KEY,),
+        f"SELECT {', '.join(_CATALOG_PRODUCT_FIELDS)} FROM catalog_products ORDER BY position, product_ref"
     )
-    row = cur.fetchone()
-    if not row:
-        return None, []
-    try:
-        data = json.loads(row[1]) if row[1] else []
-        return row[0], data
-    except (TypeError, json.JSONDecodeError):
-        return None, []
+    return scanned_at, [_catalog_row_to_api(row) for row in cur.fetchall()]
 
 
 def set_catalog_cache(conn: sqlite3.Connection, productos: list[dict]) -> None:
-    """Guarda la lista de productos en caché con la fecha/hora actual."""
+    """
+    Guarda el resultado de un escaneo completo con la fecha/hora actual: actualiza los productos existentes
+    (conservando tipos asignados a mano) y elimina los que ya no aparecen en la carpeta.
+    """
     scanned_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-    data = json.dumps(productos, ensure_ascii=False)
+    scan_gen = (conn.execute("SELECT COALESCE(MAX(scan_gen), 0) FROM catalog_products").fetchone()[0] or 0) + 1
+    _upsert_catalog_products(conn, productos, scan_gen)
+    conn.execute("DELETE FROM catalog_products WHERE scan_gen != ?", (scan_gen,))
     conn.execute(
-        """INSERT INTO catalog_cache (key, scanned_at, data) VALUES (?, ?, ?)
-           ON CONFLICT(key) DO UPDATE SET scanned_at = excluded.scanned_at, data = excluded.data""",
-        (_CATALOG_CACHE_KEY, scanned_at, data),
+        """INSERT INTO catalog_cache (key, scanned_at, data) VALUES (?, ?, '[]')
+           ON CONFLICT(key) DO UPDATE SET scanned_at = excluded.scanned_at, data = '[]'""",
+        (_CATALOG_CACHE_KEY, scanned_at),
+    )
+
+
+def update_catalog_products(
+    conn: sqlite3.Connection,
+    productos: list[dict],
+    removed_folder_rels: list[str] | None = None,
+) -> None:
+    """
+    Actualización incremental (vigilancia de carpetas): borra los productos de las carpetas desaparecidas
+    (folder_rel exacto o por debajo) y añade/actualiza los indicados, sin tocar el resto del catálogo.
+    Si el Nº de serie de una carpeta cambia, se sustituye la fila anterior de esa carpeta; si su tipo se había
+    asignado a mano, pasa a la fila nueva.
+    """
+    for rel in removed_folder_rels or []:
+        rel = (rel or "").strip().strip("/")
+        if not rel:
+            continue
+        conn.execute(
+            "DELETE FROM catalog_products WHERE folder_rel = ? OR substr(folder_rel, 1, ?) = ?",
+            (rel, len(rel) + 1, rel + "/"),
+        )
+    if not productos:
+        return
+    scan_gen, next_pos = conn.execute(
+        "SELECT COALESCE(MAX(scan_gen), 1), COALESCE(MAX(position), -1) + 1 FROM catalog_products"
+    ).fetchone()
+    existing = {
+        row["folder_rel"]: row
+        for row in conn.execute(
+            """SELECT folder_rel, position, product_ref, product_type, product_type_manual
+               FROM catalog_products WHERE folder_rel IS NOT NULL"""
+        )
+    }
+    productos = list(productos)
+    positions = []
+    for i, p in enumerate(productos):
+        old = existing.get(p.get("folder_rel"))
+        if old is None:
+            pos, next_pos = next_pos, next_pos + 1
+        else:
+            pos = old["position"]
+            if old["product_type_manual"] and old["product_ref"] != catalog_product_ref(p.get("brand"), p.get("base_serial")):
+                productos[i] = {**p, "product_type": old["product_type"], "product_type_manual": True}
+        positions.append(pos)
+    _upsert_catalog_products(conn, productos, scan_gen, positions)
+    for p in productos:
+        ref = catalog_product_ref(p.get("brand"), p.get("base_serial"))
+        conn.execute(
+            "DELETE FROM catalog_products WHERE folder_rel = ? AND product_ref != ?",
+            (p.get("folder_rel"), ref),
+        )
+
+
+def catalog_file_is_indexed(conn: sqlite3.Connection, path_rel: str) -> bool:
+    """True si path_rel es el PDF o Excel visual de algún producto del catálogo (ruta conocida, ya validada)."""
+    rel = (path_rel or "").strip()
+    if not rel:
+        return False
+    cur = conn.execute(
+        "SELECT 1 FROM catalog_products WHERE visual_pdf_rel = ? OR visual_excel_rel = ? LIMIT 1",
+        (rel, rel),
     )
+    return cur.fetchone() is not None
+
+
+def list_catalog_product_types(conn: sqlite3.Connection) -> list[str]:
+    """Tipos de producto distintos presentes en el catálogo (se guardan ya recortados: sale del índice por tipo)."""
+    cur = conn.execute(
+        "SELECT DISTINCT product_type FROM catalog_products WHERE product_type IS NOT NULL"
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def assign_catalog_product_type(conn: sqlite3.Connection, product_refs: list[str], product_type: str) -> int:
+    """Asigna (a mano) el tipo a los productos indicados por 'Marca|Nº serie base'. Devuelve filas actualizadas."""
+    refs = [r for r in dict.fromkeys((r or "").strip() for r in product_refs) if r]
+    changed = 0
+    for i in range(0, len(refs), _SQL_IN_CHUNK):
+        chunk = refs[i:i + _SQL_IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        cur = conn.execute(
+            f"UPDATE catalog_products SET product_type = ?, product_type_manual = 1 WHERE product_ref IN ({placeholders})",
+            [_clean_product_type(product_type)] + chunk,
+        )
+        changed += cur.rowcount
+    return changed
+
+
+def clear_catalog_product_types(conn: sqlite3.Connection, product_types: list[str]) -> int:
+    """Deja sin tipo (a mano, para que no vuelva al reescanear) los productos con alguno de esos tipos."""
+    tipos = [t for t in dict.fromkeys((t or "").strip() for t in product_types) if t]
+    if not tipos:
+        return 0
+    placeholders = ",".join("?" * len(tipos))
+    cur = conn.execute(
+        f"UPDATE catalog_products SET product_type = NULL, product_type_manual = 1 WHERE product_type IN ({placeholders})",
+        tipos,
+    )
+    return cur.rowcount
+
+
+def rename_catalog_product_type(conn: sqlite3.Connection, old_type: str, new_type: str) -> int:
+    """Renombra un tipo en todos los productos que lo tengan (queda como asignación manual). Devuelve filas actualizadas."""
+    cur = conn.execute(
+        "UPDATE catalog_products SET product_type = ?, product_type_manual = 1 WHERE product_type = ?",
+        (_clean_product_type(new_type), (old_type or "").strip()),
+    )
+    return cur.rowcount
 
 
 # --- Repuestos (vinculados a productos del catálogo, con inventario) ---
@@ -0,0 +1,263 @@
+"""
+Caché de archivos del catálogo (PDF/Excel visuales) servidos desde la carpeta de red (QNAP).
+- Metadatos (mtime, tamaño) en memoria con TTL corto: evita un stat por petición sobre SMB (304 sin tocar la red).
+- Copia local opcional de los archivos más usados (LRU en disco con tope de tamaño). Se activa con
+  CATALOG_FILE_CACHE_MB > 0; carpeta en CATALOG_FILE_CACHE_DIR (por defecto backend/.file_cache).
+- Si no hay copia se sirve desde la red y la copia se hace en segundo plano (CATALOG_FILE_CACHE_WORKERS hilos):
+  la primera petición (p. ej. el primer Range de un visor PDF) no espera a copiar el archivo entero.
+- Tamaño y fecha salen del fstat del archivo ya abierto, no del stat en caché: Content-Length siempre cuadra
+  con lo que se envía aunque el archivo se haya sustituido dentro del TTL.
+- Las copias en lectura no se borran al desalojarlas: se marcan y se borran cuando se cierra la última lectura
+  (en Windows no se puede borrar un archivo abierto). Los .part de copias interrumpidas se limpian al arrancar.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+CACHE_MAX_BYTES = int(float(os.environ.get("CATALOG_FILE_CACHE_MB", "0") or 0) * 1024 * 1024)
+CACHE_DIR = Path(os.environ.get("CATALOG_FILE_CACHE_DIR", "").strip() or (Path(__file__).resolve().parent / ".file_cache"))
+STAT_TTL_SECONDS = float(os.environ.get("CATALOG_FILE_STAT_TTL", "60"))
+FILL_WORKERS = max(1, int(os.environ.get("CATALOG_FILE_CACHE_WORKERS", "2") or 2))
+_COPY_CHUNK = 1024 * 1024
+
+
+def _noop() -> None:
+    pass
+
+
+class CatalogFileCache:
+    """Metadatos con TTL y copias locales LRU de archivos remotos, indexadas por ruta de origen."""
+
+    def __init__(
+        self,
+        cache_dir: Path = CACHE_DIR,
+        max_bytes: int = CACHE_MAX_BYTES,
+        stat_ttl: float = STAT_TTL_SECONDS,
+        fill_workers: int = FILL_WORKERS,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max(0, int(max_bytes))
+        self.stat_ttl = stat_ttl
+        self.fill_workers = max(1, fill_workers)
+        self._lock = threading.Lock()
+        self._stats: dict[str, tuple[float, float, int]] = {}  # origen -> (comprobado_en, mtime, tamaño)
+        self._entries: OrderedDict[str, int] = OrderedDict()  # nombre local -> tamaño (orden LRU)
+        self._total = 0
+        self._loaded = False
+        self._readers: dict[str, int] = {}  # nombre local -> lecturas abiertas
+        self._doomed: set[str] = set()  # desalojados que aún no se han podido borrar
+        self._filling: set[str] = set()  # orígenes con una copia en curso o encolada
+        self._executor: ThreadPoolExecutor | None = None
+        self._counters = {"hits": 0, "misses": 0, "fills": 0, "fill_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    # --- Metadatos ---
+
+    def stat(self, source: str) -> tuple[float, int]:
+        """(mtime, tamaño) del archivo de origen; se consulta la red como mucho una vez cada stat_ttl segundos."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._stats.get(source)
+            if cached and now - cached[0] < self.stat_ttl:
+                return cached[1], cached[2]
+        st = os.stat(source)  # FileNotFoundError / PermissionError los gestiona quien llama
+        self._remember_stat(source, st)
+        return st.st_mtime, st.st_size
+
+    def _remember_stat(self, source: str, st: os.stat_result) -> None:
+        with self._lock:
+            self._stats[source] = (time.monotonic(), st.st_mtime, st.st_size)
+
+    def invalidate(self, source: str) -> None:
+        with self._lock:
+            self._stats.pop(source, None)
+
+    # --- Copias locales (LRU) ---
+
+    @staticmethod
+    def _local_name(source: str, mtime: float, size: int) -> str:
+        """Nombre local: cambia si cambia el archivo de origen, así una versión vieja nunca se sirve."""
+        digest = hashlib.sha1(f"{source}|{mtime}|{size}".encode("utf-8")).hexdigest()
+        return digest + Path(source).suffix.lower()
+
+    def _load_index(self) -> None:
+        """
+        Con el lock tomado. Reconstruye el índice LRU desde la carpeta (tras reiniciar el servidor), más antiguos
+        primero, y borra los .part de copias que no terminaron.
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            paths = [p for p in self.cache_dir.iterdir() if p.is_file()]
+        except OSError:
+            return
+        files = []
+        for p in paths:
+            if p.name.endswith(".part"):
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+                continue
+            try:
+                files.append((p.stat().st_atime, p.name, p.stat().st_size))
+            except OSError:
+                continue
+        files.sort()
+        for _atime, name, size in files:
+            self._entries[name] = size
+            self._total += size
+
+    def _unlink(self, name: str) -> None:
+        """Con el lock tomado. Borra la copia; si está en lectura o no se puede borrar queda pendiente."""
+        if self._readers.get(name):
+            self._doomed.add(name)
+            return
+        try:
+            (self.cache_dir / name).unlink()
+            self._doomed.discard(name)
+        except FileNotFoundError:
+            self._doomed.discard(name)
+        except OSError:
+            self._doomed.add(name)
+
+    def _evict(self, needed: int) -> None:
+        """Con el lock tomado. Reintenta los borrados pendientes y desaloja por LRU hasta que quepa needed."""
+        for name in list(self._doomed):
+            if name not in self._entries:
+                self._unlink(name)
+        while self._entries and self._total + needed > self.max_bytes:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            self._unlink(name)
+
+    def _release(self, name: str) -> None:
+        with self._lock:
+            n = self._readers.get(name, 0) - 1
+            if n > 0:
+                self._readers[name] = n
+                return
+            self._readers.pop(name, None)
+            if name in self._doomed and name not in self._entries:
+                self._unlink(name)
+
+    def open(self, source: str, mtime: float, size: int) -> tuple[BinaryIO, Callable[[], None]]:
+        """
+        Abre el archivo para servirlo: la copia local si la hay (protegida del desalojo hasta llamar a release) o
+        el de la red, encargando la copia en segundo plano. Devuelve (archivo, release); quien llama cierra el
+        archivo y después llama a release. Tamaño y fecha: os.fstat del archivo devuelto (la copia local lleva
+        el mtime del original). OSError si no se puede abrir el de la red.
+        """
+        if self.enabled and size <= self.max_bytes:
+            name = self._local_name(source, mtime, size)
+            with self._lock:
+                self._load_index()
+                hit = name in self._entries
+                if hit:
+                    self._entries.move_to_end(name)
+                    self._readers[name] = self._readers.get(name, 0) + 1
+            if hit:
+                try:
+                    f = open(self.cache_dir / name, "rb")
+                except OSError:
+                    self._release(name)
+                    with self._lock:
+                        if self._entries.pop(name, None) is not None:
+                            self._total -= size
+                else:
+                    with self._lock:
+                        self._counters["hits"] += 1
+                    return f, lambda: self._release(name)
+        f = open(source, "rb")
+        try:
+            self._remember_stat(source, os.fstat(f.fileno()))
+        except OSError:
+            pass
+        if self.enabled:
+            with self._lock:
+                self._counters["misses"] += 1
+            self._schedule_fill(source)
+        return f, _noop
+
+    def _schedule_fill(self, source: str) -> None:
+        with self._lock:
+            if source in self._filling:
+                return
+            self._filling.add(source)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.fill_workers, thread_name_prefix="catalog_file_cache")
+            executor = self._executor
+        executor.submit(self._fill, source)
+
+    def _fill(self, source: str) -> None:
+        """Copia el archivo de la red a la caché; el nombre sale del fstat del archivo abierto (no del stat en caché)."""
+        tmp: Path | None = None
+        try:
+            with open(source, "rb") as src:
+                st = os.fstat(src.fileno())
+                self._remember_stat(source, st)
+                if st.st_size > self.max_bytes:
+                    return
+                name = self._local_name(source, st.st_mtime, st.st_size)
+                with self._lock:
+                    self._load_index()
+                    if name in self._entries:
+                        return
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp = self.cache_dir / f"{name}.{threading.get_ident()}.part"
+                with open(tmp, "wb") as dst:
+                    shutil.copyfileobj(src, dst, _COPY_CHUNK)
+            if tmp.stat().st_size != st.st_size:
+                raise OSError("El archivo cambió durante la copia")
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            with self._lock:
+                self._evict(st.st_size)
+                os.replace(tmp, self.cache_dir / name)
+                tmp = None
+                self._doomed.discard(name)
+                self._entries[name] = st.st_size
+                self._total += st.st_size
+                self._counters["fills"] += 1
+        except OSError:
+            with self._lock:
+                self._counters["fill_errors"] += 1
+        finally:
+            if tmp is not None:
+                try:
+                    tmp.unlink()
+                except OSError:
+                    pass
+            with self._lock:
+                self._filling.discard(source)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "files": len(self._entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "reading": sum(self._readers.values()),
+                "pending_delete": len(self._doomed),
+                "filling": len(self._filling),
+                **self._counters,
+            }
@@ -0,0 +1,282 @@
+"""
+Vigilancia de carpetas (catálogo QNAP y RMA especiales) para mantener los datos al día sin escaneos completos.
+- Si está instalado watchdog y la carpeta es local, se usan eventos del sistema (inotify en Linux).
+- En carpetas de red (SMB/UNC) o sin watchdog, se hace un sondeo periódico barato: un stat por directorio y
+  solo se vuelve a listar un directorio cuando cambia su mtime (crear/borrar/renombrar archivos lo cambia).
+  Sobrescribir un archivo en su sitio no cambia el mtime del directorio (en SMB): para verlo, cada
+  FS_WATCHER_FULL_PASS_EVERY sondeos se relistan todos los directorios comparando (mtime, tamaño) de cada archivo.
+- Las rutas cambiadas se encolan y, pasado un tiempo sin cambios nuevos (debounce), se entregan en bloque al
+  callback (main.py las encola como tarea en el gestor de tareas, en la cola del escaneo completo).
+Es opcional: se activa con FS_WATCHER_ENABLED=1 (ver .env.example).
+"""
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+WATCHER_ENABLED = os.environ.get("FS_WATCHER_ENABLED", "").lower() in ("1", "true", "yes")
+POLL_SECONDS = float(os.environ.get("FS_WATCHER_POLL_SECONDS", "60"))
+DEBOUNCE_SECONDS = float(os.environ.get("FS_WATCHER_DEBOUNCE_SECONDS", "5"))
+# Cada cuántos sondeos se hace una pasada completa (relistar todo); 0 = nunca (las ediciones en sitio necesitan
+# entonces el escaneo manual)
+FULL_PASS_EVERY = max(0, int(os.environ.get("FS_WATCHER_FULL_PASS_EVERY", "10") or 0))
+# Tipos de sistema de ficheros de red en /proc/mounts: ahí inotify no ve cambios hechos desde otros equipos
+_NETWORK_FS_TYPES = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "fuse.sshfs", "9p"}
+
+
+def _is_ignored(path: str) -> bool:
+    """Archivos temporales de Office (~$...) y de bloqueo: no interesan."""
+    name = os.path.basename(path)
+    return name.startswith("~$") or name.startswith(".~lock")
+
+
+def is_network_path(path: str) -> bool:
+    """True si la ruta es UNC (\\\\server\\share) o está bajo un montaje de red (Linux)."""
+    if not path:
+        return False
+    if path.startswith("\\\\") or path.startswith("//"):
+        return True
+    try:
+        real = os.path.realpath(path)
+        best, best_type = "", ""
+        with open("/proc/mounts", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point, fs_type = parts[1], parts[2]
+                if (real == mount_point or real.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) > len(best):
+                    best, best_type = mount_point, fs_type
+        return best_type in _NETWORK_FS_TYPES
+    except OSError:
+        return False
+
+
+class _DirSnapshot:
+    """
+    Foto de un árbol de directorios para el sondeo: por directorio guarda mtime, subdirectorios y
+    (mtime, tamaño) de sus archivos. poll() devuelve las rutas añadidas, borradas o renombradas (cambia el mtime
+    del directorio); las modificadas en su sitio solo en las pasadas completas (una de cada full_pass_every).
+    """
+
+    def __init__(self, root: str, max_depth: int | None = None, full_pass_every: int = FULL_PASS_EVERY):
+        self.root = root
+        self.max_depth = max_depth
+        self.full_pass_every = full_pass_every
+        self._dirs: dict[str, tuple[float, list[str], dict[str, tuple[float, int]]]] = {}
+        self._initialized = False
+        self._polls = 0
+
+    def _list_dir(self, path: str) -> tuple[float, list[str], dict[str, tuple[float, int]]] | None:
+        try:
+            mtime = os.stat(path).st_mtime
+            subdirs: list[str] = []
+            files: dict[str, tuple[float, int]] = {}
+            with os.scandir(path) as it:
+                for e in it:
+                    try:
+                        if e.is_dir():
+                            subdirs.append(e.path)
+                        elif e.is_file() and not _is_ignored(e.path):
+                            st = e.stat()
+                            files[e.name] = (st.st_mtime, st.st_size)
+                    except OSError:
+                        continue
+            return mtime, subdirs, files
+        except OSError:
+            return None
+
+    def _forget(self, path: str, changed: set[str]) -> None:
+        """Elimina de la foto un directorio desaparecido (y sus descendientes) y marca sus rutas como cambiadas."""
+        entry = self._dirs.pop(path, None)
+        changed.add(path)
+        if entry is None:
+            return
+        _mtime, subdirs, files = entry
+        for name in files:
+            changed.add(os.path.join(path, name))
+        for sd in subdirs:
+            self._forget(sd, changed)
+
+    def poll(self) -> set[str]:
+        changed: set[str] = set()
+        self._polls += 1
+        full = self.full_pass_every > 0 and self._polls % self.full_pass_every == 0
+        stack: list[tuple[str, int]] = [(self.root, 0)]
+        while stack:
+            path, depth = stack.pop()
+            prev = self._dirs.get(path)
+            if prev is not None and not full:
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    self._forget(path, changed)
+                    continue
+                if mtime == prev[0]:
+                    # Sin cambios en la lista de entradas: solo bajar a los subdirectorios ya conocidos
+                    if self.max_depth is None or depth < self.max_depth:
+                        stack.extend((sd, depth + 1) for sd in prev[1])
+                    continue
+            listed = self._list_dir(path)
+            if listed is None:
+                self._forget(path, changed)
+                continue
+            mtime, subdirs, files = listed
+            if self._initialized:
+                old_files = prev[2] if prev else {}
+                for name, sig in files.items():
+                    if old_files.get(name) != sig:
+                        changed.add(os.path.join(path, name))
+                for name in old_files:
+                    if name not in files:
+                        changed.add(os.path.join(path, name))
+                if prev is not None:
+                    for sd in set(prev[1]) - set(subdirs):
+                        self._forget(sd, changed)
+            self._dirs[path] = (mtime, subdirs, files)
+            if self.max_depth is None or depth < self.max_depth:
+                stack.extend((sd, depth + 1) for sd in subdirs)
+        self._initialized = True
+        return changed
+
+
+class FolderWatcher:
+    """
+    Vigila la carpeta que devuelve get_root() (se relee en cada ciclo: puede cambiar desde Configuración)
+    y llama a on_changes(root, rutas) con las rutas cambiadas agrupadas.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        get_root: Callable[[], str | None],
+        on_changes: Callable[[str, list[str]], None],
+        poll_seconds: float = POLL_SECONDS,
+        debounce_seconds: float = DEBOUNCE_SECONDS,
+        max_depth: int | None = None,
+    ):
+        self.name = name
+        self.get_root = get_root
+        self.on_changes = on_changes
+        self.poll_seconds = poll_seconds
+        self.debounce_seconds = debounce_seconds
+        self.max_depth = max_depth
+        self._queue: queue.Queue[str] = queue.Queue()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._root: str | None = None
+        self._observer = None
+        self._snapshot: _DirSnapshot | None = None
+        self.mode = "off"
+
+    # --- Fuente de eventos ---
+
+    def _start_observer(self, root: str) -> bool:
+        """Intenta usar watchdog (eventos del SO). False si no está disponible o la ruta es de red."""
+        if is_network_path(root):
+            return False
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+        q = self._queue
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                for p in (getattr(event, "src_path", None), getattr(event, "dest_path", None)):
+                    if p and not _is_ignored(p):
+                        q.put(os.fsdecode(p))
+
+        try:
+            observer = Observer()
+            observer.schedule(_Handler(), root, recursive=True)
+            observer.daemon = True
+            observer.start()
+        except Exception as e:
+            logger.warning("fs_watcher[%s]: watchdog no disponible para %s (%s); se usa sondeo", self.name, root, e)
+            return False
+        self._observer = observer
+        return True
+
+    def _stop_observer(self) -> None:
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+                self._observer.join(timeout=5)
+            except Exception:
+                pass
+            self._observer = None
+
+    def _source_loop(self) -> None:
+        """Comprueba la ruta configurada y, en modo sondeo, encola los cambios detectados en cada ciclo."""
+        while not self._stop.is_set():
+            try:
+                root = (self.get_root() or "").strip() or None
+                if root and not os.path.isdir(root):
+                    root = None
+                if root != self._root:
+                    self._stop_observer()
+                    self._snapshot = None
+                    self._root = root
+                    self.mode = "off"
+                    if root:
+                        if self._start_observer(root):
+                            self.mode = "events"
+                        else:
+                            self._snapshot = _DirSnapshot(root, self.max_depth)
+                            self._snapshot.poll()  # foto inicial: no genera cambios
+                            self.mode = "poll"
+                elif self._snapshot is not None:
+                    for p in self._snapshot.poll():
+                        self._queue.put(p)
+            except Exception as e:
+                logger.warning("fs_watcher[%s]: error al vigilar: %s", self.name, e)
+            self._stop.wait(self.poll_seconds)
+        self._stop_observer()
+
+    # --- Entrega agrupada ---
+
+    def _dispatch_loop(self) -> None:
+        """Agrupa rutas hasta que pasan debounce_seconds sin cambios nuevos y las entrega al callback."""
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            batch = {first}
+            while not self._stop.is_set():
+                try:
+                    batch.add(self._queue.get(timeout=self.debounce_seconds))
+                except queue.Empty:
+                    break
+            root = self._root
+            if not root or self._stop.is_set():
+                continue
+            try:
+                self.on_changes(root, sorted(batch))
+            except Exception as e:
+                logger.warning("fs_watcher[%s]: error procesando %d cambios: %s", self.name, len(batch), e)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for target in (self._source_loop, self._dispatch_loop):
+            t = threading.Thread(target=target, name=f"fs_watcher-{self.name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+
+    def status(self) -> dict:
+        return {"name": self.name, "root": self._root, "mode": self.mode, "pending": self._queue.qsize()}
@@ -0,0 +1,265 @@
+"""
+Gestor de tareas en segundo plano (sync, sync-reset, refresco del catálogo, escaneo de RMA especiales, mantenimiento).
+- Colas con nombre y límite de tareas simultáneas por cola (JOBS_LIMITS, por defecto 1): dos recargas o dos escaneos
+  no se ejecutan a la vez contra la misma BD y el mismo NAS; la segunda espera en cola.
+- Una tarea idéntica (misma clave) que aún espera en cola no se duplica: se devuelve la que ya hay.
+- Cancelación cooperativa: cancel() marca la tarea y checkpoint() lanza JobCancelled en el siguiente punto de
+  control; la transacción abierta se deshace (get_connection no hace commit si sale con excepción).
+- shutdown(): no acepta más tareas, cancela las pendientes, pide cancelar las que corren y espera a que terminen
+  (JOBS_SHUTDOWN_TIMEOUT_SECONDS) en lugar de matar los hilos a mitad de una transacción.
+- Tareas periódicas (every): se encolan como una tarea más, sin acumularse si la anterior sigue pendiente.
+- El estado de las tareas terminadas se guarda JOBS_RESULT_TTL_SECONDS para que el navegador lo lea.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable
+
+
+def _parse_limits(raw: str) -> dict[str, int]:
+    """'catalogo=1,rma_excel=1' -> {'catalogo': 1, 'rma_excel': 1}; entradas mal formadas se ignoran."""
+    out: dict[str, int] = {}
+    for part in (raw or "").split(","):
+        name, _sep, value = part.partition("=")
+        try:
+            out[name.strip()] = max(1, int(value))
+        except ValueError:
+            continue
+    return out
+
+
+JOBS_LIMITS = _parse_limits(os.environ.get("JOBS_LIMITS", ""))
+JOBS_SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get("JOBS_SHUTDOWN_TIMEOUT_SECONDS", "30") or 0)
+JOBS_RESULT_TTL_SECONDS = float(os.environ.get("JOBS_RESULT_TTL_SECONDS", "3600") or 0)
+
+_PUBLIC_FIELDS = ("status", "percent", "message", "result")
+_FINISHED = ("done", "error", "cancelled")
+
+
+class JobCancelled(BaseException):
+    """
+    Se lanza en un punto de control de una tarea cancelada. Hereda de BaseException (como asyncio.CancelledError)
+    para que los `except Exception` de las tareas no la traten como un error ni guarden un estado de fallo.
+    """
+
+
+class JobRunner:
+    """Colas por nombre con límite de concurrencia, deduplicación de pendientes, cancelación y apagado ordenado."""
+
+    def __init__(self, limits: dict[str, int] | None = None, default_limit: int = 1, result_ttl: float = JOBS_RESULT_TTL_SECONDS):
+        self.limits = dict(JOBS_LIMITS if limits is None else limits)
+        self.default_limit = max(1, default_limit)
+        self.result_ttl = result_ttl
+        self._cond = threading.Condition()
+        self._jobs: dict[str, dict] = {}
+        self._pending: dict[str, deque[str]] = {}
+        self._running: dict[str, int] = {}
+        self._threads: set[threading.Thread] = set()
+        self._closed = False
+        self._periodic: list[dict] = []
+        self._periodic_stop = threading.Event()
+        self._periodic_thread: threading.Thread | None = None
+        self._stats = {"submitted": 0, "deduplicated": 0, "done": 0, "error": 0, "cancelled": 0}
+
+    def limit(self, queue: str) -> int:
+        return self.limits.get(queue, self.default_limit)
+
+    def submit(
+        self,
+        queue: str,
+        fn: Callable[..., None],
+        *args,
+        key=None,
+        owner: str | None = None,
+        message: str = "Iniciando...",
+    ) -> tuple[str, bool]:
+        """
+        Encola fn(task_id, *args) en la cola indicada. Devuelve (task_id, creada); si ya hay una pendiente con la
+        misma clave se devuelve esa con creada=False. RuntimeError si el gestor se está apagando.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("El servidor se está deteniendo; inténtalo de nuevo en unos segundos.")
+            self._prune()
+            pending = self._pending.setdefault(queue, deque())
+            if key is not None:
+                for other in pending:
+                    if self._jobs[other]["key"] == key:
+                        self._stats["deduplicated"] += 1
+                        return other, False
+            task_id = str(uuid.uuid4())
+            self._jobs[task_id] = {
+                "status": "queued",
+                "percent": 0,
+                "message": message,
+                "result": None,
+                "queue": queue,
+                "key": key,
+                "owner": owner,
+                "fn": fn,
+                "args": args,
+                "cancel": threading.Event(),
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+            self._stats["submitted"] += 1
+            if self._running.get(queue, 0) < self.limit(queue):
+                self._start_worker(queue, task_id)
+            else:
+                pending.append(task_id)
+                self._jobs[task_id]["message"] = "En cola: espera a que termine otra tarea del mismo tipo..."
+            return task_id, True
+
+    def _start_worker(self, queue: str, task_id: str) -> None:
+        """Con el lock tomado. Un hilo por tarea en marcha; al terminar sigue con la siguiente pendiente de su cola."""
+        self._running[queue] = self._running.get(queue, 0) + 1
+        self._jobs[task_id]["status"] = "running"
+        t = threading.Thread(target=self._worker, args=(queue, task_id), name=f"job_{queue}", daemon=True)
+        self._threads.add(t)
+        t.start()
+
+    def _worker(self, queue: str, task_id: str | None) -> None:
+        while task_id is not None:
+            self._execute(task_id)
+            with self._cond:
+                pending = self._pending.get(queue)
+                task_id = pending.popleft() if pending and not self._closed else None
+                if task_id is not None:
+                    self._jobs[task_id].update(status="running", message="Iniciando...")
+                else:
+                    self._running[queue] -= 1
+                    self._threads.discard(threading.current_thread())
+                    self._cond.notify_all()
+
+    def _execute(self, task_id: str) -> None:
+        with self._cond:
+            job = self._jobs[task_id]
+            fn, args = job["fn"], job["args"]
+        final = None
+        try:
+            if job["cancel"].is_set():
+                raise JobCancelled()
+            fn(task_id, *args)
+        except JobCancelled:
+            final = {"status": "cancelled", "message": "Cancelada"}
+        except Exception as e:
+            final = {"status": "error", "percent": 0, "message": str(e), "result": None}
+        with self._cond:
+            if final is not None:
+                job.update(final)
+            elif job["status"] not in _FINISHED:
+                job.update(status="done", percent=100)
+            job.update(fn=None, args=(), finished_at=time.time())  # suelta los argumentos (p. ej. el Excel subido)
+            self._stats[job["status"]] = self._stats.get(job["status"], 0) + 1
+
+    def update(self, task_id: str, **fields) -> None:
+        with self._cond:
+            job = self._jobs.get(task_id)
+            if job is not None:
+                job.update(fields)
+
+    def checkpoint(self, task_id: str) -> None:
+        """Punto de cancelación: JobCancelled si se pidió cancelar la tarea."""
+        with self._cond:
+            job = self._jobs.get(task_id)
+            cancel = job["cancel"] if job is not None else None
+        if cancel is not None and cancel.is_set():
+            raise JobCancelled()
+
+    def get(self, task_id: str) -> dict | None:
+        """Estado público (status, percent, message, result) y cola; None si no existe o ya caducó."""
+        with self._cond:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return None
+            out = {k: job[k] for k in _PUBLIC_FIELDS}
+            out["queue"] = job["queue"]
+            out["owner"] = job["owner"]
+            return out
+
+    def cancel(self, task_id: str) -> str | None:
+        """
+        Cancela una tarea: si espera en cola se quita y queda 'cancelled'; si está en marcha se marca y para en su
+        siguiente punto de control. Devuelve el estado resultante (None si no existe).
+        """
+        with self._cond:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                self._pending[job["queue"]].remove(task_id)
+                job.update(status="cancelled", message="Cancelada", fn=None, args=(), finished_at=time.time())
+                self._stats["cancelled"] += 1
+            elif job["status"] == "running":
+                job["cancel"].set()
+                job["message"] = "Cancelando..."
+            return job["status"]
+
+    def _prune(self) -> None:
+        """Con el lock tomado. Olvida las tareas terminadas hace más de result_ttl."""
+        limit = time.time() - self.result_ttl
+        old = [tid for tid, j in self._jobs.items() if j["finished_at"] is not None and j["finished_at"] < limit]
+        for tid in old:
+            del self._jobs[tid]
+
+    def every(self, queue: str, name: str, interval: float, fn: Callable[[str], None]) -> None:
+        """Encola fn(task_id) al arrancar start_periodic y después cada interval segundos (clave ('every', name))."""
+        self._periodic.append({"queue": queue, "name": name, "interval": interval, "fn": fn, "next": 0.0})
+
+    def start_periodic(self) -> None:
+        if not self._periodic or self._periodic_thread is not None:
+            return
+        self._periodic_stop.clear()
+        self._periodic_thread = threading.Thread(target=self._run_periodic, name="job_periodic", daemon=True)
+        self._periodic_thread.start()
+
+    def _run_periodic(self) -> None:
+        while not self._periodic_stop.is_set():
+            now = time.monotonic()
+            for p in self._periodic:
+                if now >= p["next"]:
+                    p["next"] = now + p["interval"]
+                    try:
+                        self.submit(p["queue"], p["fn"], key=("every", p["name"]), owner="sistema")
+                    except RuntimeError:
+                        return
+            wait = min(p["next"] for p in self._periodic) - time.monotonic()
+            self._periodic_stop.wait(max(1.0, wait))
+
+    def shutdown(self, timeout: float = JOBS_SHUTDOWN_TIMEOUT_SECONDS) -> None:
+        """Apagado ordenado: cancela lo pendiente, pide cancelar lo que corre y espera hasta timeout segundos."""
+        self._periodic_stop.set()
+        with self._cond:
+            self._closed = True
+            for queue, pending in self._pending.items():
+                while pending:
+                    job = self._jobs[pending.popleft()]
+                    job.update(status="cancelled", message="Servidor detenido", fn=None, args=(), finished_at=time.time())
+                    self._stats["cancelled"] += 1
+            for job in self._jobs.values():
+                if job["status"] == "running":
+                    job["cancel"].set()
+            deadline = time.monotonic() + timeout
+            while self._threads:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+        if self._periodic_thread is not None:
+            self._periodic_thread.join(1.0)
+            self._periodic_thread = None
+
+    def status(self) -> dict:
+        with self._cond:
+            queues = {}
+            for queue in sorted(set(self._pending) | set(self._running)):
+                queues[queue] = {
+                    "running": self._running.get(queue, 0),
+                    "pending": len(self._pending.get(queue, ())),
+                    "limit": self.limit(queue),
+                }
+            return {**self._stats, "queues": queues, "tracked": len(self._jobs), "closed": self._closed}
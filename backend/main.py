@@ -2,40 +2,62 @@
 API Garantías: usuarios (auth), RMA/productos/clientes en base de datos.
 Carga de Excel: contrasta con la BD y solo añade registros nuevos.
 El Excel de sincronización puede ser una ruta fija (p. ej. QNAP) o subida manual.
-Tareas largas (sync, sync-reset, catalog refresh) devuelven task_id y reportan progreso vía GET /api/tasks/{task_id}.
+Tareas largas (sync, sync-reset, catalog refresh, escaneo RMA especiales) van al gestor de tareas (job_runner):
+devuelven task_id, reportan progreso vía GET /api/tasks/{task_id} y se cancelan con DELETE /api/tasks/{task_id}.
 Integración Atractor: informe de ventas totalizadas por rango de fechas (configurable desde la app).
 """
 import asyncio
-import base64
 import csv
+import hashlib
 import io
 import json
+import mimetypes
 import os
-import ssl
 import threading
-import urllib.error
-import urllib.request
+import time
 import sys
-import uuid
 from collections import defaultdict
-from datetime import datetime
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime
 from pathlib import Path
-from urllib.parse import urlencode, unquote
+from typing import Callable
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote, urlencode, unquote
 
 from dotenv import load_dotenv
 load_dotenv(Path(__file__).resolve().parent / ".env")
 
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
+from fastapi import Depends, FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import pandas as pd
 import numpy as np
 from pydantic import BaseModel
 
-from auth import router as auth_router, get_current_username, get_password_hash
+from auth import (
+    router as auth_router,
+    get_current_username,
+    get_current_user,
+    get_password_hash,
+    create_stream_token,
+    get_username_from_stream_token,
+    STREAM_TOKEN_EXPIRE_SECONDS,
+    hash_pool_status,
+    invalidate_principal,
+)
 from hosts_config import get_server_ip
-from productos_catalogo import get_productos_catalogo
+from catalog_search import CatalogSearchIndex
+from productos_catalogo import ScanProfiler, get_productos_catalogo, get_productos_catalogo_cambios
+from fs_watcher import FolderWatcher, WATCHER_ENABLED
+from file_cache import CatalogFileCache
+from preview_cache import ExcelPreviewCache
+from unread_hub import UnreadCounterHub
+from job_runner import JobRunner
+from atractor_client import AtractorClient, AtractorError, SalesRowMerger, month_ranges
+from push_delivery import PUSH_WORKERS, PushDeliveryWorker, pywebpush_sender
 from database import (
     get_connection,
     get_all_rma_items,
@@ -46,7 +68,14 @@ from database import (
     insert_audit_log,
     list_audit_log,
     get_catalog_cache,
+    get_catalog_scanned_at,
     set_catalog_cache,
+    update_catalog_products,
+    catalog_file_is_indexed,
+    list_catalog_product_types,
+    assign_catalog_product_type,
+    clear_catalog_product_types,
+    rename_catalog_product_type,
     insert_rma_item,
     rma_item_exists,
     delete_all_rma_items,
@@ -73,24 +102,45 @@ from database import (
     update_password_by_id,
     count_admins,
     delete_user,
-    user_is_admin,
     get_notifications_for_user,
     get_notifications_sent_by_user,
+    archive_old_notifications,
+    NOTIFICATIONS_PAGE_SIZE,
     count_unread_notifications,
     set_en_revision_at,
     get_rma_items_en_revision,
     save_push_subscription,
-    get_push_subscriptions_for_user,
-    create_notification,
+    get_push_subscriptions_for_users,
+    delete_push_subscription,
+    create_notifications,
+    get_unread_counts_for_users,
+    get_unread_count_version,
+    get_users_by_ids,
     mark_notification_read,
     soft_delete_notification_by_sender,
     restore_notification_by_sender,
     get_all_rma_especiales,
     get_rma_especial_by_id,
-    get_rma_especial_by_rma_number,
+    get_rma_especial_lineas_page,
+    get_rma_especial_estado_counts,
     get_all_rma_especial_formats,
     add_rma_especial_format,
-    insert_rma_especial,
+    upsert_rma_especiales,
+    get_rma_especial_manifest,
+    upsert_rma_especial_manifest,
+    delete_rma_especial_manifest,
+    save_rma_especial_scan_results,
+    get_rma_especial_scan_results,
+    count_rma_especial_scan_results,
+    update_rma_especial_scan_result,
+    delete_rma_especial_scan_result,
+    prune_rma_especial_scan_results,
+    get_rma_especial_header_grids,
+    get_atractor_cache,
+    save_atractor_cache,
+    get_atractor_cache_status,
+    save_rma_especial_header_grids,
+    delete_rma_especial_header_grids,
     update_rma_especial_estado,
     update_rma_especial_linea_estado,
     update_rma_especial_linea,
@@ -149,15 +199,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Tareas en segundo plano (sync, sync-reset, catalog refresh) con progreso en tiempo real
-_tasks: dict[str, dict] = {}
-_tasks_lock = threading.Lock()
+# Tareas en segundo plano con progreso en tiempo real. Colas: rma_excel (sync y sync-reset escriben la misma tabla),
+# catalogo, rma_especiales y mantenimiento; una tarea a la vez por cola salvo que JOBS_LIMITS diga otra cosa.
+_jobs = JobRunner()
+# Hilos que leen Excel en paralelo en el escaneo de RMA especiales (la lectura espera sobre todo a la red/SMB)
+RMA_ESPECIALES_SCAN_WORKERS = max(1, int(os.environ.get("RMA_ESPECIALES_SCAN_WORKERS", "4") or 4))
+# RMA especiales importados por transacción durante el escaneo
+RMA_ESPECIALES_IMPORT_BATCH = max(1, int(os.environ.get("RMA_ESPECIALES_IMPORT_BATCH", "50") or 50))
 
 
 def _update_task(task_id: str, **kwargs) -> None:
-    with _tasks_lock:
-        if task_id in _tasks:
-            _tasks[task_id] = {**_tasks[task_id], **kwargs}
+    """
+    Actualiza el progreso de una tarea. Las actualizaciones intermedias (sin status) son puntos de cancelación:
+    si se pidió cancelar lanza JobCancelled y la transacción abierta se deshace.
+    """
+    _jobs.update(task_id, **kwargs)
+    if "status" not in kwargs:
+        _jobs.checkpoint(task_id)
+
+
+def _submit_task(queue: str, fn, *args, key=None, username: str | None = None, message: str = "Iniciando...") -> dict:
+    """Encola una tarea en el gestor; con key, una idéntica que ya espera en cola no se duplica. 503 si se está apagando."""
+    try:
+        task_id, _created = _jobs.submit(queue, fn, *args, key=key, owner=username, message=message)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"task_id": task_id}
+
+
+@app.on_event("startup")
+def start_job_runner():
+    _jobs.start_periodic()
+
+
+@app.on_event("shutdown")
+def stop_job_runner():
+    """Cancela lo pendiente y espera a que las tareas en marcha paren en su siguiente punto de control."""
+    _jobs.shutdown()
 
 
 # Mapeo de posibles nombres de columna en Excel a nuestras claves internas
@@ -307,11 +385,11 @@ def _run_sync_reset_task(task_id: str, excel_path: str) -> None:
             return
         total = len(df)
         _update_task(task_id, percent=5, message="Borrando registros anteriores...")
-        with get_connection() as conn:
-            delete_all_rma_items(conn)
         loaded = 0
         seen: set[tuple[str, str]] = set()  # (rma_number, serial) para evitar duplicados del Excel
+        # Borrado y carga en una sola transacción: si se cancela o falla a mitad, queda la lista anterior
         with get_connection() as conn:
+            delete_all_rma_items(conn)
             for idx, row in df.iterrows():
                 rma = _value(row.get(col_map.get("rma_number")))
                 serial = _value(row.get(col_map.get("serial"))) if col_map.get("serial") else None
@@ -385,18 +463,14 @@ async def recargar_rma_desde_excel(username: str = Depends(get_current_username)
         )
     if not os.path.isfile(path_str):
         raise HTTPException(status_code=400, detail=f"La ruta no es un archivo: {path_str}")
-    task_id = str(uuid.uuid4())
-    with _tasks_lock:
-        _tasks[task_id] = {"status": "running", "percent": 0, "message": "Iniciando...", "result": None}
-    threading.Thread(target=_run_sync_reset_task, args=(task_id, excel_path), daemon=True).start()
-    return {"task_id": task_id}
+    return _submit_task("rma_excel", _run_sync_reset_task, excel_path, key=("sync_reset", path_str), username=username)
 
 
 @app.get("/api/tasks/{task_id}")
 def get_task_progress(task_id: str):
-    """Devuelve el progreso de una tarea (sync, sync-reset, catalog refresh)."""
-    with _tasks_lock:
-        t = _tasks.get(task_id)
+    """Devuelve el progreso de una tarea (sync, sync-reset, catalog refresh, escaneo). status: queued, running,
+    done, error, cancelled o not_found."""
+    t = _jobs.get(task_id)
     if t is None:
         return {"status": "not_found", "percent": 0, "message": "", "result": None}
     return {
@@ -407,6 +481,21 @@ def get_task_progress(task_id: str):
     }
 
 
+@app.delete("/api/tasks/{task_id}")
+def cancelar_tarea(task_id: str, user: dict = Depends(get_current_user)):
+    """
+    Cancela una tarea: si espera en cola se descarta; si está en marcha para en su siguiente punto de control y
+    deshace la transacción abierta. Solo quien la lanzó o un administrador.
+    """
+    t = _jobs.get(task_id)
+    if t is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    if t["owner"] != user["username"] and not user["is_admin"]:
+        raise HTTPException(status_code=403, detail="Solo quien lanzó la tarea o un administrador puede cancelarla")
+    status = _jobs.cancel(task_id)
+    return {"task_id": task_id, "status": status}
+
+
 def _run_sync_task(task_id: str, excel_path: str | None, file_content: bytes | None) -> None:
     """Ejecuta sync (añadir solo nuevos) en segundo plano. La ruta Excel viene ya normalizada desde settings."""
     try:
@@ -507,11 +596,8 @@ async def sincronizar_excel(
             raise HTTPException(status_code=400, detail=f"No se encuentra el archivo o la ruta. Comprueba que el servidor tiene acceso. Ruta: {path_str}")
         if not os.path.isfile(path_str):
             raise HTTPException(status_code=400, detail=f"La ruta no es un archivo: {path_str}")
-    task_id = str(uuid.uuid4())
-    with _tasks_lock:
-        _tasks[task_id] = {"status": "running", "percent": 0, "message": "Iniciando...", "result": None}
-    threading.Thread(target=_run_sync_task, args=(task_id, excel_path, file_content), daemon=True).start()
-    return {"task_id": task_id}
+    key = ("sync", hashlib.sha1(file_content).hexdigest()) if file_content is not None else ("sync", path_str)
+    return _submit_task("rma_excel", _run_sync_task, excel_path, file_content, key=key, username=username)
 
 
 class EstadoBody(BaseModel):
@@ -719,11 +805,11 @@ class SettingsBody(BaseModel):
 @app.patch("/api/settings")
 def actualizar_settings(
     body: SettingsBody,
-    username: str = Depends(get_current_username),
+    user: dict = Depends(get_current_user),
 ):
     """Guarda las rutas de catálogo, Excel, RMA especiales y configuración de Atractor. Solo administradores pueden cambiar las rutas."""
     with get_connection() as conn:
-        if user_is_admin(conn, username):
+        if user["is_admin"]:
             set_setting(conn, "PRODUCTOS_CATALOG_PATH", _normalize_unc_path(body.PRODUCTOS_CATALOG_PATH or ""))
             set_setting(conn, "EXCEL_SYNC_PATH", _normalize_unc_path(body.EXCEL_SYNC_PATH or ""))
             set_setting(conn, "RMA_ESPECIALES_FOLDER", _normalize_unc_path(body.RMA_ESPECIALES_FOLDER or ""))
@@ -735,7 +821,7 @@ def actualizar_settings(
         set_setting(conn, "ATRACTOR_USER", (body.ATRACTOR_USER or "").strip())
         if (body.ATRACTOR_PASSWORD or "").strip():
             set_setting(conn, "ATRACTOR_PASSWORD", (body.ATRACTOR_PASSWORD or "").strip())
-        insert_audit_log(conn, username, "settings_updated", "settings", "", "Rutas y Atractor")
+        insert_audit_log(conn, user["username"], "settings_updated", "settings", "", "Rutas y Atractor")
     return {"mensaje": "Configuración guardada"}
 
 
@@ -758,9 +844,28 @@ def descargar_certificado(username: str = Depends(get_current_username)):
     return FileResponse(str(cert_path), filename="cert.pem", media_type="application/x-pem-file")
 
 
+def _load_catalog_scan_report(conn, top: int) -> dict | None:
+    """Informe del último escaneo completo del catálogo (tiempos por fase y los `top` directorios/archivos más lentos)."""
+    raw = get_setting(conn, "LAST_CATALOG_SCAN_REPORT")
+    if not raw:
+        return None
+    try:
+        report = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    top = max(0, min(top, 50))
+    report["slowest_dirs"] = (report.get("slowest_dirs") or [])[:top]
+    report["slowest_files"] = (report.get("slowest_files") or [])[:top]
+    return report
+
+
 @app.get("/api/settings/status")
-def obtener_estado_sistema(username: str = Depends(get_current_username)):
-    """Devuelve el estado de la última sincronización RMA y del último refresco de catálogo (para la sección Estado en Configuración)."""
+def obtener_estado_sistema(
+    top: int = 10,
+    username: str = Depends(get_current_username),
+):
+    """Devuelve el estado de la última sincronización RMA y del último refresco de catálogo (para la sección Estado en Configuración).
+    top: cuántos directorios/archivos más lentos del último escaneo del catálogo se incluyen en el informe."""
     with get_connection() as conn:
         return {
             "last_sync_at": get_setting(conn, "LAST_SYNC_AT") or "",
@@ -769,6 +874,16 @@ def obtener_estado_sistema(username: str = Depends(get_current_username)):
             "last_catalog_at": get_setting(conn, "LAST_CATALOG_AT") or "",
             "last_catalog_status": get_setting(conn, "LAST_CATALOG_STATUS") or "",
             "last_catalog_message": get_setting(conn, "LAST_CATALOG_MESSAGE") or "",
+            "last_catalog_scan_report": _load_catalog_scan_report(conn, top),
+            "watchers": [w.status() for w in _watchers],
+            "catalog_file_cache": _catalog_files.status(),
+            "rma_especiales_preview_cache": _excel_previews.status(),
+            "auth_hash_pool": hash_pool_status(),
+            "jobs": _jobs.status(),
+            "notifications_unread_stream": _unread_hub.status(),
+            "push_delivery": _push_worker.status(),
+            "atractor_client": _atractor.status(),
+            "atractor_cache": {**get_atractor_cache_status(conn), "max_bytes": ATRACTOR_CACHE_MAX_BYTES},
         }
 
 
@@ -950,19 +1065,8 @@ def _especial_columns_from_headers(headers: list[str], aliases: dict) -> dict:
     return result
 
 
-def _get_excel_sheet_names(path: str) -> list[str]:
-    """Devuelve la lista de nombres de hojas del Excel."""
-    try:
-        xl = pd.ExcelFile(path)
-        return list(xl.sheet_names)
-    except Exception:
-        return []
-
-
-def _read_excel_grid(path: str, max_rows: int = 20, max_cols: int = 30, sheet: int | str = 0) -> list[list[str]]:
-    """Lee solo las primeras filas y columnas del Excel (más rápido). sheet: índice 0-based o nombre de hoja."""
-    df = _read_excel_with_engine(path, sheet_name=sheet, header=None, nrows=max_rows)
-    df = df.replace({np.nan: None})
+def _grid_from_df(df: pd.DataFrame, max_rows: int = 20, max_cols: int = 30) -> list[list[str]]:
+    """Primeras filas y columnas de una hoja leída con header=None, como texto ('' en celdas vacías)."""
     rows = []
     for ri in range(min(max_rows, len(df))):
         row = []
@@ -976,6 +1080,144 @@ def _read_excel_grid(path: str, max_rows: int = 20, max_cols: int = 30, sheet: i
     return rows
 
 
+class _ExcelWorkbook:
+    """
+    Excel abierto una sola vez (escaneo/importación de RMA especiales). Para buscar el formato y sacar la cabecera
+    solo se leen las primeras filas de cada hoja (grid); las líneas se recorren en streaming con iter_rows sobre el
+    mismo libro (openpyxl en modo solo lectura), sin cargar la hoja entera en un DataFrame.
+    Usar con `with` para cerrar el archivo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._xl: pd.ExcelFile | None = None
+        self._sheets: dict[int | str, pd.DataFrame] = {}
+        self._heads: dict[int | str, tuple[int, pd.DataFrame]] = {}  # hoja -> (filas pedidas, primeras filas)
+        self._errors: dict[int | str, Exception] = {}
+
+    def __enter__(self) -> "_ExcelWorkbook":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._xl is not None:
+            try:
+                self._xl.close()
+            except Exception:
+                pass
+            self._xl = None
+
+    def _open(self) -> pd.ExcelFile:
+        if self._xl is None:
+            engine = "xlrd" if os.path.splitext(self.path)[1].lower() == ".xls" else None
+            try:
+                self._xl = pd.ExcelFile(self.path, engine=engine)
+            except ImportError:
+                _read_excel_with_engine(self.path, nrows=0)  # lanza el mismo error claro si falta xlrd
+                raise
+        return self._xl
+
+    def _parse(self, sheet: int | str, nrows: int | None = None) -> pd.DataFrame:
+        """Hoja sin cabecera (NaN -> None). Una hoja inexistente falla siempre igual sin reintentar."""
+        if sheet in self._errors:
+            raise self._errors[sheet]
+        try:
+            return self._open().parse(sheet_name=sheet, header=None, nrows=nrows).replace({np.nan: None})
+        except Exception as e:
+            self._errors[sheet] = e
+            raise
+
+    def sheet(self, sheet: int | str = 0) -> pd.DataFrame:
+        """Hoja completa sin cabecera (solo para .xls sin streaming o quien necesite el DataFrame)."""
+        df = self._sheets.get(sheet)
+        if df is None:
+            df = self._sheets[sheet] = self._parse(sheet)
+        return df
+
+    def grid(self, sheet: int | str = 0, max_rows: int = 20, max_cols: int = 30) -> list[list[str]]:
+        """Primeras filas y columnas de la hoja como texto; si la hoja no se ha leído entera, solo se leen esas filas."""
+        df = self._sheets.get(sheet)
+        if df is None:
+            head = self._heads.get(sheet)
+            if head is None or head[0] < max_rows:
+                head = self._heads[sheet] = (max_rows, self._parse(sheet, nrows=max_rows))
+            df = head[1]
+        return _grid_from_df(df, max_rows, max_cols)
+
+    def sheet_names(self) -> list[str]:
+        return list(self._open().sheet_names)
+
+    def iter_rows(self, sheet: int | str = 0, start_row: int = 0):
+        """
+        Filas de la hoja (tuplas de valores, None en celdas vacías) a partir de start_row (0-based), en streaming.
+        Los valores se convierten como los lee pandas (números enteros como int, errores de Excel como vacío) y las
+        filas vacías del final se descartan, así el resultado es el mismo que con la hoja entera en un DataFrame.
+        """
+        xl = self._open()
+        if sheet in self._sheets or getattr(xl, "engine", None) != "openpyxl":
+            df = self.sheet(sheet)
+            yield from df.iloc[start_row:].itertuples(index=False, name=None)
+            return
+        if sheet in self._errors:
+            raise self._errors[sheet]
+        try:
+            book = xl.book
+            ws = book.worksheets[sheet] if isinstance(sheet, int) else book[sheet]
+        except (IndexError, KeyError) as e:
+            self._errors[sheet] = e
+            raise
+        if getattr(book, "read_only", False):
+            ws.reset_dimensions()
+        empty_rows = 0
+        for row in islice(ws.rows, start_row, None):
+            values = tuple(_openpyxl_cell_value(c) for c in row)
+            if all(v is None for v in values):
+                empty_rows += 1  # solo se devuelven si después hay filas con datos
+                continue
+            for _ in range(empty_rows):
+                yield ()
+            empty_rows = 0
+            yield values
+
+    def header_grids(self, max_rows: int = 20, max_cols: int = 30) -> dict:
+        """Nombres de hojas y rejillas de las hojas ya leídas (por índice), para guardarlas en rma_especial_header_grids."""
+        grids = {s: self.grid(s, max_rows, max_cols) for s in {**self._heads, **self._sheets} if isinstance(s, int)}
+        try:
+            sheet_names = self.sheet_names() if self._xl is not None else None
+        except Exception:
+            sheet_names = None
+        return {"sheet_names": sheet_names, "grids": grids}
+
+
+def _openpyxl_cell_value(cell):
+    """Valor de una celda de openpyxl como lo deja pandas: vacío/error -> None, float entero -> int."""
+    value = cell.value
+    if value is None or value == "" or getattr(cell, "data_type", None) == "e":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _cell_text(value) -> str | None:
+    """Texto de una celda (None si está vacía o es NaN)."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return str(value).strip() or None
+
+
+def _header_grids_entry(path: str, wb: _ExcelWorkbook) -> dict:
+    """Entrada para save_rma_especial_header_grids con lo leído de un libro abierto."""
+    return {"path": path, "mtime": os.path.getmtime(path), **wb.header_grids()}
+
+
+def _pop_header_grids(items: list[dict]) -> list[dict]:
+    """Saca de las entradas del escaneo las rejillas leídas ("_grids") para guardarlas aparte."""
+    return [g for g in (item.pop("_grids", None) for item in items) if g]
+
+
 def _normalize_cell(s) -> str:
     """Normaliza una celda para comparación; acepta str, int, float (p. ej. desde Excel)."""
     if s is None:
@@ -1006,61 +1248,123 @@ def _find_matching_format(grid_rows: list[list[str]], formats: list[dict]) -> tu
     return None
 
 
-def _find_matching_format_for_path(path: str, formats: list[dict], max_rows: int = 20, max_cols: int = 30) -> tuple[int, int, dict] | None:
+class _FormatIndex:
+    """
+    Índice de las firmas de cabecera de los formatos guardados (se construye una vez por escaneo).
+    Cada formato se guarda por longitud de firma y tupla de celdas normalizadas; cada fila del Excel se
+    normaliza una vez y se busca con un acceso a diccionario por cada longitud distinta (la fila puede tener
+    más celdas que la firma: se compara su prefijo). El resultado es el mismo que probar los formatos en orden.
+    """
+
+    def __init__(self, formats: list[dict]):
+        self.formats: list[dict] = []
+        self._by_len: dict[int, dict[tuple[str, ...], list[int]]] = {}
+        self._sheets: list[list[int]] = []  # hojas candidatas de cada formato, en orden
+        self._min_pos_by_sheet: dict[int, int] = {}  # primer formato (posición) que mira cada hoja
+        for fmt in formats:
+            header_cells = fmt.get("header_cells") or []
+            if not header_cells:
+                continue
+            pos = len(self.formats)
+            self.formats.append(fmt)
+            key = tuple(_normalize_cell(c) for c in header_cells)
+            self._by_len.setdefault(len(key), {}).setdefault(key, []).append(pos)
+            sheet_hint = fmt.get("sheet")
+            if sheet_hint not in (None, ""):
+                try:
+                    sheets = [int(sheet_hint)]
+                except (ValueError, TypeError):
+                    sheets = [0]
+            else:
+                sheets = [0, 1]
+            self._sheets.append(sheets)
+            for si in sheets:
+                self._min_pos_by_sheet.setdefault(si, pos)
+        self._lengths = sorted(self._by_len)
+
+    def __len__(self) -> int:
+        return len(self.formats)
+
+    def _row_hits(self, row_cells: list[str]) -> list[int]:
+        """Posiciones de los formatos cuya firma coincide con la fila."""
+        norm = [_normalize_cell(c) for c in row_cells]
+        hits: list[int] = []
+        for length in self._lengths:
+            key = tuple(norm[:length])
+            if len(key) < length:
+                key = key + ("",) * (length - len(key))
+            hits.extend(self._by_len[length].get(key, ()))
+        return hits
+
+    def match(self, get_grid: Callable[[int], list[list[str]]]) -> tuple[int, int, dict] | None:
+        """
+        (header_row_idx, sheet_idx, formato) del primer formato (en orden) que encaja, o None.
+        get_grid(sheet) devuelve la rejilla de la hoja (o lanza si no existe). Una hoja solo se lee si algún
+        formato anterior al mejor encontrado hasta ahora (o él mismo) la tiene como candidata.
+        """
+        rows_by_sheet: dict[int, dict[int, list[int]]] = {}  # hoja -> formato -> filas que coinciden
+        best: int | None = None
+        for si, min_pos in sorted(self._min_pos_by_sheet.items(), key=lambda kv: (kv[1], kv[0])):
+            if best is not None and min_pos > best:
+                continue
+            try:
+                grid_rows = get_grid(si)
+            except Exception:
+                continue
+            hits: dict[int, list[int]] = {}
+            for row_idx, row_cells in enumerate(grid_rows):
+                for pos in self._row_hits(row_cells):
+                    if si in self._sheets[pos]:
+                        hits.setdefault(pos, []).append(row_idx)
+            rows_by_sheet[si] = hits
+            if hits:
+                first = min(hits)
+                best = first if best is None else min(best, first)
+        if best is None:
+            return None
+        fmt = self.formats[best]
+        for si in self._sheets[best]:
+            rows = rows_by_sheet.get(si, {}).get(best)
+            if not rows:
+                continue
+            header_row = fmt.get("header_row")
+            if isinstance(header_row, int) and header_row in rows:
+                return (header_row, si, fmt)
+            return (rows[0], si, fmt)
+        return None
+
+
+def _find_matching_format_for_path(
+    path: str,
+    formats: list[dict] | _FormatIndex,
+    max_rows: int = 20,
+    max_cols: int = 30,
+    workbook: _ExcelWorkbook | None = None,
+) -> tuple[int, int, dict] | None:
     """
     Busca un formato que encaje para el archivo path inspeccionando hasta dos hojas (0 y 1).
     Devuelve (header_row_idx, sheet_idx, formato) o None.
     Usa header_row y sheet guardados en el formato como pista si están disponibles.
+    formats: lista de formatos o _FormatIndex ya construido (escaneos: una vez para todos los archivos).
+    workbook: libro ya abierto (las hojas leídas aquí se reutilizan después para importar).
     """
+    index = formats if isinstance(formats, _FormatIndex) else _FormatIndex(formats)
+    if not len(index):
+        return None
     grids: dict[int, list[list[str]]] = {}
 
     def get_grid(sheet_idx: int) -> list[list[str]]:
         if sheet_idx in grids:
             return grids[sheet_idx]
-        g = _read_excel_with_engine(path, sheet_name=sheet_idx, header=None, nrows=max_rows)
-        g = g.replace({np.nan: None})
-        rows: list[list[str]] = []
-        for ri in range(min(max_rows, len(g))):
-            row: list[str] = []
-            for ci in range(min(max_cols, len(g.columns))):
-                v = g.iloc[ri, ci]
-                if v is None or (isinstance(v, float) and np.isnan(v)):
-                    row.append("")
-                else:
-                    row.append(str(v).strip())
-            rows.append(row)
+        if workbook is not None:
+            rows = workbook.grid(sheet_idx, max_rows, max_cols)
+        else:
+            g = _read_excel_with_engine(path, sheet_name=sheet_idx, header=None, nrows=max_rows)
+            rows = _grid_from_df(g.replace({np.nan: None}), max_rows, max_cols)
         grids[sheet_idx] = rows
         return rows
 
-    for fmt in formats:
-        header_cells = fmt.get("header_cells") or []
-        if not header_cells:
-            continue
-        sheet_hint = fmt.get("sheet")
-        candidate_sheets: list[int] = []
-        if sheet_hint not in (None, ""):
-            try:
-                si = int(sheet_hint)
-            except (ValueError, TypeError):
-                si = 0
-            candidate_sheets = [si]
-        else:
-            candidate_sheets = [0, 1]
-        for si in candidate_sheets:
-            try:
-                grid_rows = get_grid(si)
-            except Exception:
-                continue
-            if not grid_rows:
-                continue
-            header_row = fmt.get("header_row")
-            if isinstance(header_row, int) and 0 <= header_row < len(grid_rows):
-                if _header_row_matches(grid_rows[header_row], header_cells):
-                    return (header_row, si, fmt)
-            for row_idx, row_cells in enumerate(grid_rows):
-                if _header_row_matches(row_cells, header_cells):
-                    return (row_idx, si, fmt)
-    return None
+    return index.match(get_grid)
 
 
 def _extract_rma_from_filename(path: str | Path) -> str:
@@ -1077,23 +1381,141 @@ def _scan_rma_especiales_folder(base_path: str) -> list[dict]:
     return _scan_rma_especiales_folder_impl(base_path, None)
 
 
+def _rma_especiales_config_sig(formats: list[dict], aliases: dict) -> str:
+    """Firma de los formatos y aliases guardados: si cambia, los Excel no reconocidos se vuelven a leer."""
+    payload = {
+        "formats": [
+            [f.get("header_cells"), f.get("serial_col"), f.get("fallo_col"), f.get("resolucion_col"), f.get("header_row"), f.get("sheet")]
+            for f in formats
+        ],
+        "aliases": {k: sorted(aliases.get(k) or []) for k in ("serial", "fallo", "resolucion")},
+    }
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _rma_especial_manifest_precheck(
+    path: str,
+    size: int,
+    mtime: float,
+    rma_number: str,
+    config_sig: str,
+    existing: dict[str, dict],
+    manifest: dict[str, dict],
+) -> tuple[bool, dict | None, dict | None]:
+    """
+    Decide con el manifiesto si hay que abrir el Excel, sin leerlo.
+    Devuelve (abrir, entrada del resultado o None, entrada del manifiesto o None); si abrir es False ya es el resultado final.
+    - Importado y sin cambios (tamaño, mtime): no se abre.
+    - Importado y modificado después: se abre para reimportarlo si encaja con un formato guardado.
+    - No reconocido y sin cambios, con los mismos formatos/aliases: se devuelve el resultado anterior sin abrirlo.
+    - Errores de lectura/importación: se reintentan siempre (p. ej. archivo abierto en Excel).
+    """
+    prev = manifest.get(path)
+    unchanged = prev is not None and prev["size"] == size and prev["mtime"] == mtime
+    known = existing.get(rma_number)
+    if known is not None:
+        if known.get("source_path") != path:
+            return False, None, None  # Mismo número RMA ya importado desde otro archivo
+        if prev is not None and prev["outcome"] == "imported" and unchanged:
+            return False, None, None
+        if (prev is None or prev["outcome"] != "imported") and known.get("file_date") == datetime.fromtimestamp(mtime).isoformat():
+            # Importado antes de existir el manifiesto (o a mano desde la vista) y sin cambios desde entonces
+            return False, None, _manifest_entry(path, rma_number, size, mtime, "imported", config_sig)
+        return True, None, None
+    if (
+        prev is not None
+        and unchanged
+        and prev["outcome"] == "unmatched"
+        and prev["config_sig"] == config_sig
+        and prev.get("result") is not None
+    ):
+        return False, prev["result"], None
+    return True, None, None
+
+
+def _manifest_entry(path: str, rma_number: str, size: int, mtime: float, outcome: str, config_sig: str, result: dict | None = None) -> dict:
+    return {"path": path, "rma_number": rma_number, "size": size, "mtime": mtime,
+            "outcome": outcome, "config_sig": config_sig, "result": result}
+
+
+def _rma_especial_manifest_outcome(
+    item: dict,
+    reimport: bool,
+    size: int,
+    mtime: float,
+    config_sig: str,
+) -> tuple[dict | None, dict | None]:
+    """Tras abrir (e importar) el Excel: (entrada del resultado o None, entrada del manifiesto o None)."""
+    path, rma_number = item["path"], item["rma_number"]
+    if item.get("imported"):
+        if reimport:
+            item["reimported"] = True
+        return item, _manifest_entry(path, rma_number, size, mtime, "imported", config_sig)
+    if item.get("error"):
+        return item, (None if reimport else _manifest_entry(path, rma_number, size, mtime, "error", config_sig))
+    if reimport:
+        # No encaja con ningún formato guardado (se importó a mano): se conserva lo importado
+        return None, _manifest_entry(path, rma_number, size, mtime, "imported", config_sig)
+    return item, _manifest_entry(path, rma_number, size, mtime, "unmatched", config_sig, item)
+
+
+def _scan_rma_especial_with_manifest(
+    f: Path,
+    size: int,
+    mtime: float,
+    rma_number: str,
+    aliases: dict,
+    formats: list[dict] | _FormatIndex,
+    config_sig: str,
+    existing: dict[str, dict],
+    manifest: dict[str, dict],
+) -> tuple[dict | None, dict | None]:
+    """Versión secuencial (un archivo): comprueba el manifiesto, abre e importa si hace falta."""
+    must_open, item, entry = _rma_especial_manifest_precheck(str(f), size, mtime, rma_number, config_sig, existing, manifest)
+    if not must_open:
+        return item, entry
+    item = _scan_rma_especial_file(f, rma_number, aliases, formats)
+    return _rma_especial_manifest_outcome(item, rma_number in existing, size, mtime, config_sig)
+
+
+def _rma_especial_scan_status(item: dict) -> str:
+    """Estado de una entrada del escaneo para filtrar: imported, error, missing (sin formato) o ready (por importar)."""
+    if item.get("imported"):
+        return "imported"
+    if item.get("error"):
+        return "error"
+    if item.get("missing"):
+        return "missing"
+    return "ready"
+
+
 def _scan_rma_especiales_folder_impl(
     base_path: str,
     update_progress: None | tuple[str, callable],
+    scan_id: str | None = None,
 ) -> list[dict]:
-    """Implementación del escaneo; una sola lectura por archivo (grid con nrows) y progreso detallado."""
+    """
+    Implementación del escaneo con progreso detallado.
+    Con el manifiesto (rma_especial_scan_manifest) solo se abren los Excel nuevos o modificados; la lectura se reparte
+    entre RMA_ESPECIALES_SCAN_WORKERS hilos y las importaciones las escribe solo este hilo, en el orden del listado
+    (mismo resultado que un escaneo secuencial: una entrada por rma_number, gana el primer archivo).
+    Con scan_id las entradas se guardan en rma_especial_scan_results según se conocen (la tarea solo lleva recuentos).
+    """
     task_id, update_fn = update_progress if update_progress else (None, None)
     with get_connection() as conn:
         aliases = _get_rma_especiales_aliases(conn)
         formats = get_all_rma_especial_formats(conn)
-        existing_rma_numbers = {r["rma_number"] for r in get_all_rma_especiales(conn)}
+        existing = {r["rma_number"]: r for r in get_all_rma_especiales(conn)}
+        manifest = get_rma_especial_manifest(conn)
+    config_sig = _rma_especiales_config_sig(formats, aliases)
+    format_index = _FormatIndex(formats)  # una vez para todos los archivos del escaneo
     base = Path(base_path) if base_path else None
     if not base or not base.is_dir():
         return []
-    # Fase 1: listar archivos con progreso por año/mes
+    # Fase 1: listar archivos (con tamaño y mtime) con progreso por año/mes
     if update_fn and task_id:
         update_fn(task_id, percent=0, message="Listando carpetas año / mes...")
-    files_to_scan: list[tuple[Path, str, str]] = []  # (path, year_name, month_name)
+    files_to_scan: list[tuple[Path, str, str, int, float]] = []  # (path, year_name, month_name, size, mtime)
     year_dirs = sorted([d for d in base.iterdir() if d.is_dir()], key=lambda d: d.name)
     for year_dir in year_dirs:
         try:
@@ -1107,42 +1529,159 @@ def _scan_rma_especiales_folder_impl(
                 continue
             if update_fn and task_id:
                 update_fn(task_id, percent=0, message=f"Recorriendo {year_dir.name} / {month_dir.name}...")
-            for f in month_dir.iterdir():
-                if f.suffix.lower() not in (".xlsx", ".xls"):
-                    continue
-                if f.name.startswith("~$"):
-                    continue
-                rma_number = _extract_rma_from_filename(f)
-                if rma_number:
-                    files_to_scan.append((f, year_dir.name, month_dir.name))
+            with os.scandir(month_dir) as entries:
+                for e in entries:
+                    if os.path.splitext(e.name)[1].lower() not in (".xlsx", ".xls"):
+                        continue
+                    if e.name.startswith("~$"):
+                        continue
+                    f = Path(e.path)
+                    rma_number = _extract_rma_from_filename(f)
+                    if not rma_number:
+                        continue
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    files_to_scan.append((f, year_dir.name, month_dir.name, st.st_size, st.st_mtime))
     total = len(files_to_scan)
     if update_fn and task_id:
         update_fn(
             task_id,
             percent=1,
-            message=f"Encontrados {total} archivos. Leyendo cada Excel (solo primeras filas)...",
+            message=f"Encontrados {total} archivos. Leyendo los Excel nuevos o modificados...",
         )
-    if total == 0:
-        return []
-    # Fase 2: leer cada Excel una sola vez (grid con nrows=20) y progreso por archivo. Solo una entrada por rma_number.
-    out = []
-    shown_rma_numbers = set()
-    for idx, (f, year_name, month_name) in enumerate(files_to_scan):
-        if update_fn and task_id:
-            pct = 1 + int(97 * (idx + 1) / total)
-            update_fn(
-                task_id,
-                percent=min(pct, 98),
-                message=f"Leyendo Excel ({idx + 1}/{total}): {year_name} / {month_name} / {f.name}",
-            )
-        rma_number = _extract_rma_from_filename(f)
-        if rma_number in existing_rma_numbers:
-            continue
-        try:
-            matched = _find_matching_format_for_path(str(f), formats, max_rows=20, max_cols=30)
+    # Fase 2: decidir con el manifiesto y leer en paralelo solo los Excel que lo necesitan. Las lecturas se
+    # encargan con una ventana de 2 × RMA_ESPECIALES_SCAN_WORKERS por delante de la que se está recogiendo: un
+    # archivo lento no deja a los demás hilos leer (y guardar en memoria) el resto de la carpeta.
+    plans: list[tuple[bool, dict | None, dict | None]] = []
+    for f, _year, _month, size, mtime in files_to_scan:
+        plans.append(_rma_especial_manifest_precheck(
+            str(f), size, mtime, _extract_rma_from_filename(f), config_sig, existing, manifest
+        ))
+    to_read = [i for i, plan in enumerate(plans) if plan[0]]
+    futures: dict[int, Future] = {}  # posición en files_to_scan -> lectura encargada y aún no recogida
+    next_read = 0
+    read_ahead = 2 * RMA_ESPECIALES_SCAN_WORKERS
+    pool = ThreadPoolExecutor(max_workers=RMA_ESPECIALES_SCAN_WORKERS, thread_name_prefix="rma_especiales_scan")
+
+    def submit_reads() -> None:
+        nonlocal next_read
+        while next_read < len(to_read) and len(futures) < read_ahead:
+            i = to_read[next_read]
+            f = files_to_scan[i][0]
+            futures[i] = pool.submit(_read_rma_especial_file, f, _extract_rma_from_filename(f), aliases, format_index)
+            next_read += 1
+
+    try:
+        submit_reads()
+
+        # Fase 3: recoger en el orden del listado; un único escritor en BD que importa por lotes
+        # (RMA_ESPECIALES_IMPORT_BATCH RMA por transacción)
+        out = []
+        shown_rma_numbers = set()
+        manifest_entries: list[dict] = []
+        header_grids: list[dict] = []
+        pending: list[tuple[dict, bool, int, float]] = []  # (entrada con "_import", reimportación, tamaño, mtime)
+        first_pending_pos: int | None = None  # posición en out de la primera entrada aún por escribir en BD
+        saved = 0  # entradas de out ya guardadas en rma_especial_scan_results
+        last_push = 0.0
+        with get_connection() as conn:
+            if scan_id:
+                prune_rma_especial_scan_results(conn, scan_id)
+
+            def flush() -> None:
+                nonlocal first_pending_pos
+                if not pending:
+                    return
+                _write_rma_especial_imports(conn, [p[0] for p in pending])
+                conn.commit()
+                for item_p, reimport, size_p, mtime_p in pending:
+                    _item, entry_p = _rma_especial_manifest_outcome(item_p, reimport, size_p, mtime_p, config_sig)
+                    if entry_p is not None:
+                        manifest_entries.append(entry_p)
+                pending.clear()
+                first_pending_pos = None
+
+            def save_results() -> None:
+                """Guarda las entradas ya definitivas (hasta la primera pendiente de importar en el lote)."""
+                nonlocal saved
+                ready = len(out) if first_pending_pos is None else first_pending_pos
+                if not scan_id or ready <= saved:
+                    return
+                save_rma_especial_scan_results(
+                    conn, scan_id, [(seq, _rma_especial_scan_status(out[seq]), out[seq]) for seq in range(saved, ready)]
+                )
+                conn.commit()
+                saved = ready
+
+            for idx, ((f, year_name, month_name, size, mtime), (must_open, item, entry)) in enumerate(zip(files_to_scan, plans)):
+                rma_number = _extract_rma_from_filename(f)
+                known = existing.get(rma_number)
+                if must_open:
+                    item = futures.pop(idx).result()
+                    submit_reads()
+                    header_grids.extend(_pop_header_grids([item]))
+                    if known is not None and known.get("source_path") != str(f):
+                        item, entry = None, None  # Importado en este escaneo desde un archivo anterior
+                    elif "_import" in item:
+                        # Se escribe con el lote; cuenta ya como importado para descartar duplicados posteriores
+                        pending.append((item, known is not None, size, mtime))
+                        if first_pending_pos is None and rma_number not in shown_rma_numbers:
+                            first_pending_pos = len(out)
+                        existing[rma_number] = {"source_path": str(f), "file_date": datetime.fromtimestamp(mtime).isoformat()}
+                        entry = None
+                        if len(pending) >= RMA_ESPECIALES_IMPORT_BATCH:
+                            flush()
+                    else:
+                        item, entry = _rma_especial_manifest_outcome(item, known is not None, size, mtime, config_sig)
+                elif item is not None and known is not None and known.get("source_path") != str(f):
+                    item, entry = None, None
+                if entry is not None:
+                    manifest_entries.append(entry)
+                if item is not None and rma_number not in shown_rma_numbers:
+                    shown_rma_numbers.add(rma_number)
+                    out.append(item)
+                if update_fn and task_id:
+                    pct = 1 + int(97 * (idx + 1) / total)
+                    progress = {
+                        "percent": min(pct, 98),
+                        "message": f"Leyendo Excel ({idx + 1}/{total}): {year_name} / {month_name} / {f.name}",
+                    }
+                    now = time.monotonic()
+                    if scan_id and (now - last_push >= 0.5 or idx + 1 == total):
+                        # Resultados parciales para la vista mientras sigue el escaneo (como mucho 2 veces por segundo):
+                        # se guardan en BD y la tarea solo lleva el identificador y cuántas entradas hay ya
+                        last_push = now
+                        save_results()
+                        progress["result"] = {"scan_id": scan_id, "total": saved, "partial": True}
+                    update_fn(task_id, **progress)
+            flush()
+            save_results()
+            listed = {str(f) for f, *_rest in files_to_scan}
+            upsert_rma_especial_manifest(conn, manifest_entries)
+            save_rma_especial_header_grids(conn, header_grids)
+            gone = [p for p in manifest if p not in listed]
+            delete_rma_especial_manifest(conn, gone)
+            delete_rma_especial_header_grids(conn, gone)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return out
+
+
+def _read_rma_especial_file(f: Path, rma_number: str, aliases: dict, formats: list[dict] | _FormatIndex) -> dict:
+    """
+    Lectura de un Excel de RMA especial (sin BD, se puede ejecutar en paralelo). Si encaja con un formato guardado,
+    la entrada lleva en "_import" las líneas ya extraídas para que las guarde _write_rma_especial_import; si no,
+    devuelve cabeceras y columnas reconocidas por aliases. En "_grids" van las rejillas de cabecera leídas
+    (las guarda quien llama con save_rma_especial_header_grids).
+    """
+    try:
+        with _ExcelWorkbook(str(f)) as wb:
+            matched = _find_matching_format_for_path(str(f), formats, max_rows=20, max_cols=30, workbook=wb)
             if matched is not None:
                 header_row_idx, sheet_idx, fmt = matched
-                grid = _read_excel_grid(str(f), max_rows=20, max_cols=30, sheet=sheet_idx)
+                grid = wb.grid(sheet_idx, max_rows=20, max_cols=30)
                 header_cells = grid[header_row_idx] if header_row_idx < len(grid) else []
                 serial_col = fmt.get("serial_col", 0)
                 fallo_col = fmt.get("fallo_col", 0)
@@ -1150,59 +1689,163 @@ def _scan_rma_especiales_folder_impl(
                 serial_name = header_cells[serial_col] if serial_col < len(header_cells) else None
                 fallo_name = header_cells[fallo_col] if fallo_col < len(header_cells) else None
                 resolucion_name = header_cells[resolucion_col] if resolucion_col < len(header_cells) else None
-                try:
-                    with get_connection() as conn:
-                        nid = _import_rma_especial_excel_by_indices(
-                            str(f), rma_number, header_row_idx, serial_col, fallo_col, resolucion_col, conn
-                        )
-                    existing_rma_numbers.add(rma_number)
-                    if rma_number not in shown_rma_numbers:
-                        shown_rma_numbers.add(rma_number)
-                        out.append({
-                            "path": str(f),
-                            "rma_number": rma_number,
-                            "headers": header_cells,
-                            "mapped": {"serial": serial_name, "fallo": fallo_name, "resolucion": resolucion_name},
-                            "missing": [],
-                            "imported": True,
-                            "id": nid,
-                        })
-                except Exception as imp_e:
-                    if rma_number not in shown_rma_numbers:
-                        shown_rma_numbers.add(rma_number)
-                        out.append({
-                            "path": str(f),
-                            "rma_number": rma_number,
-                            "headers": header_cells,
-                            "mapped": {"serial": serial_name, "fallo": fallo_name, "resolucion": resolucion_name},
-                            "missing": [],
-                            "imported": False,
-                            "error": str(imp_e),
-                        })
-            else:
-                if rma_number not in shown_rma_numbers:
-                    shown_rma_numbers.add(rma_number)
-                    headers = [str(c).strip() if c is not None else "" for c in (grid[0] if grid else [])]
-                    mapped = _especial_columns_from_headers(headers, aliases)
-                    missing = [k for k in ("serial", "fallo", "resolucion") if mapped[k] is None]
-                    out.append({
-                        "path": str(f),
-                        "rma_number": rma_number,
-                        "headers": headers,
-                        "mapped": {k: (mapped[k] if mapped[k] is not None else None) for k in ("serial", "fallo", "resolucion")},
-                        "missing": missing,
-                    })
-        except Exception as e:
-            if rma_number not in shown_rma_numbers:
-                shown_rma_numbers.add(rma_number)
-                out.append({
+                item = {
                     "path": str(f),
                     "rma_number": rma_number,
-                    "headers": [],
-                    "mapped": {"serial": None, "fallo": None, "resolucion": None},
-                    "missing": ["serial", "fallo", "resolucion"],
-                    "error": str(e),
-                })
+                    "headers": header_cells,
+                    "mapped": {"serial": serial_name, "fallo": fallo_name, "resolucion": resolucion_name},
+                    "missing": [],
+                }
+                try:
+                    lineas = list(_rma_especial_lineas_from_rows(
+                        wb.iter_rows(sheet_idx, header_row_idx + 1), serial_col, fallo_col, resolucion_col
+                    ))
+                    file_date = datetime.fromtimestamp(os.path.getmtime(str(f))).isoformat()
+                    item["_import"] = {"lineas": lineas, "file_date": file_date}
+                except Exception as imp_e:
+                    item["imported"] = False
+                    item["error"] = str(imp_e)
+                item["_grids"] = _header_grids_entry(str(f), wb)
+                return item
+            grid = wb.grid(0, max_rows=20, max_cols=30)
+            headers = [str(c).strip() if c is not None else "" for c in (grid[0] if grid else [])]
+            mapped = _especial_columns_from_headers(headers, aliases)
+            missing = [k for k in ("serial", "fallo", "resolucion") if mapped[k] is None]
+            return {
+                "path": str(f),
+                "rma_number": rma_number,
+                "headers": headers,
+                "mapped": {k: (mapped[k] if mapped[k] is not None else None) for k in ("serial", "fallo", "resolucion")},
+                "missing": missing,
+                "_grids": _header_grids_entry(str(f), wb),
+            }
+    except Exception as e:
+        return {
+            "path": str(f),
+            "rma_number": rma_number,
+            "headers": [],
+            "mapped": {"serial": None, "fallo": None, "resolucion": None},
+            "missing": ["serial", "fallo", "resolucion"],
+            "error": str(e),
+        }
+
+
+def _write_rma_especial_imports(conn, items: list[dict]) -> None:
+    """
+    Escribe en BD un lote de lo leído por _read_rma_especial_file (un solo hilo escritor) y marca en cada
+    entrada imported/id o error. El lote va en un SAVEPOINT; si falla, se repite uno a uno para aislar el RMA
+    que da error sin perder el resto. El commit lo hace quien llama.
+    """
+    batch = [(item, item.pop("_import")) for item in items if "_import" in item]
+
+    def rows(part):
+        return [
+            {"rma_number": item["rma_number"], "source_path": item["path"], "lineas": data["lineas"], "file_date": data["file_date"]}
+            for item, data in part
+        ]
+
+    def write(part) -> None:
+        conn.execute("SAVEPOINT rma_especiales_import")
+        try:
+            ids = upsert_rma_especiales(conn, rows(part))
+        except Exception:
+            conn.execute("ROLLBACK TO rma_especiales_import")
+            conn.execute("RELEASE rma_especiales_import")
+            raise
+        conn.execute("RELEASE rma_especiales_import")
+        for (item, _data), nid in zip(part, ids):
+            item["imported"] = True
+            item["id"] = nid
+
+    if not batch:
+        return
+    try:
+        write(batch)
+    except Exception:
+        for one in batch:
+            try:
+                write([one])
+            except Exception as e:
+                one[0]["imported"] = False
+                one[0]["error"] = str(e)
+
+
+def _write_rma_especial_import(conn, item: dict) -> dict:
+    """Escritura en BD de una sola entrada leída por _read_rma_especial_file. Marca imported/id o error."""
+    _write_rma_especial_imports(conn, [item])
+    return item
+
+
+def _scan_rma_especial_file(f: Path, rma_number: str, aliases: dict, formats: list[dict] | _FormatIndex) -> dict:
+    """
+    Procesa un Excel de RMA especial: si encaja con un formato guardado lo importa; si no, devuelve
+    cabeceras y columnas reconocidas por aliases. Devuelve la entrada del resultado del escaneo.
+    """
+    item = _read_rma_especial_file(f, rma_number, aliases, formats)
+    header_grids = _pop_header_grids([item])
+    if "_import" in item or header_grids:
+        with get_connection() as conn:
+            save_rma_especial_header_grids(conn, header_grids)
+            if "_import" in item:
+                _write_rma_especial_import(conn, item)
+    return item
+
+
+def _rma_especial_file_in_layout(base: Path, f: Path) -> bool:
+    """True si f es un Excel de RMA especial en base / año / mes (misma estructura que recorre el escaneo)."""
+    if f.suffix.lower() not in (".xlsx", ".xls") or f.name.startswith("~$"):
+        return False
+    try:
+        rel = f.relative_to(base)
+    except ValueError:
+        return False
+    if len(rel.parts) != 3:
+        return False
+    try:
+        int(rel.parts[0])
+    except ValueError:
+        return False
+    return True
+
+
+def _import_rma_especiales_changed(base_path: str, changed_paths: list[str]) -> list[dict]:
+    """
+    Importador incremental de RMA especiales (vigilancia de carpetas): procesa solo los Excel cambiados,
+    con las mismas reglas del manifiesto que el escaneo completo (nuevos, no reconocidos y reimportación).
+    """
+    base = Path(base_path)
+    with get_connection() as conn:
+        aliases = _get_rma_especiales_aliases(conn)
+        formats = get_all_rma_especial_formats(conn)
+        existing = {r["rma_number"]: r for r in get_all_rma_especiales(conn)}
+        manifest = get_rma_especial_manifest(conn)
+    config_sig = _rma_especiales_config_sig(formats, aliases)
+    format_index = _FormatIndex(formats)
+    out = []
+    manifest_entries: list[dict] = []
+    for raw in changed_paths:
+        f = Path(raw)
+        if not _rma_especial_file_in_layout(base, f):
+            continue
+        try:
+            st = f.stat()
+        except OSError:
+            continue
+        rma_number = _extract_rma_from_filename(f)
+        if not rma_number:
+            continue
+        item, entry = _scan_rma_especial_with_manifest(
+            f, st.st_size, st.st_mtime, rma_number, aliases, format_index, config_sig, existing, manifest
+        )
+        if entry is not None:
+            manifest_entries.append(entry)
+        if item is None:
+            continue
+        if item.get("imported"):
+            existing[rma_number] = {"source_path": str(f), "file_date": datetime.fromtimestamp(st.st_mtime).isoformat()}
+        out.append(item)
+    with get_connection() as conn:
+        upsert_rma_especial_manifest(conn, manifest_entries)
     return out
 
 
@@ -1211,13 +1854,15 @@ def _run_rma_especiales_scan_task(task_id: str, base_path: str) -> None:
     try:
         _update_task(task_id, percent=0, message="Listando carpetas año / mes...")
         update_progress = (task_id, lambda tid, **kw: _update_task(tid, **kw))
-        items = _scan_rma_especiales_folder_impl(base_path, update_progress)
+        items = _scan_rma_especiales_folder_impl(base_path, update_progress, scan_id=task_id)
+        with get_connection() as conn:
+            counts = count_rma_especial_scan_results(conn, task_id)
         _update_task(
             task_id,
             status="done",
             percent=100,
             message="Completado",
-            result={"items": items, "total": len(items)},
+            result={"scan_id": task_id, "total": len(items), "counts": counts},
         )
     except FileNotFoundError as e:
         _update_task(task_id, status="error", percent=0, message=f"Carpeta no encontrada: {e}", result=None)
@@ -1227,6 +1872,22 @@ def _run_rma_especiales_scan_task(task_id: str, base_path: str) -> None:
         _update_task(task_id, status="error", percent=0, message=str(e), result=None)
 
 
+def _excel_header_names(cells) -> list[str]:
+    """Nombres de columna de una fila de cabecera como los pone pandas (header=0): vacías 'Unnamed: n', repetidas 'X.1'."""
+    names: list[str] = []
+    counts: dict[str, int] = {}
+    for i, c in enumerate(cells):
+        name = f"Unnamed: {i}" if c is None or c == "" else str(c)
+        cur = counts.get(name, 0)
+        while cur > 0:
+            counts[name] = cur + 1
+            name = f"{name}.{cur}"
+            cur = counts.get(name, 0)
+        counts[name] = cur + 1
+        names.append(name)
+    return names
+
+
 def _import_rma_especial_excel(
     path: str,
     rma_number: str,
@@ -1236,35 +1897,29 @@ def _import_rma_especial_excel(
     conn,
     sheet: int | str = 0,
 ) -> int:
-    """Lee el Excel en path (hoja sheet) y crea/actualiza el RMA especial. col_* son los nombres de columna. Devuelve id."""
-    df = _read_excel_with_engine(path, sheet_name=sheet, header=0)
-    df = df.replace({np.nan: None})
-    lineas = []
-    for _, row in df.iterrows():
-        def v(c):
-            if c is None:
-                return None
-            x = row.get(c)
-            if x is None or (isinstance(x, float) and np.isnan(x)):
-                return None
-            return str(x).strip() or None
-        ref_proveedor = None
-        for col in df.columns:
-            if str(col).strip() and col not in (col_serial, col_fallo, col_resolucion):
-                ref_proveedor = v(col)
-                if ref_proveedor:
-                    break
-        lineas.append({
-            "ref_proveedor": ref_proveedor,
-            "serial": v(col_serial),
-            "fallo": v(col_fallo),
-            "resolucion": v(col_resolucion),
-        })
-    existing = get_rma_especial_by_rma_number(conn, rma_number)
-    if existing:
-        delete_rma_especial(conn, existing["id"])
-    file_date = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
-    return insert_rma_especial(conn, rma_number=rma_number, source_path=path, lineas=lineas, file_date=file_date)
+    """
+    Lee el Excel en path (hoja sheet, cabecera en la fila 0) y crea/actualiza el RMA especial. col_* son los nombres
+    de columna. Las filas se leen en streaming y se escriben por bloques. Devuelve id.
+    """
+    with _ExcelWorkbook(path) as wb:
+        rows = wb.iter_rows(sheet)
+        header = next(rows, ())
+        names = _excel_header_names(header)
+
+        def col_index(name: str | None) -> int:
+            if not name:
+                return -1
+            for i, n in enumerate(names):
+                if n == name or n.strip() == name.strip():
+                    return i
+            return -1
+
+        sc, fc, rc = col_index(col_serial), col_index(col_fallo), col_index(col_resolucion)
+        # Columnas con cabecera en blanco (solo espacios) no cuentan para ref_proveedor, como en la lectura con pandas
+        blank = {i for i, c in enumerate(header) if isinstance(c, str) and c and not c.strip()}
+        lineas = _rma_especial_lineas_from_rows(rows, sc, fc, rc, skip_cols=blank)
+        file_date = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+        return _save_rma_especial(conn, rma_number, path, lineas, file_date)
 
 
 def _import_rma_especial_excel_by_indices(
@@ -1276,42 +1931,66 @@ def _import_rma_especial_excel_by_indices(
     resolucion_col: int,
     conn,
     sheet: int | str = 0,
+    workbook: _ExcelWorkbook | None = None,
 ) -> int:
-    """Importa un RMA especial usando la fila header_row como cabecera y los índices de columna (0-based). sheet: hoja del Excel."""
-    df = _read_excel_with_engine(path, sheet_name=sheet, header=None)
-    df = df.replace({np.nan: None})
-    lineas = []
-    for ri in range(header_row + 1, len(df)):
-        def cell(col_idx: int):
-            if col_idx < 0 or col_idx >= len(df.columns):
-                return None
-            v = df.iloc[ri, col_idx]
-            if v is None or (isinstance(v, float) and np.isnan(v)):
-                return None
-            return str(v).strip() or None
+    """
+    Importa un RMA especial usando la fila header_row como cabecera y los índices de columna (0-based). sheet: hoja del Excel.
+    workbook: libro ya abierto (escaneo) para no volver a abrir el archivo. Las filas se leen en streaming.
+    """
+    file_date = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+    if workbook is not None:
+        lineas = _rma_especial_lineas_from_rows(
+            workbook.iter_rows(sheet, header_row + 1), serial_col, fallo_col, resolucion_col
+        )
+        return _save_rma_especial(conn, rma_number, path, lineas, file_date)
+    with _ExcelWorkbook(path) as wb:
+        lineas = _rma_especial_lineas_from_rows(wb.iter_rows(sheet, header_row + 1), serial_col, fallo_col, resolucion_col)
+        return _save_rma_especial(conn, rma_number, path, lineas, file_date)
+
+
+def _rma_especial_lineas_from_rows(
+    rows,
+    serial_col: int,
+    fallo_col: int,
+    resolucion_col: int,
+    skip_cols: set[int] | frozenset[int] = frozenset(),
+):
+    """
+    Líneas de un RMA especial (generador) a partir de las filas bajo la cabecera (tuplas de valores, columnas 0-based).
+    ref_proveedor: primera celda con valor de la fila fuera de las columnas mapeadas (y de skip_cols); se recorre la
+    tupla y se para en la primera con valor, que casi siempre es la primera columna.
+    """
+    excluded = {serial_col, fallo_col, resolucion_col} | set(skip_cols)
+
+    def cell(row: tuple, col_idx: int):
+        return _cell_text(row[col_idx]) if 0 <= col_idx < len(row) else None
+
+    for row in rows:
         ref_proveedor = None
-        for ci in range(len(df.columns)):
-            if ci in (serial_col, fallo_col, resolucion_col):
+        for ci, value in enumerate(row):
+            if ci in excluded:
                 continue
-            ref_proveedor = cell(ci)
+            ref_proveedor = _cell_text(value)
             if ref_proveedor:
                 break
-        lineas.append({
+        yield {
             "ref_proveedor": ref_proveedor,
-            "serial": cell(serial_col),
-            "fallo": cell(fallo_col),
-            "resolucion": cell(resolucion_col),
-        })
-    existing = get_rma_especial_by_rma_number(conn, rma_number)
-    if existing:
-        delete_rma_especial(conn, existing["id"])
-    file_date = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
-    return insert_rma_especial(conn, rma_number=rma_number, source_path=path, lineas=lineas, file_date=file_date)
+            "serial": cell(row, serial_col),
+            "fallo": cell(row, fallo_col),
+            "resolucion": cell(row, resolucion_col),
+        }
+
+
+def _save_rma_especial(conn, rma_number: str, path: str, lineas: list[dict], file_date: str | None) -> int:
+    """Crea o actualiza el RMA especial (upsert: conserva estado, fechas y estado de las líneas que siguen). Devuelve id."""
+    return upsert_rma_especiales(
+        conn, [{"rma_number": rma_number, "source_path": path, "lineas": lineas, "file_date": file_date}]
+    )[0]
 
 
 @app.get("/api/rma-especiales")
 def listar_rma_especiales(username: str = Depends(get_current_username)):
-    """Lista todos los RMA especiales."""
+    """Lista todos los RMA especiales (con line_count y estado_counts: líneas por estado, '' = sin estado)."""
     with get_connection() as conn:
         return get_all_rma_especiales(conn)
 
@@ -1326,6 +2005,33 @@ def obtener_rma_especial(rma_especial_id: int, username: str = Depends(get_curre
     return item
 
 
+@app.get("/api/rma-especiales/{rma_especial_id:int}/lineas")
+def listar_lineas_rma_especial(
+    rma_especial_id: int,
+    after_id: int = 0,
+    limit: int = 200,
+    estado: str | None = None,
+    username: str = Depends(get_current_username),
+):
+    """
+    Líneas de un RMA especial paginadas por keyset: las siguientes a after_id (0 = desde el principio), en orden.
+    estado: solo las de ese estado ('' = sin estado). next_after_id es el after_id de la página siguiente
+    (None si no hay más). estado_counts: líneas por estado de todo el RMA.
+    """
+    limit = max(1, min(int(limit), 1000))
+    with get_connection() as conn:
+        if conn.execute("SELECT 1 FROM rma_especiales WHERE id = ?", (rma_especial_id,)).fetchone() is None:
+            raise HTTPException(status_code=404, detail="RMA especial no encontrado")
+        lineas = get_rma_especial_lineas_page(conn, rma_especial_id, after_id, limit, estado)
+        estado_counts = get_rma_especial_estado_counts(conn, rma_especial_id)
+    return {
+        "lineas": lineas,
+        "next_after_id": lineas[-1]["id"] if len(lineas) == limit else None,
+        "estado_counts": estado_counts,
+        "line_count": sum(estado_counts.values()),
+    }
+
+
 class RmaEspecialEstadoBody(BaseModel):
     estado: str = ""
 
@@ -1421,17 +2127,65 @@ def _path_under_rma_especiales_folder(conn, path_str: str) -> bool:
     return path_abs.startswith(folder_abs) or path_str.startswith(folder.rstrip(os.sep))
 
 
-@app.get("/api/rma-especiales/excel-preview")
-def excel_preview_rma_especial(
-    path: str,
-    sheet: int | str | None = None,
-    username: str = Depends(get_current_username),
-):
+_excel_previews = ExcelPreviewCache()
+
+
+def _excel_preview(path_str: str, sheet: int | str | None) -> tuple[list[str], int, list[list[str]]]:
     """
-    Devuelve los nombres de hojas y una vista en grid del Excel para la hoja indicada.
-    sheet: índice 0-based o nombre de hoja; por defecto 0 (primera hoja).
+    (nombres de hojas, índice de hoja, grid) para la vista previa. Se sirve de _excel_previews por (ruta, mtime, hoja);
+    si falta algo, el Excel se abre una sola vez para sacar las hojas y el grid, y la rejilla leída se guarda también
+    en rma_especial_header_grids (para el recheck).
     """
-    path_str = (unquote(path) if path else "").strip().replace("/", os.sep)
+    mtime = os.path.getmtime(path_str)
+    sheet_names = _excel_previews.get(path_str, mtime, None)
+    wb = None
+    try:
+        if sheet_names is None:
+            wb = _ExcelWorkbook(path_str)
+            try:
+                sheet_names = wb.sheet_names()
+                _excel_previews.put(path_str, mtime, None, sheet_names)
+            except Exception:
+                sheet_names = []  # Sin cachear: el grid dará el error (o se reintenta en la próxima petición)
+        if sheet is None:
+            sheet_idx = 0
+        elif isinstance(sheet, int):
+            sheet_idx = max(0, sheet) if sheet_names and sheet < len(sheet_names) else 0
+        else:
+            try:
+                sheet_idx = int(sheet)
+                if sheet_idx < 0 or (sheet_names and sheet_idx >= len(sheet_names)):
+                    sheet_idx = 0
+            except (ValueError, TypeError):
+                sheet_idx = 0
+        rows = _excel_previews.get(path_str, mtime, sheet_idx)
+        if rows is None:
+            if wb is None:
+                wb = _ExcelWorkbook(path_str)
+            rows = wb.grid(sheet_idx)
+            _excel_previews.put(path_str, mtime, sheet_idx, rows)
+            with get_connection() as conn:
+                save_rma_especial_header_grids(
+                    conn, [{"path": path_str, "mtime": mtime, "sheet_names": sheet_names or None, "grids": {sheet_idx: rows}}]
+                )
+    finally:
+        if wb is not None:
+            wb.close()
+    return sheet_names, sheet_idx, rows
+
+
+@app.get("/api/rma-especiales/excel-preview")
+def excel_preview_rma_especial(
+    path: str,
+    sheet: int | str | None = None,
+    username: str = Depends(get_current_username),
+):
+    """
+    Devuelve los nombres de hojas y una vista en grid del Excel para la hoja indicada.
+    sheet: índice 0-based o nombre de hoja; por defecto 0 (primera hoja).
+    Las vistas ya pedidas (mismo archivo sin cambios y misma hoja) salen de la caché en memoria.
+    """
+    path_str = (unquote(path) if path else "").strip().replace("/", os.sep)
     path_str = _normalize_unc_path(path_str)
     if not path_str:
         raise HTTPException(status_code=400, detail="Ruta de archivo no indicada.")
@@ -1447,19 +2201,9 @@ def excel_preview_rma_especial(
         if not _path_under_rma_especiales_folder(conn, path_str):
             raise HTTPException(status_code=403, detail="El archivo no está en la carpeta de RMA especiales configurada.")
     try:
-        sheet_names = _get_excel_sheet_names(path_str)
-        if sheet is None:
-            sheet_idx = 0
-        elif isinstance(sheet, int):
-            sheet_idx = max(0, sheet) if sheet_names and sheet < len(sheet_names) else 0
-        else:
-            try:
-                sheet_idx = int(sheet)
-                if sheet_idx < 0 or (sheet_names and sheet_idx >= len(sheet_names)):
-                    sheet_idx = 0
-            except (ValueError, TypeError):
-                sheet_idx = 0
-        rows = _read_excel_grid(path_str, sheet=sheet_idx)
+        sheet_names, sheet_idx, rows = _excel_preview(path_str, sheet)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"No se pudo leer el Excel: {e}")
     return {"sheet_names": sheet_names or ["Hoja1"], "rows": rows, "path": path_str, "sheet": sheet_idx}
@@ -1470,7 +2214,8 @@ def escanear_rma_especiales(username: str = Depends(get_current_username)):
     """
     Inicia el escaneo de la carpeta RMA especiales en segundo plano.
     Devuelve task_id para consultar progreso en GET /api/tasks/{task_id}.
-    El resultado final incluye items y total.
+    El resultado final incluye scan_id, total y counts; las entradas se piden paginadas a
+    GET /api/rma-especiales/scan/{scan_id}/items.
     """
     with get_connection() as conn:
         folder = (get_setting(conn, "RMA_ESPECIALES_FOLDER") or "").strip()
@@ -1480,11 +2225,37 @@ def escanear_rma_especiales(username: str = Depends(get_current_username)):
     path_str = os.path.normpath(folder) if (os.name == "nt" and folder.startswith("\\\\")) else folder
     if not os.path.isdir(path_str):
         raise HTTPException(status_code=400, detail=f"No se encuentra la carpeta: {path_str}")
-    task_id = str(uuid.uuid4())
-    with _tasks_lock:
-        _tasks[task_id] = {"status": "running", "percent": 0, "message": "Iniciando escaneo...", "result": None}
-    threading.Thread(target=_run_rma_especiales_scan_task, args=(task_id, path_str), daemon=True).start()
-    return {"task_id": task_id}
+    return _submit_task(
+        "rma_especiales", _run_rma_especiales_scan_task, path_str,
+        key=("scan", path_str), username=username, message="Iniciando escaneo...",
+    )
+
+
+_RMA_ESPECIAL_SCAN_STATUSES = ("imported", "missing", "error", "ready")
+
+
+@app.get("/api/rma-especiales/scan/{scan_id}/items")
+def listar_resultado_escaneo_rma_especiales(
+    scan_id: str,
+    estado: str = "",
+    limit: int = 50,
+    offset: int = 0,
+    username: str = Depends(get_current_username),
+):
+    """
+    Entradas de un escaneo de RMA especiales, paginadas y en el orden del listado.
+    estado: imported, missing (formato no reconocido), error o ready (por importar); vacío = todas.
+    Devuelve items, total (con el filtro), counts (por estado, sin filtro), limit y offset.
+    """
+    estado = (estado or "").strip().lower()
+    if estado and estado not in _RMA_ESPECIAL_SCAN_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Estado no válido. Usa: {', '.join(_RMA_ESPECIAL_SCAN_STATUSES)}")
+    limit = max(1, min(int(limit), 500))
+    offset = max(0, int(offset))
+    with get_connection() as conn:
+        items, total = get_rma_especial_scan_results(conn, scan_id, estado or None, limit, offset)
+        counts = count_rma_especial_scan_results(conn, scan_id)
+    return {"items": items, "total": total, "counts": counts, "limit": limit, "offset": offset}
 
 
 class RmaEspecialImportBody(BaseModel):
@@ -1498,6 +2269,7 @@ class RmaEspecialImportBody(BaseModel):
     column_fallo_index: int | None = None
     column_resolucion_index: int | None = None
     sheet: int | str | None = None
+    scan_id: str | None = None
 
 
 @app.post("/api/rma-especiales/import")
@@ -1510,6 +2282,7 @@ def importar_rma_especial(
     Modo 1: Sin mapeo -> intenta auto-detectar (formatos guardados o aliases en fila 0).
     Modo 2: header_row + column_*_index (0-based) -> importa con esa fila como cabecera y guarda el formato para futuros archivos con las mismas celdas.
     Modo 3: column_serial/column_fallo/column_resolucion (nombres de columna) -> importa con cabecera en fila 0 y añade aliases.
+    Con scan_id, el archivo se quita del resultado de ese escaneo.
     """
     path_str = (body.path or "").strip()
     if not path_str or not os.path.isfile(path_str):
@@ -1528,13 +2301,19 @@ def importar_rma_especial(
     sheet_param = body.sheet if body.sheet is not None else 0
 
     with get_connection() as conn:
+        if body.scan_id:
+            # Misma transacción que la importación: si falla, la entrada sigue en el resultado del escaneo
+            delete_rma_especial_scan_result(conn, body.scan_id, path_str)
         if use_indices:
             hr = max(0, int(body.header_row))
             sc = max(0, int(body.column_serial_index))
             fc = max(0, int(body.column_fallo_index))
             rc = max(0, int(body.column_resolucion_index))
-            nid = _import_rma_especial_excel_by_indices(path_str, rma_number, hr, sc, fc, rc, conn, sheet=sheet_param)
-            grid = _read_excel_grid(path_str, sheet=sheet_param)
+            with _ExcelWorkbook(path_str) as wb:
+                grid = wb.grid(sheet_param, max_rows=max(20, hr + 1))
+                nid = _import_rma_especial_excel_by_indices(
+                    path_str, rma_number, hr, sc, fc, rc, conn, sheet=sheet_param, workbook=wb
+                )
             raw_row = grid[hr] if hr < len(grid) else []
             header_cells = [str(c).strip() if c is not None else "" for c in (raw_row or [])]
             add_rma_especial_format(
@@ -1550,12 +2329,15 @@ def importar_rma_especial(
 
         if not body.column_serial and not body.column_fallo and not body.column_resolucion:
             formats = get_all_rma_especial_formats(conn)
-            matched = _find_matching_format_for_path(path_str, formats)
-            if matched is not None:
-                header_row_idx, sheet_idx, fmt = matched
-                sc, fc, rc = fmt["serial_col"], fmt["fallo_col"], fmt["resolucion_col"]
-                nid = _import_rma_especial_excel_by_indices(path_str, rma_number, header_row_idx, sc, fc, rc, conn, sheet=sheet_idx)
-                return {"id": nid, "rma_number": rma_number, "mensaje": "RMA especial importado"}
+            with _ExcelWorkbook(path_str) as wb:
+                matched = _find_matching_format_for_path(path_str, formats, workbook=wb)
+                if matched is not None:
+                    header_row_idx, sheet_idx, fmt = matched
+                    sc, fc, rc = fmt["serial_col"], fmt["fallo_col"], fmt["resolucion_col"]
+                    nid = _import_rma_especial_excel_by_indices(
+                        path_str, rma_number, header_row_idx, sc, fc, rc, conn, sheet=sheet_idx, workbook=wb
+                    )
+                    return {"id": nid, "rma_number": rma_number, "mensaje": "RMA especial importado"}
             df = _read_excel_with_engine(path_str, sheet_name=0, header=0)
             aliases = _get_rma_especiales_aliases(conn)
             mapped = _especial_columns_from_df(df, aliases)
@@ -1591,6 +2373,86 @@ def importar_rma_especial(
 
 class RmaEspecialRecheckBody(BaseModel):
     paths: list[str] = []
+    scan_id: str | None = None
+
+
+def _recheck_rma_especial_path(
+    path_str: str,
+    aliases: dict,
+    formats: list[dict] | _FormatIndex,
+    cached: dict | None = None,
+) -> dict:
+    """
+    Entrada del escaneo de un Excel con los formatos y aliases actuales: path, rma_number, headers, mapped, missing.
+    cached: rejillas guardadas del archivo (get_rma_especial_header_grids); solo se abre el Excel si falta alguna
+    hoja que haya que mirar, y lo leído va en "_grids" para guardarlo.
+    """
+    rma_number = _extract_rma_from_filename(path_str)
+    grids: dict[int, list[list[str]]] = dict((cached or {}).get("grids") or {})
+    sheet_names = (cached or {}).get("sheet_names")
+    wb: _ExcelWorkbook | None = None
+
+    def get_grid(sheet_idx: int) -> list[list[str]]:
+        nonlocal wb
+        if sheet_idx in grids:
+            return grids[sheet_idx]
+        if sheet_names is not None and not 0 <= sheet_idx < len(sheet_names):
+            raise IndexError(f"El Excel no tiene hoja {sheet_idx}")
+        if wb is None:
+            wb = _ExcelWorkbook(path_str)
+        grids[sheet_idx] = wb.grid(sheet_idx)
+        return grids[sheet_idx]
+
+    index = formats if isinstance(formats, _FormatIndex) else _FormatIndex(formats)
+    try:
+        matched = index.match(get_grid) if len(index) else None
+        if matched is not None:
+            header_row_idx, sheet_idx, fmt = matched
+            grid = get_grid(sheet_idx)
+            header_cells = grid[header_row_idx] if header_row_idx < len(grid) else []
+            sc, fc, rc = fmt["serial_col"], fmt["fallo_col"], fmt["resolucion_col"]
+            serial_name = header_cells[sc] if sc < len(header_cells) else None
+            fallo_name = header_cells[fc] if fc < len(header_cells) else None
+            resolucion_name = header_cells[rc] if rc < len(header_cells) else None
+            item = {
+                "path": path_str,
+                "rma_number": rma_number,
+                "headers": header_cells,
+                "mapped": {"serial": serial_name, "fallo": fallo_name, "resolucion": resolucion_name},
+                "missing": [],
+            }
+        else:
+            grid = get_grid(0)
+            headers = [str(c).strip() if c is not None else "" for c in (grid[0] if grid else [])]
+            mapped = _especial_columns_from_headers(headers, aliases)
+            missing = [k for k in ("serial", "fallo", "resolucion") if mapped[k] is None]
+            item = {
+                "path": path_str,
+                "rma_number": rma_number,
+                "headers": headers,
+                "mapped": {k: (mapped[k] if mapped[k] is not None else None) for k in ("serial", "fallo", "resolucion")},
+                "missing": missing,
+            }
+        if wb is not None:
+            item["_grids"] = {
+                "path": path_str,
+                "mtime": os.path.getmtime(path_str),
+                "sheet_names": wb.sheet_names(),
+                "grids": {si: grids[si] for si in grids if si not in ((cached or {}).get("grids") or {})},
+            }
+        return item
+    except Exception as e:
+        return {
+            "path": path_str,
+            "rma_number": rma_number,
+            "headers": [],
+            "mapped": {"serial": None, "fallo": None, "resolucion": None},
+            "missing": ["serial", "fallo", "resolucion"],
+            "error": str(e),
+        }
+    finally:
+        if wb is not None:
+            wb.close()
 
 
 @app.post("/api/rma-especiales/recheck")
@@ -1602,57 +2464,42 @@ def recheck_rma_especiales_columnas(
     Vuelve a intentar reconocer las columnas de los Excel indicados con los aliases actuales
     (p. ej. tras haber asignado columnas en otro archivo, que se añadieron a la lista).
     Devuelve para cada path: path, rma_number, headers, mapped, missing.
+    Con scan_id y sin paths se revisan todas las entradas sin formato reconocido (missing) de ese escaneo,
+    y el resultado guardado del escaneo se actualiza.
+    Las cabeceras salen de rma_especial_header_grids (guardadas al escanear o previsualizar) si el archivo tiene
+    el mismo mtime que cuando se guardaron; si cambió (p. ej. el proveedor corrigió la cabecera) o no hay
+    rejillas, se abre el Excel. Los archivos que ya no existen se omiten.
     """
     paths = [p.strip() for p in (body.paths or []) if p and p.strip()]
-    if not paths:
-        return {"items": []}
     with get_connection() as conn:
         aliases = _get_rma_especiales_aliases(conn)
         formats = get_all_rma_especial_formats(conn)
+        if body.scan_id and not paths:
+            missing_items, _total = get_rma_especial_scan_results(conn, body.scan_id, "missing")
+            paths = [i["path"] for i in missing_items if i.get("path")]
+        cached = get_rma_especial_header_grids(conn, paths)
+    if not paths:
+        return {"items": []}
+    format_index = _FormatIndex(formats)
     out = []
-    for path_str in paths:
-        if not path_str or not os.path.isfile(path_str):
+    for p in paths:
+        if not os.path.isfile(p):
             continue
-        rma_number = _extract_rma_from_filename(path_str)
         try:
-            matched = _find_matching_format_for_path(path_str, formats)
-            if matched is not None:
-                header_row_idx, sheet_idx, fmt = matched
-                grid = _read_excel_grid(path_str, sheet=sheet_idx)
-                header_cells = grid[header_row_idx] if header_row_idx < len(grid) else []
-                sc, fc, rc = fmt["serial_col"], fmt["fallo_col"], fmt["resolucion_col"]
-                serial_name = header_cells[sc] if sc < len(header_cells) else None
-                fallo_name = header_cells[fc] if fc < len(header_cells) else None
-                resolucion_name = header_cells[rc] if rc < len(header_cells) else None
-                out.append({
-                    "path": path_str,
-                    "rma_number": rma_number,
-                    "headers": header_cells,
-                    "mapped": {"serial": serial_name, "fallo": fallo_name, "resolucion": resolucion_name},
-                    "missing": [],
-                })
-            else:
-                df = _read_excel_with_engine(path_str, sheet_name=0, header=0)
-                df = df.replace({np.nan: None})
-                headers = [str(c).strip() for c in df.columns]
-                mapped = _especial_columns_from_df(df, aliases)
-                missing = [k for k in ("serial", "fallo", "resolucion") if mapped[k] is None]
-                out.append({
-                    "path": path_str,
-                    "rma_number": rma_number,
-                    "headers": headers,
-                    "mapped": {k: (mapped[k] if mapped[k] is not None else None) for k in ("serial", "fallo", "resolucion")},
-                    "missing": missing,
-                })
-        except Exception as e:
-            out.append({
-                "path": path_str,
-                "rma_number": rma_number,
-                "headers": [],
-                "mapped": {"serial": None, "fallo": None, "resolucion": None},
-                "missing": ["serial", "fallo", "resolucion"],
-                "error": str(e),
-            })
+            mtime = os.path.getmtime(p)
+        except OSError:
+            continue
+        stored = cached.get(p)
+        out.append(_recheck_rma_especial_path(
+            p, aliases, format_index, stored if stored is not None and stored["mtime"] == mtime else None
+        ))
+    header_grids = _pop_header_grids(out)
+    if body.scan_id or header_grids:
+        with get_connection() as conn:
+            save_rma_especial_header_grids(conn, header_grids)
+            if body.scan_id:
+                for item in out:
+                    update_rma_especial_scan_result(conn, body.scan_id, item["path"], _rma_especial_scan_status(item), item)
     return {"items": out}
 
 
@@ -1727,11 +2574,246 @@ def exportar_clientes_csv(username: str = Depends(get_current_username)):
 class AtractorInformeVentasBody(BaseModel):
     desde: str = ""  # YYYY-MM-DD
     hasta: str = ""  # YYYY-MM-DD
+    refrescar: bool = False  # True: ignora la caché y consulta Atractor (la respuesta nueva sí se guarda)
+
+
+_atractor = AtractorClient()
+
+
+@app.on_event("shutdown")
+async def close_atractor_client():
+    await _atractor.aclose()
+
+
+async def _await_unless_disconnected(request: Request, coro):
+    """Espera la corrutina; si el navegador cierra la conexión antes, la cancela (libera la conexión con Atractor)."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _pending = await asyncio.wait({task}, timeout=0.5)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Petición cancelada por el cliente")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+# Caché de informes en SQLite (sobrevive a reinicios). Rangos cerrados (hasta < hoy) no cambian: TTL largo;
+# si el rango incluye hoy, TTL corto. Caducada pero dentro de la ventana stale: se sirve y se refresca en segundo plano.
+ATRACTOR_CACHE_MAX_BYTES = int(float(os.environ.get("ATRACTOR_CACHE_MB", "64") or 0) * 1024 * 1024)
+ATRACTOR_CACHE_TTL_CLOSED_SECONDS = float(os.environ.get("ATRACTOR_CACHE_TTL_CLOSED_HOURS", "168") or 0) * 3600
+ATRACTOR_CACHE_TTL_OPEN_SECONDS = float(os.environ.get("ATRACTOR_CACHE_TTL_OPEN_SECONDS", "300") or 0)
+ATRACTOR_CACHE_STALE_SECONDS = float(os.environ.get("ATRACTOR_CACHE_STALE_HOURS", "24") or 0) * 3600
+_atractor_revalidating: set[str] = set()
+_atractor_background: set[asyncio.Task] = set()
+
+
+def _atractor_cache_key(url: str, user: str, desde: str, hasta: str) -> str:
+    return hashlib.sha1(json.dumps([url, user, desde, hasta]).encode("utf-8")).hexdigest()
+
+
+def _atractor_cache_ttl(hasta: str) -> float:
+    """TTL según si el rango ya está cerrado (hasta anterior a hoy) o incluye hoy/futuro."""
+    if hasta < datetime.now().strftime("%Y-%m-%d"):
+        return ATRACTOR_CACHE_TTL_CLOSED_SECONDS
+    return ATRACTOR_CACHE_TTL_OPEN_SECONDS
+
+
+def _atractor_cache_info(estado: str, fetched_at: float | None) -> dict:
+    return {
+        "estado": estado,  # hit | stale | miss | bypass | off
+        "fetched_at": datetime.fromtimestamp(fetched_at).isoformat(timespec="seconds") if fetched_at else None,
+    }
+
+
+# Lectura y escritura de la caché síncronas (get_connection, JSON y desalojo LRU): desde las corrutinas se llaman
+# con run_in_threadpool para no parar el bucle de eventos (un informe largo son hasta ~12 tramos a la vez).
+def _read_atractor_cache(key: str, now: float) -> tuple | None:
+    """(datos, fetched_at, expires_at) de la entrada guardada, o None si no hay o el cuerpo no es JSON."""
+    with get_connection() as conn:
+        cached = get_atractor_cache(conn, key, now)
+    if cached is None:
+        return None
+    try:
+        return json.loads(cached["body"]), cached["fetched_at"], cached["expires_at"]
+    except json.JSONDecodeError:
+        return None
+
+
+def _store_atractor_cache(key: str, url: str, desde: str, hasta: str, data, now: float) -> None:
+    with get_connection() as conn:
+        save_atractor_cache(
+            conn, key, url, desde, hasta, json.dumps(data, ensure_ascii=False),
+            now, now + _atractor_cache_ttl(hasta), ATRACTOR_CACHE_MAX_BYTES,
+        )
+
+
+async def _fetch_atractor_cached(key: str, url: str, user: str, password: str, desde: str, hasta: str):
+    """Consulta Atractor y guarda la respuesta (salvo que no sea JSON). Devuelve (datos, fetched_at)."""
+    data = await _atractor.get_json(url, user, password)
+    now = time.time()
+    if ATRACTOR_CACHE_MAX_BYTES > 0 and not (isinstance(data, dict) and set(data) == {"raw"}):
+        await run_in_threadpool(_store_atractor_cache, key, url, desde, hasta, data, now)
+    return data, now
+
+
+def _revalidate_atractor(key: str, url: str, user: str, password: str, desde: str, hasta: str) -> None:
+    """Refresca una entrada caducada en segundo plano (una sola vez por clave aunque lleguen varias peticiones)."""
+    if key in _atractor_revalidating:
+        return
+    _atractor_revalidating.add(key)
+
+    async def _run():
+        try:
+            await _fetch_atractor_cached(key, url, user, password, desde, hasta)
+        except Exception:
+            pass
+        finally:
+            _atractor_revalidating.discard(key)
+
+    task = asyncio.ensure_future(_run())
+    _atractor_background.add(task)
+    task.add_done_callback(_atractor_background.discard)
+
+
+def _atractor_url(base_url: str, desde: str, hasta: str) -> str:
+    sep = "&" if "?" in base_url else "?"
+    return f"{base_url.rstrip('/')}{sep}{urlencode({'desde': desde, 'hasta': hasta})}"
+
+
+async def _atractor_informe(url: str, user: str, password: str, desde: str, hasta: str, refrescar: bool):
+    """Informe de un rango: de la caché (vigente o stale) o consultando Atractor. Devuelve (datos, estado, fetched_at)."""
+    key = _atractor_cache_key(url, user, desde, hasta)
+    if ATRACTOR_CACHE_MAX_BYTES > 0 and not refrescar:
+        now = time.time()
+        cached = await run_in_threadpool(_read_atractor_cache, key, now)
+        if cached is not None and now - cached[2] <= ATRACTOR_CACHE_STALE_SECONDS:
+            data, fetched_at, expires_at = cached
+            if now <= expires_at:
+                return data, "hit", fetched_at
+            _revalidate_atractor(key, url, user, password, desde, hasta)
+            return data, "stale", fetched_at
+
+    data, fetched_at = await _fetch_atractor_cached(key, url, user, password, desde, hasta)
+    estado = "off" if ATRACTOR_CACHE_MAX_BYTES <= 0 else ("bypass" if refrescar else "miss")
+    return data, estado, fetched_at
+
+
+# Rangos de más de ATRACTOR_CHUNK_MIN_DAYS días se piden por meses (0 = nunca) y se devuelven como NDJSON
+ATRACTOR_CHUNK_MIN_DAYS = int(os.environ.get("ATRACTOR_CHUNK_MIN_DAYS", "62") or 0)
+ATRACTOR_STREAM_BATCH = 500
+
+
+def _atractor_tramos(desde: str, hasta: str) -> list[tuple[str, str]]:
+    """Tramos mensuales si el rango es largo; si no (o las fechas no son YYYY-MM-DD), el rango tal cual."""
+    if ATRACTOR_CHUNK_MIN_DAYS <= 0:
+        return [(desde, hasta)]
+    try:
+        dias = (date.fromisoformat(hasta) - date.fromisoformat(desde)).days + 1
+    except ValueError:
+        return [(desde, hasta)]
+    if dias <= ATRACTOR_CHUNK_MIN_DAYS:
+        return [(desde, hasta)]
+    return month_ranges(desde, hasta)
+
+
+def _estado_cache_tramos(estados: list[str]) -> str:
+    """Estado de caché del informe completo a partir del de cada tramo."""
+    if all(e == "hit" for e in estados):
+        return "hit"
+    if all(e in ("hit", "stale") for e in estados):
+        return "stale"
+    for e in ("off", "bypass"):
+        if e in estados:
+            return e
+    return "miss"
+
+
+def _ndjson(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _stream_atractor_tramos(
+    base_url: str, user: str, password: str, desde: str, hasta: str, tramos: list[tuple[str, str]], refrescar: bool,
+):
+    """
+    Informe de un rango largo por meses. Todos los tramos se piden a la vez (AtractorClient limita la concurrencia),
+    cada uno con su propia entrada de caché, y se suman según llegan: en memoria solo quedan las filas ya sumadas.
+    Emite NDJSON: inicio, un evento por tramo, las filas en lotes y fin (o error). Las filas solo se pueden enviar
+    cuando han llegado todos los meses (hasta entonces los totales no son definitivos): lo que llega antes al
+    navegador es el progreso por mes, no filas parciales.
+    Si un tramo no es una lista de filas o tiene columnas numéricas que no son medidas aditivas (ATRACTOR_SUM_FIELDS:
+    medias, precios, porcentajes) no se puede sumar y se pide el rango completo de una vez (evento datos).
+    Si el navegador se desconecta Starlette cancela el generador y el finally cancela los tramos pendientes.
+    """
+
+    async def _tramo(d: str, h: str):
+        data, estado, fetched_at = await _atractor_informe(_atractor_url(base_url, d, h), user, password, d, h, refrescar)
+        return d, h, data, estado, fetched_at
+
+    tasks = [asyncio.ensure_future(_tramo(d, h)) for d, h in tramos]
+    for t in tasks:
+        t.add_done_callback(lambda t: t.cancelled() or t.exception())  # sin avisos de excepción no recogida
+    try:
+        yield _ndjson({"tipo": "inicio", "tramos": len(tramos)})
+        merger = SalesRowMerger()
+        estados: list[str] = []
+        fetched: list[float] = []
+        for fut in asyncio.as_completed(tasks):
+            d, h, data, estado, fetched_at = await fut
+            if not merger.add(data):
+                for t in tasks:
+                    t.cancel()
+                data, estado, fetched_at = await _atractor_informe(
+                    _atractor_url(base_url, desde, hasta), user, password, desde, hasta, refrescar,
+                )
+                yield _ndjson({"tipo": "datos", "datos": data})
+                yield _ndjson({"tipo": "fin", "cache": _atractor_cache_info(estado, fetched_at)})
+                return
+            del data
+            estados.append(estado)
+            fetched.append(fetched_at)
+            yield _ndjson({"tipo": "tramo", "desde": d, "hasta": h, "cache": estado})
+
+        lote = []
+        for row in merger.rows():
+            lote.append(row)
+            if len(lote) >= ATRACTOR_STREAM_BATCH:
+                yield _ndjson({"tipo": "filas", "filas": lote})
+                lote = []
+        if lote:
+            yield _ndjson({"tipo": "filas", "filas": lote})
+        yield _ndjson({
+            "tipo": "fin",
+            "filas": len(merger),
+            "filas_origen": merger.input_rows,
+            "cache": _atractor_cache_info(_estado_cache_tramos(estados), min(fetched) if fetched else None),
+        })
+    except AtractorError as e:
+        yield _ndjson({"tipo": "error", "detail": e.detail[:600]})
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+
+def _atractor_settings() -> tuple[str, str, str]:
+    """(URL, usuario, contraseña) de Atractor. Síncrona: desde rutas async se llama con run_in_threadpool."""
+    with get_connection() as conn:
+        return (
+            (get_setting(conn, "ATRACTOR_URL") or "").strip(),
+            (get_setting(conn, "ATRACTOR_USER") or "").strip(),
+            get_setting(conn, "ATRACTOR_PASSWORD") or "",
+        )
 
 
 @app.post("/api/atractor/informe-ventas")
-def atractor_informe_ventas(
+async def atractor_informe_ventas(
     body: AtractorInformeVentasBody,
+    request: Request,
     username: str = Depends(get_current_username),
 ):
     """
@@ -1739,11 +2821,12 @@ def atractor_informe_ventas(
     Usa la URL, usuario y contraseña configurados en Configuración.
     La URL configurada puede ser la base (ej. https://atractor.example.com) o el endpoint completo;
     se añaden query params desde y hasta si la URL no los lleva.
+    Petición asíncrona con el cliente compartido (pool de conexiones, límite de concurrencia); se cancela si el
+    navegador se desconecta. Respuestas en caché por (URL, usuario, desde, hasta); refrescar=true la ignora.
+    Rangos de más de ATRACTOR_CHUNK_MIN_DAYS días: se piden por meses, se suman aquí y se devuelven como
+    NDJSON (application/x-ndjson) en lugar de un único JSON.
     """
-    with get_connection() as conn:
-        base_url = (get_setting(conn, "ATRACTOR_URL") or "").strip()
-        user = (get_setting(conn, "ATRACTOR_USER") or "").strip()
-        password = get_setting(conn, "ATRACTOR_PASSWORD") or ""
+    base_url, user, password = await run_in_threadpool(_atractor_settings)
 
     if not base_url:
         raise HTTPException(
@@ -1759,44 +2842,88 @@ def atractor_informe_ventas(
             detail="Indica rango de fechas (desde y hasta, formato YYYY-MM-DD).",
         )
 
-    sep = "&" if "?" in base_url else "?"
-    url = f"{base_url.rstrip('/')}{sep}{urlencode({'desde': desde, 'hasta': hasta})}"
-
-    req = urllib.request.Request(url, method="GET")
-    req.add_header("Accept", "application/json")
-    if user or password:
-        cred = base64.b64encode(f"{user}:{password}".encode()).decode()
-        req.add_header("Authorization", f"Basic {cred}")
-
-    try:
-        ctx = ssl.create_default_context()
-        if os.environ.get("ATRACTOR_SSL_VERIFY", "1").lower() in ("0", "false"):
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
-        with urllib.request.urlopen(req, timeout=30, context=ctx) as resp:
-            raw = resp.read().decode()
-    except urllib.error.HTTPError as e:
-        try:
-            detail = e.read().decode()
-        except Exception:
-            detail = str(e)
-        raise HTTPException(status_code=502, detail=f"Atractor respondió con error: {e.code}. {detail[:500]}")
-    except urllib.error.URLError as e:
-        raise HTTPException(status_code=502, detail=f"No se pudo conectar con Atractor: {e.reason}")
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=str(e)[:500])
+    tramos = _atractor_tramos(desde, hasta)
+    if len(tramos) > 1:
+        return StreamingResponse(
+            _stream_atractor_tramos(base_url, user, password, desde, hasta, tramos, body.refrescar),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
     try:
-        data = json.loads(raw)
-    except json.JSONDecodeError:
-        data = {"raw": raw}
+        data, estado, fetched_at = await _await_unless_disconnected(
+            request, _atractor_informe(_atractor_url(base_url, desde, hasta), user, password, desde, hasta, body.refrescar),
+        )
+    except AtractorError as e:
+        raise HTTPException(status_code=502, detail=e.detail[:600])
 
-    return {"ok": True, "datos": data}
+    return {"ok": True, "datos": data, "cache": _atractor_cache_info(estado, fetched_at)}
 
 
 # --- Catálogo de productos (carpeta QNAP: caché en BD; solo lo nuevo con refresh) ---
 
 
+# Índice de búsqueda del catálogo en memoria: se construye al refrescar y se invalida con cada cambio
+_catalog_index: CatalogSearchIndex | None = None
+_catalog_index_gen = 0  # cambia en cada sustitución: un índice construido con datos ya viejos no se guarda
+_catalog_index_lock = threading.Lock()
+
+
+def _set_catalog_index(productos: list[dict] | None) -> None:
+    """
+    Sustituye el índice (None = invalidar; se reconstruye desde la BD en la próxima búsqueda). Llamar después del
+    commit del cambio: una búsqueda que llegue antes reconstruiría con las filas viejas bajo la generación nueva.
+    """
+    global _catalog_index, _catalog_index_gen
+    index = CatalogSearchIndex(productos) if productos is not None else None
+    with _catalog_index_lock:
+        _catalog_index = index
+        _catalog_index_gen += 1
+
+
+def _get_catalog_index() -> tuple[str | None, CatalogSearchIndex | None]:
+    global _catalog_index
+    with _catalog_index_lock:
+        index, gen = _catalog_index, _catalog_index_gen
+    with get_connection() as conn:
+        scanned_at = get_catalog_scanned_at(conn)
+        if scanned_at is None:
+            return None, None
+        if index is None:
+            _scanned_at, productos = get_catalog_cache(conn)
+    if index is None:
+        index = CatalogSearchIndex(productos)
+        with _catalog_index_lock:
+            if gen == _catalog_index_gen:
+                _catalog_index = index
+    return scanned_at, index
+
+
+@app.get("/api/productos-catalogo/buscar")
+def buscar_productos_catalogo(
+    q: str = "",
+    brand: str = "",
+    tipo: str = "",
+    limit: int = 20,
+    offset: int = 0,
+    fuzzy: bool = True,
+    username: str = Depends(get_current_username),
+):
+    """
+    Busca en el catálogo sin descargarlo entero: q por Nº serie base (exacta, prefijo, contiene y difusa por
+    trigramas si fuzzy), brand y tipo filtran (contiene). Devuelve una página (limit máx. 200), el total y
+    recuentos por marca y tipo.
+    """
+    scanned_at, index = _get_catalog_index()
+    if index is None:
+        return {"total": 0, "limit": limit, "offset": offset, "productos": [], "facets": {"brand": [], "product_type": []},
+                "cached": False, "scanned_at": None}
+    result = index.search(q=q, brand=brand, product_type=tipo, limit=min(limit, 200), offset=offset, fuzzy=fuzzy)
+    result["cached"] = True
+    result["scanned_at"] = scanned_at
+    return result
+
+
 @app.get("/api/productos-catalogo")
 def listar_productos_catalogo():
     """Lista productos desde la caché en BD (no rescanear). Si no hay caché, productos vacío y cached=false."""
@@ -1818,7 +2945,7 @@ def listar_tipos_catalogo(username: str = Depends(get_current_username)):
     Combina los tipos existentes en la caché con los tipos extra guardados en settings.
     """
     with get_connection() as conn:
-        _scanned_at, productos = get_catalog_cache(conn)
+        base_types = set(list_catalog_product_types(conn))
         extras_raw = get_setting(conn, "PRODUCT_TYPES_EXTRA") or "[]"
     try:
         extras = json.loads(extras_raw)
@@ -1826,11 +2953,6 @@ def listar_tipos_catalogo(username: str = Depends(get_current_username)):
             extras = []
     except Exception:
         extras = []
-    base_types = {
-        (p.get("product_type") or "").strip()
-        for p in (productos or [])
-        if (p.get("product_type") or "").strip()
-    }
     all_types = sorted(base_types.union({(t or "").strip() for t in extras if (t or "").strip()}))
     return {"tipos": all_types}
 
@@ -1876,20 +2998,10 @@ def asignar_tipo_catalogo(body: CatalogoAsignarTipoBody, username: str = Depends
     if not refs:
         raise HTTPException(status_code=400, detail="Indica al menos un producto.")
     with get_connection() as conn:
-        scanned_at, productos = get_catalog_cache(conn)
-        if scanned_at is None or not productos:
+        if get_catalog_scanned_at(conn) is None:
             raise HTTPException(status_code=400, detail="No hay catálogo en caché. Actualiza el catálogo primero.")
-        changed = 0
-        for p in productos:
-            brand = (p.get("brand") or "").strip()
-            base_serial = (p.get("base_serial") or "").strip()
-            if not brand and not base_serial:
-                continue
-            key = "|".join([v for v in [brand, base_serial] if v])
-            if key in refs:
-                p["product_type"] = tipo
-                changed += 1
-        set_catalog_cache(conn, productos)
+        changed = assign_catalog_product_type(conn, list(refs), tipo)
+    _set_catalog_index(None)  # tras el commit: una búsqueda no puede reconstruir el índice con las filas de antes
     return {"ok": True, "actualizados": changed}
 
 
@@ -1908,15 +3020,7 @@ def borrar_tipos_catalogo(body: CatalogoBorrarTiposBody, username: str = Depends
     if not tipos_norm:
         raise HTTPException(status_code=400, detail="Indica al menos un tipo a borrar.")
     with get_connection() as conn:
-        scanned_at, productos = get_catalog_cache(conn)
-        changed = 0
-        if scanned_at is not None and productos:
-            for p in productos:
-                pt = (p.get("product_type") or "").strip()
-                if pt in tipos_norm:
-                    p["product_type"] = None
-                    changed += 1
-            set_catalog_cache(conn, productos)
+        changed = clear_catalog_product_types(conn, list(tipos_norm))
 
         extras_raw = get_setting(conn, "PRODUCT_TYPES_EXTRA") or "[]"
         try:
@@ -1930,6 +3034,7 @@ def borrar_tipos_catalogo(body: CatalogoBorrarTiposBody, username: str = Depends
         # Solo guardamos si hay cambios
         if extras_filtrados != extras:
             set_setting(conn, "PRODUCT_TYPES_EXTRA", json.dumps(extras_filtrados, ensure_ascii=False))
+    _set_catalog_index(None)
     return {"ok": True, "afectados": changed}
 
 
@@ -1953,15 +3058,7 @@ def renombrar_tipo_catalogo(body: CatalogoRenombrarTipoBody, username: str = Dep
         return {"ok": True, "renombrados": 0}
 
     with get_connection() as conn:
-        scanned_at, productos = get_catalog_cache(conn)
-        changed = 0
-        if scanned_at is not None and productos:
-            for p in productos:
-                pt = (p.get("product_type") or "").strip()
-                if pt == antiguo:
-                    p["product_type"] = nuevo
-                    changed += 1
-            set_catalog_cache(conn, productos)
+        changed = rename_catalog_product_type(conn, antiguo, nuevo)
 
         extras_raw = get_setting(conn, "PRODUCT_TYPES_EXTRA") or "[]"
         try:
@@ -1981,7 +3078,7 @@ def renombrar_tipo_catalogo(body: CatalogoRenombrarTipoBody, username: str = Dep
                     nuevas.append(e)
             extras = nuevas
         set_setting(conn, "PRODUCT_TYPES_EXTRA", json.dumps(extras, ensure_ascii=False))
-
+    _set_catalog_index(None)
     return {"ok": True, "renombrados": changed}
 
 
@@ -1997,10 +3094,20 @@ def _run_catalog_refresh_task(task_id: str, catalog_path: str) -> None:
             else:
                 _update_task(task_id, message=path_rel or ".")
 
-        productos = get_productos_catalogo(catalog_path, on_directory=on_dir)
+        profiler = ScanProfiler()
+        productos = get_productos_catalogo(catalog_path, on_directory=on_dir, profiler=profiler)
         _update_task(task_id, percent=90, message="Guardando en caché...")
+        with profiler.phase("persist"):
+            with get_connection() as conn:
+                set_catalog_cache(conn, productos)
         with get_connection() as conn:
-            set_catalog_cache(conn, productos)
+            # Releer: los tipos asignados a mano prevalecen sobre los de la carpeta
+            _scanned_at, productos = get_catalog_cache(conn)
+            report = profiler.report()
+            report["products"] = len(productos)
+            report["finished_at"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+            set_setting(conn, "LAST_CATALOG_SCAN_REPORT", json.dumps(report, ensure_ascii=False))
+        _set_catalog_index(productos)
         _update_task(
             task_id,
             status="done",
@@ -2042,38 +3149,264 @@ def refrescar_catalogo(username: str = Depends(get_current_username)):
         raise HTTPException(status_code=400, detail=f"No se encuentra la carpeta del catálogo. Comprueba que el servidor tiene acceso a la unidad de red. Ruta: {path_str}")
     if not os.path.isdir(path_str):
         raise HTTPException(status_code=400, detail=f"La ruta del catálogo no es una carpeta: {path_str}")
-    task_id = str(uuid.uuid4())
-    with _tasks_lock:
-        _tasks[task_id] = {"status": "running", "percent": 0, "message": "Iniciando...", "result": None}
-    threading.Thread(target=_run_catalog_refresh_task, args=(task_id, path_str), daemon=True).start()
-    return {"task_id": task_id}
+    return _submit_task("catalogo", _run_catalog_refresh_task, path_str, key=("refresh", path_str), username=username)
+
+
+def _apply_catalog_changes(catalog_path: str, changed_paths: list[str]) -> None:
+    """Importador incremental del catálogo (vigilancia de carpetas): reprocesa solo los productos afectados."""
+    with get_connection() as conn:
+        if get_catalog_scanned_at(conn) is None:
+            return  # Sin un escaneo completo previo no hay catálogo que actualizar
+    productos, removed = get_productos_catalogo_cambios(catalog_path, changed_paths)
+    if not productos and not removed:
+        return
+    with get_connection() as conn:
+        update_catalog_products(conn, productos, removed)
+    _set_catalog_index(None)
+
+
+_catalog_files = CatalogFileCache()
+_FILE_CHUNK = 256 * 1024
+
+
+def _iter_file(f, start: int, length: int, release=None):
+    """Envía length bytes desde start del archivo ya abierto; lo cierra (y llama a release) al terminar o cortarse."""
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(_FILE_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+        if release is not None:
+            release()
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Interpreta 'bytes=inicio-fin' (un solo rango). Devuelve (inicio, fin inclusive) o None si no es válido."""
+    if not header or not header.strip().lower().startswith("bytes=") or size <= 0:
+        return None
+    spec = header.split("=", 1)[1].split(",")[0].strip()
+    start_s, _, end_s = spec.partition("-")
+    try:
+        if not start_s:
+            # Sufijo: los últimos N bytes
+            n = int(end_s)
+            if n <= 0:
+                return None
+            return max(0, size - n), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _file_validators(mtime: float, size: int) -> tuple[str, str]:
+    """(ETag, Last-Modified) de un archivo."""
+    return f'"{int(mtime * 1000):x}-{size:x}"', formatdate(mtime, usegmt=True)
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """True si el cliente ya tiene esa versión (If-None-Match o, sin él, If-Modified-Since)."""
+    inm = request.headers.get("if-none-match")
+    if inm:
+        return etag in [t.strip() for t in inm.split(",")] or inm.strip() == "*"
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return False
+
+
+def _serve_file(request: Request, f, filename: str, release=None) -> Response:
+    """
+    Respuesta con ETag/Last-Modified, 304 si el cliente ya lo tiene y 206 para peticiones Range (visores PDF).
+    f es el archivo ya abierto: tamaño y fecha salen de su fstat, así Content-Length cuadra con lo enviado.
+    La respuesta se queda el archivo (lo cierra y llama a release al terminar).
+    """
+    try:
+        st = os.fstat(f.fileno())
+    except OSError:
+        f.close()
+        if release is not None:
+            release()
+        raise
+    mtime, size = st.st_mtime, st.st_size
+    etag, last_modified = _file_validators(mtime, size)
+    ascii_name = filename.encode("ascii", "ignore").decode() or "archivo"
+    disposition = f'attachment; filename="{ascii_name}"'
+    if ascii_name != filename:
+        disposition += f"; filename*=utf-8''{quote(filename)}"
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=0, must-revalidate",
+        "Content-Disposition": disposition,
+    }
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    def _closed(response: Response) -> Response:
+        f.close()
+        if release is not None:
+            release()
+        return response
+
+    if _not_modified(request, etag, mtime):
+        return _closed(Response(status_code=304, headers=headers))
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() in (etag, last_modified)):
+        rng = _parse_range(range_header, size)
+        if rng is None:
+            return _closed(Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"}))
+        start, end = rng
+        length = end - start + 1
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(
+            _iter_file(f, start, length, release), status_code=206, media_type=media_type, headers=headers,
+        )
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(_iter_file(f, 0, size, release), media_type=media_type, headers=headers)
 
 
 @app.get("/api/productos-catalogo/archivo")
-def servir_archivo_catalogo(path: str = ""):
-    """Sirve un archivo del catálogo por ruta relativa (para abrir visual PDF/Excel)."""
+def servir_archivo_catalogo(request: Request, path: str = ""):
+    """
+    Sirve un archivo del catálogo por ruta relativa (para abrir visual PDF/Excel).
+    Las rutas del índice del catálogo se dan por válidas sin resolverlas en la red; con ETag/Last-Modified,
+    peticiones Range y copia local opcional de los archivos más usados (si no hay copia se sirve desde la red y
+    la copia se hace en segundo plano). El 304 usa el stat en caché; el cuerpo, el fstat del archivo abierto.
+    """
     with get_connection() as conn:
         catalog_path = _get_productos_catalog_path(conn)
+        indexed = catalog_file_is_indexed(conn, path)
     if not catalog_path or not path or ".." in path or path.startswith("/"):
         raise HTTPException(status_code=400, detail="Ruta no válida")
     base = Path(catalog_path)
-    if not base.exists() or not base.is_dir():
-        raise HTTPException(status_code=404, detail="Catálogo no disponible. Configura la ruta en Configuración.")
-    # path ya está validado (sin ".."); unir con base. En Windows con UNC, resolve() puede fallar.
     path_normalized = path.replace("/", os.sep).lstrip(os.sep)
     full = base / path_normalized
+    if not indexed:
+        if not base.exists() or not base.is_dir():
+            raise HTTPException(status_code=404, detail="Catálogo no disponible. Configura la ruta en Configuración.")
+        # path ya está validado (sin ".."); unir con base. En Windows con UNC, resolve() puede fallar.
+        try:
+            full_res = full.resolve()
+            base_res = base.resolve()
+            full_res.relative_to(base_res)
+        except (ValueError, OSError):
+            # OSError típico en rutas UNC en Windows; ValueError si full no está bajo base.
+            # Si no podemos resolver, confiamos en que path no tiene ".." y que full está bajo base.
+            if ".." in path_normalized or path_normalized.startswith(".."):
+                raise HTTPException(status_code=403, detail="Acceso denegado")
+        if not full.is_file():
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    source = str(full)
+    try:
+        mtime, size = _catalog_files.stat(source)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    etag, last_modified = _file_validators(mtime, size)
+    if _not_modified(request, etag, mtime):
+        return Response(
+            status_code=304,
+            headers={"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "private, max-age=0, must-revalidate"},
+        )
     try:
-        full_res = full.resolve()
-        base_res = base.resolve()
-        full_res.relative_to(base_res)
-    except (ValueError, OSError):
-        # OSError típico en rutas UNC en Windows; ValueError si full no está bajo base.
-        # Si no podemos resolver, confiamos en que path no tiene ".." y que full está bajo base.
-        if ".." in path_normalized or path_normalized.startswith(".."):
-            raise HTTPException(status_code=403, detail="Acceso denegado")
-    if not full.is_file():
+        f, release = _catalog_files.open(source, mtime, size)
+    except OSError:
+        _catalog_files.invalidate(source)
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
-    return FileResponse(str(full), filename=full.name)
+    return _serve_file(request, f, full.name, release)
+
+
+@app.on_event("shutdown")
+def stop_catalog_file_cache():
+    _catalog_files.shutdown()
+
+
+# --- Vigilancia de carpetas (catálogo y RMA especiales): importación incremental sin escaneos completos ---
+
+
+def _watched_path(raw: str) -> str:
+    return os.path.normpath(raw) if (os.name == "nt" and raw and raw.startswith("\\\\")) else (raw or "")
+
+
+def _watched_catalog_root() -> str:
+    with get_connection() as conn:
+        return _watched_path(_get_productos_catalog_path(conn))
+
+
+def _watched_rma_especiales_root() -> str:
+    with get_connection() as conn:
+        return _watched_path(_normalize_unc_path(get_setting(conn, "RMA_ESPECIALES_FOLDER") or ""))
+
+
+_watchers: list[FolderWatcher] = []
+# Rutas cambiadas por cola, pendientes de importar. El vigilante no importa en su hilo: encola una tarea en la
+# misma cola que el escaneo completo (nunca a la vez que él) y, si ya hay una pendiente, las rutas se le suman.
+_watched_changes: dict[str, set[str]] = {"catalogo": set(), "rma_especiales": set()}
+_watched_changes_lock = threading.Lock()
+
+
+def _run_watched_changes(task_id: str, queue: str, importer: Callable[[str, list[str]], object], root: str) -> None:
+    """Tarea del gestor: importa las rutas acumuladas hasta que empieza (las que lleguen después van a otra)."""
+    with _watched_changes_lock:
+        paths = sorted(_watched_changes[queue])
+        _watched_changes[queue].clear()
+    if paths:
+        _update_task(task_id, message=f"Importando {len(paths)} cambios de la carpeta...")
+        importer(root, paths)
+    _update_task(task_id, status="done", percent=100, message="Completado", result={"rutas": len(paths)})
+
+
+def _queue_watched_changes(queue: str, importer: Callable[[str, list[str]], object], root: str, paths: list[str]) -> None:
+    with _watched_changes_lock:
+        _watched_changes[queue].update(paths)
+    try:
+        _jobs.submit(
+            queue, _run_watched_changes, queue, importer, root,
+            key=("watch", queue), owner="sistema", message="Cambios en la carpeta pendientes de importar...",
+        )
+    except RuntimeError:
+        pass  # Apagando: los cambios se recogen con el siguiente escaneo
+
+
+def _on_catalog_changes(root: str, paths: list[str]) -> None:
+    _queue_watched_changes("catalogo", _apply_catalog_changes, root, paths)
+
+
+def _on_rma_especiales_changes(root: str, paths: list[str]) -> None:
+    _queue_watched_changes("rma_especiales", _import_rma_especiales_changed, root, paths)
+
+
+@app.on_event("startup")
+def start_folder_watchers():
+    """Si FS_WATCHER_ENABLED=1, arranca la vigilancia del catálogo y de la carpeta de RMA especiales."""
+    if not WATCHER_ENABLED or _watchers:
+        return
+    _watchers.append(FolderWatcher("catalogo", _watched_catalog_root, _on_catalog_changes))
+    _watchers.append(
+        FolderWatcher("rma_especiales", _watched_rma_especiales_root, _on_rma_especiales_changes, max_depth=2)
+    )
+    for w in _watchers:
+        w.start()
+
+
+@app.on_event("shutdown")
+def stop_folder_watchers():
+    for w in _watchers:
+        w.stop()
 
 
 # --- Repuestos (vinculados a productos, con inventario) ---
@@ -2178,17 +3511,17 @@ class CreateUserBody(BaseModel):
 
 
 @app.post("/api/users")
-def crear_usuario(body: CreateUserBody, username: str = Depends(get_current_username)):
+def crear_usuario(body: CreateUserBody, user: dict = Depends(get_current_user)):
     """Crea un usuario nuevo (solo nombre). Contraseña por defecto: approx2026. Solo administradores."""
     username_clean = (body.username or "").strip()
     if not username_clean:
         raise HTTPException(status_code=400, detail="El nombre de usuario no puede estar vacío")
+    if not user["is_admin"]:
+        raise HTTPException(
+            status_code=403,
+            detail="Solo un usuario administrador puede crear cuentas desde Configuración.",
+        )
     with get_connection() as conn:
-        if not user_is_admin(conn, username):
-            raise HTTPException(
-                status_code=403,
-                detail="Solo un usuario administrador puede crear cuentas desde Configuración.",
-            )
         if get_user_by_username(conn, username_clean):
             raise HTTPException(status_code=400, detail="Ya existe un usuario con ese nombre")
         email_placeholder = f"{username_clean}@approx.es"
@@ -2198,28 +3531,24 @@ def crear_usuario(body: CreateUserBody, username: str = Depends(get_current_user
             get_password_hash(DEFAULT_NEW_USER_PASSWORD),
             email_placeholder,
         )
-        insert_audit_log(conn, username, "user_created", "user", username_clean, "Contraseña por defecto")
+        insert_audit_log(conn, user["username"], "user_created", "user", username_clean, "Contraseña por defecto")
     return {"mensaje": f"Usuario '{username_clean}' creado. Contraseña por defecto: {DEFAULT_NEW_USER_PASSWORD}"}
 
 
 @app.get("/api/users")
-def listar_usuarios(username: str = Depends(get_current_username)):
+def listar_usuarios(user: dict = Depends(get_current_user)):
     """Lista usuarios (id, username) para elegir destinatario de notificaciones. Excluye al actual."""
     with get_connection() as conn:
-        current = get_user_by_username(conn, username)
         users = list_users(conn)
-    if not current:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    current_id = current["id"]
-    return [u for u in users if u["id"] != current_id]
+    return [u for u in users if u["id"] != user["id"]]
 
 
 @app.get("/api/users/admin")
-def listar_usuarios_admin(username: str = Depends(get_current_username)):
+def listar_usuarios_admin(user: dict = Depends(get_current_user)):
     """Lista todos los usuarios con datos completos. Solo administradores."""
+    if not user["is_admin"]:
+        raise HTTPException(status_code=403, detail="Solo administradores pueden acceder al panel de usuarios.")
     with get_connection() as conn:
-        if not user_is_admin(conn, username):
-            raise HTTPException(status_code=403, detail="Solo administradores pueden acceder al panel de usuarios.")
         return list_users_admin(conn)
 
 
@@ -2232,12 +3561,12 @@ class UpdateUserBody(BaseModel):
 def actualizar_usuario(
     user_id: int,
     body: UpdateUserBody,
-    username: str = Depends(get_current_username),
+    user: dict = Depends(get_current_user),
 ):
     """Actualiza email y/o is_admin de un usuario. Solo administradores."""
+    if not user["is_admin"]:
+        raise HTTPException(status_code=403, detail="Solo administradores pueden modificar usuarios.")
     with get_connection() as conn:
-        if not user_is_admin(conn, username):
-            raise HTTPException(status_code=403, detail="Solo administradores pueden modificar usuarios.")
         target = get_user_by_id_full(conn, user_id)
         if not target:
             raise HTTPException(status_code=404, detail="Usuario no encontrado")
@@ -2252,91 +3581,195 @@ def actualizar_usuario(
                     detail="No se puede quitar el rol de administrador al último admin.",
                 )
             update_user(conn, user_id, is_admin=body.is_admin)
-        insert_audit_log(conn, username, "user_updated", "user", target["username"], str(body.model_dump()))
+        insert_audit_log(conn, user["username"], "user_updated", "user", target["username"], str(body.model_dump()))
+    invalidate_principal(target["username"])
     return {"mensaje": "Usuario actualizado"}
 
 
 @app.post("/api/users/{user_id:int}/reset-password")
 def restablecer_password_usuario(
     user_id: int,
-    username: str = Depends(get_current_username),
+    user: dict = Depends(get_current_user),
 ):
     """Establece la contraseña del usuario a la por defecto (approx2026). Solo administradores."""
+    if not user["is_admin"]:
+        raise HTTPException(status_code=403, detail="Solo administradores pueden restablecer contraseñas.")
     with get_connection() as conn:
-        if not user_is_admin(conn, username):
-            raise HTTPException(status_code=403, detail="Solo administradores pueden restablecer contraseñas.")
         target = get_user_by_id(conn, user_id)
         if not target:
             raise HTTPException(status_code=404, detail="Usuario no encontrado")
         new_hash = get_password_hash(DEFAULT_NEW_USER_PASSWORD)
         update_password_by_id(conn, user_id, new_hash)
-        insert_audit_log(conn, username, "user_password_reset", "user", target["username"], "")
+        insert_audit_log(conn, user["username"], "user_password_reset", "user", target["username"], "")
+    invalidate_principal(target["username"])
     return {"mensaje": f"Contraseña de '{target['username']}' restablecida a {DEFAULT_NEW_USER_PASSWORD}"}
 
 
 @app.delete("/api/users/{user_id:int}")
-def eliminar_usuario(user_id: int, username: str = Depends(get_current_username)):
+def eliminar_usuario(user_id: int, user: dict = Depends(get_current_user)):
     """Elimina un usuario. Solo administradores. No se puede eliminar a uno mismo ni al último admin."""
+    if not user["is_admin"]:
+        raise HTTPException(status_code=403, detail="Solo administradores pueden eliminar usuarios.")
     with get_connection() as conn:
-        if not user_is_admin(conn, username):
-            raise HTTPException(status_code=403, detail="Solo administradores pueden eliminar usuarios.")
-        current = get_user_by_username(conn, username)
         target = get_user_by_id_full(conn, user_id)
         if not target:
             raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        if current and current["id"] == user_id:
+        if user["id"] == user_id:
             raise HTTPException(status_code=400, detail="No puedes eliminar tu propia cuenta.")
         if target["is_admin"] and count_admins(conn) <= 1:
             raise HTTPException(status_code=400, detail="No se puede eliminar al único administrador.")
         delete_user(conn, user_id)
-        insert_audit_log(conn, username, "user_deleted", "user", target["username"], "")
+        insert_audit_log(conn, user["username"], "user_deleted", "user", target["username"], "")
+    invalidate_principal(target["username"])
     return {"mensaje": "Usuario eliminado"}
 
 
 @app.get("/api/notifications")
 def listar_notificaciones(
     category: str | None = None,
-    username: str = Depends(get_current_username),
+    limit: int = NOTIFICATIONS_PAGE_SIZE,
+    cursor: str | None = None,
+    archived: bool = False,
+    user: dict = Depends(get_current_user),
 ):
-    """Lista notificaciones recibidas por el usuario actual. category opcional: abono, envio, sin_categoria."""
+    """Página de notificaciones recibidas por el usuario actual (más recientes primero). category opcional: abono, envio, sin_categoria.
+    cursor: next_cursor de la página anterior. archived=true: mensajes leídos antiguos (tabla de archivo)."""
+    limit = max(1, min(limit, 200))
     with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        items = get_notifications_for_user(conn, user["id"], category=category if category else None)
-    return items
+        items, next_cursor = get_notifications_for_user(
+            conn, user["id"],
+            category=category if category else None,
+            limit=limit,
+            cursor=cursor,
+            archived=archived,
+        )
+    return {"items": items, "next_cursor": next_cursor}
 
 
 @app.get("/api/notifications/sent")
 def listar_notificaciones_enviadas(
     category: str | None = None,
     deleted: bool = False,
-    username: str = Depends(get_current_username),
+    limit: int = NOTIFICATIONS_PAGE_SIZE,
+    cursor: str | None = None,
+    archived: bool = False,
+    user: dict = Depends(get_current_user),
 ):
-    """Lista notificaciones enviadas por el usuario actual. category opcional. deleted=true: solo las borradas por el remitente (bandeja de borrados)."""
+    """Página de notificaciones enviadas por el usuario actual. category opcional. deleted=true: solo las borradas por el remitente (bandeja de borrados).
+    cursor y archived como en /api/notifications."""
+    limit = max(1, min(limit, 200))
     with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        items = get_notifications_sent_by_user(
+        items, next_cursor = get_notifications_sent_by_user(
             conn, user["id"],
             category=category if category else None,
             deleted_only=deleted,
+            limit=limit,
+            cursor=cursor,
+            archived=archived,
         )
-    return items
+    return {"items": items, "next_cursor": next_cursor}
+
+
+# Archivo de notificaciones: las leídas hace más de NOTIFICATIONS_ARCHIVE_DAYS días pasan a la tabla fría (0 = nunca)
+NOTIFICATIONS_ARCHIVE_DAYS = int(os.environ.get("NOTIFICATIONS_ARCHIVE_DAYS", "90") or 0)
+NOTIFICATIONS_ARCHIVE_INTERVAL_SECONDS = 6 * 60 * 60
+
+
+def _run_notifications_archive(task_id: str) -> None:
+    """Tarea periódica (cola mantenimiento): al arrancar y después cada NOTIFICATIONS_ARCHIVE_INTERVAL_SECONDS."""
+    with get_connection() as conn:
+        moved = archive_old_notifications(conn, NOTIFICATIONS_ARCHIVE_DAYS)
+        if moved:
+            insert_audit_log(conn, "sistema", "notifications_archived", "notifications", "", str(moved))
+    _update_task(task_id, status="done", percent=100, message="Completado", result={"archivadas": moved})
+
+
+if NOTIFICATIONS_ARCHIVE_DAYS > 0:
+    _jobs.every("mantenimiento", "notifications_archive", NOTIFICATIONS_ARCHIVE_INTERVAL_SECONDS, _run_notifications_archive)
 
 
 @app.get("/api/notifications/unread-count")
-def contar_notificaciones_no_leidas(username: str = Depends(get_current_username)):
+def contar_notificaciones_no_leidas(user: dict = Depends(get_current_user)):
     """Cuenta notificaciones no leídas del usuario actual."""
     with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
         count = count_unread_notifications(conn, user["id"])
     return {"count": count}
 
 
+# Contador de no leídas en tiempo real (SSE): sustituye al polling de la barra de navegación
+_unread_hub = UnreadCounterHub()
+UNREAD_STREAM_HEARTBEAT_SECONDS = float(os.environ.get("NOTIFICATIONS_STREAM_HEARTBEAT_SECONDS", "25") or 25)
+
+
+def _publish_unread_count(*user_ids: int) -> None:
+    """Envía el contador actualizado a las pestañas abiertas de los usuarios (llamar tras el commit)."""
+    ids = [uid for uid in user_ids if _unread_hub.has_subscribers(uid)]
+    if not ids:
+        return
+    with get_connection() as conn:
+        counts = get_unread_counts_for_users(conn, ids)
+    for uid, (count, version) in counts.items():
+        _unread_hub.publish(uid, count, version)
+
+
+def _count_unread(user_id: int) -> tuple[int, int]:
+    with get_connection() as conn:
+        return get_unread_count_version(conn, user_id)
+
+
+_UNREAD_STREAM_SCOPE = "unread-stream"
+
+
+@app.post("/api/notifications/unread-stream/token")
+def token_stream_notificaciones(username: str = Depends(get_current_username)):
+    """Token de un solo uso y corta duración para abrir /api/notifications/unread-stream (pedir uno por conexión)."""
+    return {"token": create_stream_token(username, _UNREAD_STREAM_SCOPE), "expires_in": STREAM_TOKEN_EXPIRE_SECONDS}
+
+
+@app.get("/api/notifications/unread-stream")
+async def stream_notificaciones_no_leidas(request: Request, token: str = ""):
+    """
+    Server-Sent Events con el número de notificaciones sin leer: uno al conectar y otro cada vez que cambia.
+    EventSource no permite cabeceras, así que va en ?token= un token de un solo uso pedido con
+    POST /api/notifications/unread-stream/token (el JWT de sesión no se acepta aquí: la URL acaba en los logs).
+    Comentario de keep-alive cada NOTIFICATIONS_STREAM_HEARTBEAT_SECONDS para que proxies y navegador no cierren
+    la conexión. Se suscribe antes de leer el contador: un cambio entre ambas cosas llega por la cola, nunca se
+    pierde; los valores con versión no posterior a la leída se descartan (prime). Las consultas a la BD van al
+    pool de hilos.
+    """
+    username = get_username_from_stream_token(token, _UNREAD_STREAM_SCOPE)
+    user = await run_in_threadpool(get_current_user, username)
+    user_id = user["id"]
+    queue = _unread_hub.subscribe(user_id)
+    try:
+        count, version = await run_in_threadpool(_count_unread, user_id)
+    except BaseException:
+        _unread_hub.unsubscribe(user_id, queue)
+        raise
+    _unread_hub.prime(queue, version)
+
+    async def eventos():
+        try:
+            yield f"event: unread\ndata: {json.dumps({'count': count})}\n\n"
+            while True:
+                try:
+                    _version, n = await asyncio.wait_for(queue.get(), timeout=UNREAD_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: unread\ndata: {json.dumps({'count': n})}\n\n"
+        finally:
+            _unread_hub.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # --- Web Push (notificaciones aunque el navegador esté cerrado) ---
 
 def _get_vapid_public_key() -> str:
@@ -2373,16 +3806,13 @@ class PushSubscribeBody(BaseModel):
 
 
 @app.post("/api/push/subscribe")
-def suscribir_push(body: PushSubscribeBody, username: str = Depends(get_current_username)):
+def suscribir_push(body: PushSubscribeBody, user: dict = Depends(get_current_user)):
     """Guarda la suscripción push del navegador para enviar notificaciones Web Push."""
     p256dh = (body.keys or {}).get("p256dh") or (body.keys or {}).get("p256dh")
     auth = (body.keys or {}).get("auth")
     if not body.endpoint or not p256dh or not auth:
         raise HTTPException(status_code=400, detail="Faltan endpoint o keys (p256dh, auth)")
     with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
         save_push_subscription(conn, user["id"], body.endpoint, p256dh, auth)
     return {"mensaje": "Suscripción guardada"}
 
@@ -2395,93 +3825,149 @@ class NotificationBody(BaseModel):
     message: str = ""
 
 
-def _send_web_push_to_user(to_user_id: int, from_username: str, type_label: str, ref_summary: str, message: str | None) -> None:
-    """Envía Web Push a todas las suscripciones del usuario. No bloquea; ignora errores."""
+def _load_push_subscriptions(user_ids: list[int]) -> list[dict]:
+    with get_connection() as conn:
+        return get_push_subscriptions_for_users(conn, user_ids)
+
+
+def _delete_push_subscription(endpoint: str) -> None:
+    with get_connection() as conn:
+        delete_push_subscription(conn, endpoint)
+
+
+def _make_push_sender():
+    """Envío real con pywebpush si hay VAPID_PRIVATE_KEY y la librería está instalada; si no, None (push desactivado)."""
     vapid_private = os.environ.get("VAPID_PRIVATE_KEY", "").strip()
     if not vapid_private:
-        return
+        return None
     try:
-        from pywebpush import webpush
+        return pywebpush_sender(vapid_private, {"sub": "mailto:notificaciones@approx.es"}, PUSH_WORKERS)
     except ImportError:
-        return
+        return None
+
+
+_push_worker = PushDeliveryWorker(_load_push_subscriptions, _delete_push_subscription)
+
+
+@app.on_event("startup")
+def start_push_delivery():
+    _push_worker.sender = _make_push_sender()
+    _push_worker.start()
+
+
+@app.on_event("shutdown")
+def stop_push_delivery():
+    _push_worker.stop()
+
+
+def _enqueue_web_push(to_user_ids: list[int], from_username: str, type_label: str, ref_summary: str, message: str | None) -> None:
+    """Encola el Web Push para todas las suscripciones de los usuarios. No bloquea; si la cola está llena se descarta."""
     payload = json.dumps({
         "title": "SAT · Nuevo mensaje",
         "body": f"{from_username}: {type_label}" + (f" — {ref_summary}" if ref_summary else ""),
         "message": message or "",
         "tag": "garantia-notification",
     }, ensure_ascii=False)
-    with get_connection() as conn:
-        subs = get_push_subscriptions_for_user(conn, to_user_id)
-    for sub in subs:
-        try:
-            webpush(
-                sub,
-                payload,
-                vapid_private_key=vapid_private,
-                vapid_claims={"sub": "mailto:notificaciones@approx.es"},
-            )
-        except Exception:
-            pass
+    _push_worker.enqueue(to_user_ids, payload)
 
 
-@app.post("/api/notifications")
-def crear_notificacion(body: NotificationBody, username: str = Depends(get_current_username)):
-    """Crea una notificación para otro usuario (compartir fila de RMA, catálogo, etc.). Envía Web Push si está configurado."""
-    with get_connection() as conn:
-        from_user = get_user_by_username(conn, username)
-        if not from_user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        to_user = get_user_by_id(conn, body.to_user_id)
-        if not to_user:
-            raise HTTPException(status_code=404, detail="Usuario destinatario no encontrado")
-        if from_user["id"] == body.to_user_id:
-            raise HTTPException(status_code=400, detail="No puedes notificarte a ti mismo")
-        ref_json = json.dumps(body.reference_data, ensure_ascii=False)
-        cat = (body.category or "sin_categoria").strip() or "sin_categoria"
-        if cat not in ("abono", "envio", "sin_categoria", "fuera_garantia"):
-            cat = "sin_categoria"
-        nid = create_notification(
+NOTIFICATION_MAX_RECIPIENTS = 100
+
+
+class BulkNotificationBody(BaseModel):
+    to_user_ids: list[int]
+    type: str
+    category: str = "sin_categoria"
+    reference_data: dict
+    message: str = ""
+
+
+def _crear_notificaciones(
+    from_user: dict,
+    to_user_ids: list[int],
+    type_: str,
+    category: str,
+    reference_data: dict,
+    message: str,
+) -> dict[int, int]:
+    """
+    Valida destinatarios en una consulta, inserta todas las notificaciones en una transacción (executemany),
+    publica los contadores y encola un único trabajo de Web Push. Devuelve {to_user_id: id}.
+    """
+    ids = list(dict.fromkeys(to_user_ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="Indica al menos un destinatario")
+    if len(ids) > NOTIFICATION_MAX_RECIPIENTS:
+        raise HTTPException(status_code=400, detail=f"Máximo {NOTIFICATION_MAX_RECIPIENTS} destinatarios por envío")
+    if from_user["id"] in ids:
+        raise HTTPException(status_code=400, detail="No puedes notificarte a ti mismo")
+    with get_connection() as conn:
+        found = get_users_by_ids(conn, ids)
+        missing = [uid for uid in ids if uid not in found]
+        if missing:
+            detail = "Usuario destinatario no encontrado" if len(ids) == 1 else (
+                "Usuarios destinatarios no encontrados: " + ", ".join(str(uid) for uid in missing)
+            )
+            raise HTTPException(status_code=404, detail=detail)
+        created = create_notifications(
             conn,
             from_user_id=from_user["id"],
-            to_user_id=body.to_user_id,
-            type_=body.type.strip(),
-            reference_data=ref_json,
-            message=body.message.strip() or None,
-            category=cat,
+            to_user_ids=ids,
+            type_=type_.strip(),
+            reference_data=json.dumps(reference_data, ensure_ascii=False),
+            message=message.strip() or None,
+            category=category,
         )
     type_labels = {"rma": "Lista RMA", "catalogo": "Catálogo", "producto_rma": "Productos RMA", "cliente": "Clientes"}
-    ref_summary = (body.reference_data.get("rma_number") or body.reference_data.get("serial") or
-                   body.reference_data.get("product_ref") or body.reference_data.get("nombre") or "")
+    ref_summary = (reference_data.get("rma_number") or reference_data.get("serial") or
+                   reference_data.get("product_ref") or reference_data.get("nombre") or "")
     if isinstance(ref_summary, str) and len(ref_summary) > 40:
         ref_summary = ref_summary[:37] + "..."
-    threading.Thread(
-        target=_send_web_push_to_user,
-        args=(body.to_user_id, from_user["username"], type_labels.get(body.type.strip(), body.type), str(ref_summary), body.message.strip() or None),
-        daemon=True,
-    ).start()
-    return {"id": nid, "mensaje": "Notificación enviada"}
+    _publish_unread_count(*ids)
+    _enqueue_web_push(
+        ids, from_user["username"], type_labels.get(type_.strip(), type_), str(ref_summary),
+        message.strip() or None,
+    )
+    return {uid: created[uid] for uid in ids}
+
+
+@app.post("/api/notifications")
+def crear_notificacion(body: NotificationBody, from_user: dict = Depends(get_current_user)):
+    """Crea una notificación para otro usuario (compartir fila de RMA, catálogo, etc.). Envía Web Push si está configurado."""
+    created = _crear_notificaciones(
+        from_user, [body.to_user_id], body.type, body.category, body.reference_data, body.message,
+    )
+    return {"id": created[body.to_user_id], "mensaje": "Notificación enviada"}
+
+
+@app.post("/api/notifications/bulk")
+def crear_notificaciones(body: BulkNotificationBody, from_user: dict = Depends(get_current_user)):
+    """Envía la misma notificación a varios usuarios (p. ej. compartir un RMA con todo el equipo) en una sola petición.
+    Devuelve el id de la notificación de cada destinatario."""
+    created = _crear_notificaciones(
+        from_user, body.to_user_ids, body.type, body.category, body.reference_data, body.message,
+    )
+    return {
+        "items": [{"to_user_id": uid, "id": nid} for uid, nid in created.items()],
+        "mensaje": f"Notificación enviada a {len(created)} usuario(s)",
+    }
 
 
 @app.patch("/api/notifications/{notification_id:int}/read")
-def marcar_notificacion_leida(notification_id: int, username: str = Depends(get_current_username)):
+def marcar_notificacion_leida(notification_id: int, user: dict = Depends(get_current_user)):
     """Marca una notificación como leída."""
     with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
         ok = mark_notification_read(conn, notification_id, user["id"])
     if not ok:
         raise HTTPException(status_code=404, detail="Notificación no encontrada o ya leída")
+    _publish_unread_count(user["id"])
     return {"mensaje": "Marcada como leída"}
 
 
 @app.patch("/api/notifications/{notification_id:int}/delete")
-def borrar_notificacion_remitente(notification_id: int, username: str = Depends(get_current_username)):
+def borrar_notificacion_remitente(notification_id: int, user: dict = Depends(get_current_user)):
     """Borra (mueve a bandeja de borrados) una notificación. Solo puede hacerlo quien la envió. No se elimina de la BD."""
     with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
         ok = soft_delete_notification_by_sender(conn, notification_id, user["id"])
     if not ok:
         raise HTTPException(status_code=404, detail="Notificación no encontrada o no puedes borrarla (solo el remitente)")
@@ -2489,12 +3975,9 @@ def borrar_notificacion_remitente(notification_id: int, username: str = Depends(
 
 
 @app.patch("/api/notifications/{notification_id:int}/restore")
-def restaurar_notificacion_remitente(notification_id: int, username: str = Depends(get_current_username)):
+def restaurar_notificacion_remitente(notification_id: int, user: dict = Depends(get_current_user)):
     """Restaura una notificación desde la bandeja de borrados. Solo el remitente puede restaurar."""
     with get_connection() as conn:
-        user = get_user_by_username(conn, username)
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
         ok = restore_notification_by_sender(conn, notification_id, user["id"])
     if not ok:
         raise HTTPException(status_code=404, detail="Notificación no encontrada o no está en borrados")
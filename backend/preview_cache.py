@@ -0,0 +1,79 @@
+"""
+Caché en memoria de las vistas previas de Excel de RMA especiales (asignar columnas en la vista).
+- Clave (ruta, mtime, hoja): si el archivo cambia en la carpeta, cambia su mtime y la entrada vieja ya no se usa
+  (acaba expulsada por LRU).
+- Guarda las primeras filas (grid) de cada hoja ya vista y la lista de hojas del archivo (hoja None).
+- LRU con tope de tamaño aproximado en bytes: RMA_ESPECIALES_PREVIEW_CACHE_MB (por defecto 32; 0 la desactiva).
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+
+PREVIEW_CACHE_MAX_BYTES = int(float(os.environ.get("RMA_ESPECIALES_PREVIEW_CACHE_MB", "32") or 0) * 1024 * 1024)
+_CELL_OVERHEAD = 16  # bytes aproximados por celda además del texto
+
+
+def _estimate_size(value) -> int:
+    """Tamaño aproximado de una lista de hojas o de un grid (lista de filas de texto)."""
+    if isinstance(value, list):
+        return sum(_estimate_size(v) for v in value) + _CELL_OVERHEAD
+    return len(str(value)) + _CELL_OVERHEAD if value is not None else _CELL_OVERHEAD
+
+
+class ExcelPreviewCache:
+    """LRU de vistas previas indexadas por (ruta, mtime, hoja); hoja None = nombres de las hojas."""
+
+    def __init__(self, max_bytes: int = PREVIEW_CACHE_MAX_BYTES):
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, float, int | str | None], tuple[list, int]] = OrderedDict()
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, path: str, mtime: float, sheet: int | str | None) -> list | None:
+        if not self.enabled:
+            return None
+        key = (path, mtime, sheet)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, path: str, mtime: float, sheet: int | str | None, value: list) -> None:
+        if not self.enabled:
+            return
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        key = (path, mtime, sheet)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= old[1]
+            while self._entries and self._total + size > self.max_bytes:
+                _key, (_value, old_size) = self._entries.popitem(last=False)
+                self._total -= old_size
+            self._entries[key] = (value, size)
+            self._total += size
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -12,6 +12,10 @@ from __future__ import annotations
 
 import os
 import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from pathlib import Path
 from typing import Callable
@@ -24,6 +28,69 @@ EXCEL_MAX_COL = 11    # columnas A..K = 0..10 (0-based), K = índice 10
 # Número de serie: buscar "TECHNICAL DEPARTMENT" en cualquier columna (A–K); el número de serie está
 # dos columnas a la izquierda, debajo (celdas unidas). Ej.: TECHNICAL en G29 → serial en E30,E31...; en H29 → F30,F31...
 SERIE_COL_OFFSET = 2   # columnas a la izquierda de TECHNICAL DEPARTMENT donde buscar el serial
+SCAN_REPORT_TOP_N = 50  # directorios y archivos más lentos que se guardan en el informe de escaneo
+
+
+class ScanProfiler:
+    """
+    Tiempos de un escaneo del catálogo por fase (count, list, stat, open, parse, persist) y por directorio/archivo,
+    para saber si lo lento es el listado del NAS, la lectura de Excel (openpyxl) o la escritura en SQLite.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.base: Path | None = None
+        self.phases: dict[str, list[float]] = defaultdict(lambda: [0.0, 0])  # fase -> [segundos, llamadas]
+        self.dirs: list[tuple[float, str, bool]] = []  # (segundos propios, path_rel, es_producto)
+        self.files: list[tuple[float, float, float, str]] = []  # (total, open, parse, path_rel)
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            acc = self.phases[name]
+            acc[0] += time.perf_counter() - t0
+            acc[1] += 1
+
+    def record_dir(self, path_rel: str, seconds: float, is_product: bool) -> None:
+        self.dirs.append((seconds, path_rel, is_product))
+
+    def record_file(self, path: Path, open_s: float, parse_s: float) -> None:
+        path_rel = (_rel_str(path, self.base) if self.base is not None else None) or str(path)
+        self.files.append((open_s + parse_s, open_s, parse_s, path_rel))
+
+    def report(self, top_n: int = SCAN_REPORT_TOP_N) -> dict:
+        slow_dirs = sorted(self.dirs, reverse=True)[:top_n]
+        slow_files = sorted(self.files, reverse=True)[:top_n]
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 3),
+            "directories": len(self.dirs),
+            "files": len(self.files),
+            "phases": {k: {"seconds": round(v[0], 3), "calls": v[1]} for k, v in sorted(self.phases.items())},
+            "slowest_dirs": [
+                {"path": p, "seconds": round(t, 3), "product": prod} for t, p, prod in slow_dirs
+            ],
+            "slowest_files": [
+                {"path": p, "seconds": round(t, 3), "open": round(o, 3), "parse": round(pa, 3)}
+                for t, o, pa, p in slow_files
+            ],
+        }
+
+
+_profiler: ContextVar[ScanProfiler | None] = ContextVar("catalog_scan_profiler", default=None)
+
+
+@contextmanager
+def _phase(name: str):
+    """Mide la fase en el perfilador del escaneo en curso (si lo hay)."""
+    prof = _profiler.get()
+    if prof is None:
+        yield
+        return
+    with prof.phase(name):
+        yield
 
 
 def _normalize_path(p: Path) -> Path:
@@ -167,7 +234,18 @@ def _read_serial_and_date_from_excel(excel_path: Path) -> tuple[str | None, str
     en la columna dos posiciones a la izquierda (G→E, H→F, etc.).
     """
     try:
-        df = pd.read_excel(excel_path, sheet_name=0, header=None)
+        t0 = time.perf_counter()
+        with _phase("open"):
+            xl = pd.ExcelFile(excel_path)
+        t1 = time.perf_counter()
+        try:
+            with _phase("parse"):
+                df = xl.parse(0, header=None)
+        finally:
+            xl.close()
+            prof = _profiler.get()
+            if prof is not None:
+                prof.record_file(Path(excel_path), t1 - t0, time.perf_counter() - t1)
         if df.empty or df.shape[0] == 0:
             return None, None
 
@@ -181,7 +259,8 @@ def _read_serial_and_date_from_excel(excel_path: Path) -> tuple[str | None, str
 def _mtime(p: Path) -> float:
     """Mtime del archivo; 0 si no se puede leer."""
     try:
-        return p.stat().st_mtime
+        with _phase("stat"):
+            return p.stat().st_mtime
     except (OSError, PermissionError):
         return 0.0
 
@@ -200,10 +279,11 @@ def _dir_has_excel(folder: Path) -> bool:
 def _dir_has_visual_excel(folder: Path) -> bool:
     """True si el directorio contiene al menos un Excel cuyo nombre incluya 'visual' (insensible a mayúsculas)."""
     try:
-        for e in folder.iterdir():
-            if e.is_file() and e.suffix.lower() in (".xlsx", ".xls"):
-                if "visual" in e.name.lower():
-                    return True
+        with _phase("list"):
+            for e in folder.iterdir():
+                if e.is_file() and e.suffix.lower() in (".xlsx", ".xls"):
+                    if "visual" in e.name.lower():
+                        return True
     except (OSError, PermissionError):
         pass
     return False
@@ -228,9 +308,10 @@ def _newest_pdf_in_dir(folder: Path) -> Path | None:
     """Devuelve el PDF más nuevo (por fecha de modificación) del directorio."""
     pdfs = []
     try:
-        for e in folder.iterdir():
-            if e.is_file() and e.suffix.lower() == ".pdf":
-                pdfs.append(e)
+        with _phase("list"):
+            for e in folder.iterdir():
+                if e.is_file() and e.suffix.lower() == ".pdf":
+                    pdfs.append(e)
     except (OSError, PermissionError):
         return None
     if not pdfs:
@@ -243,12 +324,13 @@ def _newest_visual_excel_in_dir(folder: Path) -> Path | None:
     """Devuelve el Excel más nuevo que tenga 'visual' o 'datasheet' en el nombre (para abrir como visual)."""
     excels = []
     try:
-        for e in folder.iterdir():
-            if not e.is_file() or e.suffix.lower() not in (".xlsx", ".xls"):
-                continue
-            n = e.name.lower()
-            if "visual" in n or "datasheet" in n:
-                excels.append(e)
+        with _phase("list"):
+            for e in folder.iterdir():
+                if not e.is_file() or e.suffix.lower() not in (".xlsx", ".xls"):
+                    continue
+                n = e.name.lower()
+                if "visual" in n or "datasheet" in n:
+                    excels.append(e)
     except (OSError, PermissionError):
         return None
     if not excels:
@@ -327,7 +409,8 @@ def _count_directory_visits(current: Path) -> int:
     Sirve para calcular el total y mostrar porcentaje en tiempo real.
     """
     try:
-        entries = list(current.iterdir())
+        with _phase("count"):
+            entries = list(current.iterdir())
     except (OSError, PermissionError):
         return 0
     if _dir_has_visual_excel(current):
@@ -365,8 +448,11 @@ def _walk_and_collect(
         else:
             on_directory(path_rel or ".", 0, 0)
 
+    t0 = time.perf_counter()
+    prof = _profiler.get()
     try:
-        entries = list(current.iterdir())
+        with _phase("list"):
+            entries = list(current.iterdir())
     except (OSError, PermissionError):
         return
 
@@ -376,11 +462,15 @@ def _walk_and_collect(
         product = _process_product_dir(current, base_path, path_parts)
         if product:
             out.append(product)
+        if prof is not None:
+            prof.record_dir("/".join(path_parts) or ".", time.perf_counter() - t0, True)
         return
 
-    for e in entries:
-        if not e.is_dir():
-            continue
+    with _phase("list"):
+        subdirs = [e for e in entries if e.is_dir()]
+    if prof is not None:
+        prof.record_dir("/".join(path_parts) or ".", time.perf_counter() - t0, False)
+    for e in subdirs:
         new_parts = path_parts + [e.name]
         _walk_and_collect(e, base_path, new_parts, out, on_directory, current_index, total_visits)
 
@@ -388,6 +478,7 @@ def _walk_and_collect(
 def get_productos_catalogo(
     base_path: str | Path,
     on_directory: Callable[[str, int, int], None] | None = None,
+    profiler: ScanProfiler | None = None,
 ) -> list[dict]:
     """
     Escanea la ruta base recursivamente. Solo se considera producto un directorio que contenga al menos un Excel
@@ -395,10 +486,21 @@ def get_productos_catalogo(
     en las primeras 40 filas y hasta columna K; fecha = la más antigua entre las celdas con formato de fecha
     válido; serie = primer texto en la columna (TECHNICAL - 2) debajo de la fila de "TECHNICAL DEPARTMENT".
     on_directory(path_rel, current, total) se invoca al entrar en cada directorio para progreso en tiempo real.
+    profiler: si se indica, acumula tiempos por fase, directorio y archivo (informe de escaneo).
     """
     if not base_path or not str(base_path).strip():
         return []
+    token = _profiler.set(profiler)
+    try:
+        return _get_productos_catalogo(base_path, on_directory)
+    finally:
+        _profiler.reset(token)
 
+
+def _get_productos_catalogo(
+    base_path: str | Path,
+    on_directory: Callable[[str, int, int], None] | None,
+) -> list[dict]:
     base_path_str = str(base_path).strip()
     # En Windows, rutas UNC (\\server\share) se normalizan con os.path para acceso fiable
     if os.name == "nt" and base_path_str.startswith("\\\\"):
@@ -410,6 +512,9 @@ def get_productos_catalogo(
         raise NotADirectoryError(f"La ruta no es una carpeta: {base_path_str}")
 
     base = _normalize_path(base)
+    prof = _profiler.get()
+    if prof is not None:
+        prof.base = base
     out = []
     total_visits = 0
     current_index: list[int] | None = None
@@ -418,3 +523,71 @@ def get_productos_catalogo(
         current_index = [0]
     _walk_and_collect(base, base, [], out, on_directory, current_index, total_visits)
     return out
+
+
+def _rel_str(p: Path, base_path: Path) -> str | None:
+    """Ruta relativa a base con '/' o None si p no está bajo base."""
+    try:
+        return str(p.relative_to(base_path)).replace("\\", "/")
+    except ValueError:
+        return None
+
+
+def get_productos_catalogo_cambios(
+    base_path: str | Path,
+    changed_paths: list[str],
+) -> tuple[list[dict], list[str]]:
+    """
+    Actualización incremental del catálogo a partir de rutas cambiadas (vigilancia de carpetas).
+    Para cada ruta se busca, bajando desde la base, el primer directorio con Excel "visual" (mismo criterio
+    que el escaneo completo) y solo ese directorio se vuelve a procesar. Los directorios en sí se ignoran
+    (los productos nuevos llegan por el evento de su Excel); si desaparece un directorio o su Excel visual,
+    sus productos se marcan para borrar.
+    Devuelve (productos encontrados, folder_rel que ya no son producto: borrar ese directorio y lo que cuelga de él).
+    """
+    base = _normalize_path(Path(str(base_path).strip()))
+    if not base.is_dir():
+        raise NotADirectoryError(f"La ruta no es una carpeta: {base_path}")
+    product_dirs: dict[str, tuple[Path, list[str]]] = {}
+    walk_dirs: dict[str, tuple[Path, list[str]]] = {}
+    removed: set[str] = set()
+    for raw in changed_paths:
+        p = Path(raw)
+        rel = _rel_str(p, base)
+        if rel is None or rel == ".":
+            continue
+        parts = [x for x in rel.split("/") if x]
+        if not p.exists():
+            removed.add(rel)
+        # Bajar desde la base: el primer directorio con Excel visual es el producto
+        current = base
+        found = False
+        for i, name in enumerate(parts):
+            current = current / name
+            if not current.is_dir():
+                break
+            if _dir_has_visual_excel(current):
+                product_dirs[str(current)] = (current, parts[: i + 1])
+                found = True
+                break
+        if found or p.is_dir():
+            continue
+        if p.parent != base and p.parent.is_dir() and p.suffix.lower() in (".xlsx", ".xls"):
+            # Se borró/renombró el Excel visual: el directorio padre deja de ser producto (o cambia)
+            parent_rel = _rel_str(p.parent, base)
+            if parent_rel:
+                removed.add(parent_rel)
+                walk_dirs[str(p.parent)] = (p.parent, parts[:-1])
+    out: list[dict] = []
+    for folder, parts in product_dirs.values():
+        product = _process_product_dir(folder, base, parts)
+        if product:
+            out.append(product)
+        else:
+            rel = _rel_str(folder, base)
+            if rel:
+                removed.add(rel)
+    for folder, parts in walk_dirs.values():
+        _walk_and_collect(folder, base, parts, out)
+    found_rels = {p["folder_rel"] for p in out}
+    return out, sorted(r for r in removed if r not in found_rels)
@@ -0,0 +1,221 @@
+"""
+Entrega de Web Push en segundo plano (notificaciones al navegador aunque esté cerrado).
+- Cola acotada (PUSH_QUEUE_MAX): crear una notificación solo encola; si la cola está llena se descarta el aviso push
+  (la notificación ya está guardada en la BD y llega por el contador/SSE).
+- PUSH_WORKERS hilos comparten una sesión HTTP con pool de conexiones (los servicios push de los navegadores son
+  pocos hosts; reutilizar conexiones TLS ahorra el handshake por envío).
+- Reintentos con backoff exponencial (PUSH_MAX_RETRIES) ante 429/5xx o errores de red.
+- 404/410: la suscripción ha caducado en el navegador; se borra de la BD para no reintentarla nunca más.
+- El envío se puede sustituir (sender) para probar contra un servidor push local de pruebas.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from typing import Callable
+
+PUSH_QUEUE_MAX = max(1, int(os.environ.get("PUSH_QUEUE_MAX", "500") or 500))
+PUSH_WORKERS = max(1, int(os.environ.get("PUSH_WORKERS", "2") or 2))
+PUSH_MAX_RETRIES = max(0, int(os.environ.get("PUSH_MAX_RETRIES", "3") or 0))
+PUSH_RETRY_BASE_SECONDS = float(os.environ.get("PUSH_RETRY_BASE_SECONDS", "2") or 2)
+PUSH_TIMEOUT_SECONDS = float(os.environ.get("PUSH_TIMEOUT_SECONDS", "10") or 10)
+PUSH_TTL_SECONDS = int(os.environ.get("PUSH_TTL_SECONDS", "86400") or 0)
+
+_GONE_STATUS = (404, 410)
+_RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class PushSendError(Exception):
+    """Fallo de envío con el código HTTP del servicio push (None si fue un error de red)."""
+
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+
+def _make_session(pool_size: int):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def pywebpush_sender(vapid_private_key: str, vapid_claims: dict, pool_size: int) -> Callable[[dict, str], None]:
+    """Envío con pywebpush sobre una sesión requests compartida. ImportError si pywebpush no está instalado."""
+    from pywebpush import WebPushException, webpush
+
+    session = _make_session(pool_size)
+
+    def send(subscription: dict, payload: str) -> None:
+        try:
+            webpush(
+                subscription,
+                payload,
+                vapid_private_key=vapid_private_key,
+                vapid_claims=dict(vapid_claims),
+                timeout=PUSH_TIMEOUT_SECONDS,
+                ttl=PUSH_TTL_SECONDS,
+                requests_session=session,
+            )
+        except WebPushException as e:
+            response = getattr(e, "response", None)
+            raise PushSendError(str(e), getattr(response, "status_code", None)) from e
+        except Exception as e:
+            raise PushSendError(str(e)) from e
+
+    return send
+
+
+class PushDeliveryWorker:
+    """Cola acotada de avisos push por usuario, hilos de envío, reintentos y poda de suscripciones caducadas."""
+
+    def __init__(
+        self,
+        load_subscriptions: Callable[[list[int]], list[dict]],
+        delete_subscription: Callable[[str], None],
+        sender: Callable[[dict, str], None] | None = None,
+        workers: int = PUSH_WORKERS,
+        queue_max: int = PUSH_QUEUE_MAX,
+        max_retries: int = PUSH_MAX_RETRIES,
+        retry_base: float = PUSH_RETRY_BASE_SECONDS,
+    ):
+        self.load_subscriptions = load_subscriptions
+        self.delete_subscription = delete_subscription
+        self.sender = sender
+        self.workers = max(1, workers)
+        self.max_retries = max(0, max_retries)
+        self.retry_base = retry_base
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_max))
+        self._retries: list[tuple[float, int, tuple]] = []  # heap (vence_en, orden, trabajo)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._in_flight = 0
+        self._stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "pruned": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.sender is not None
+
+    def start(self) -> None:
+        if not self.enabled or self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"push_delivery_{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Para los hilos; lo que quede en cola se pierde (los avisos push no son críticos)."""
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def enqueue(self, user_ids: int | list[int], payload: str) -> bool:
+        """Encola un aviso para todas las suscripciones de uno o varios usuarios (un único trabajo).
+        False si está desactivado o la cola está llena."""
+        if not self.enabled:
+            return False
+        ids = [user_ids] if isinstance(user_ids, int) else list(user_ids)
+        if not ids:
+            return False
+        try:
+            self._queue.put_nowait(("users", ids, payload))
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def _release_due_retries(self) -> float:
+        """Pasa a la cola los reintentos vencidos; devuelve los segundos hasta el siguiente (o 0.5 si no hay)."""
+        now = time.monotonic()
+        with self._lock:
+            while self._retries and self._retries[0][0] <= now:
+                _due, _seq, job = heapq.heappop(self._retries)
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    self._stats["dropped"] += 1
+            if self._retries:
+                return max(0.05, min(0.5, self._retries[0][0] - now))
+        return 0.5
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            wait = self._release_due_retries()
+            try:
+                job = self._queue.get(timeout=wait)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._in_flight += 1
+            try:
+                if job[0] == "users":
+                    _kind, user_ids, payload = job
+                    for sub in self.load_subscriptions(user_ids):
+                        self._deliver(sub, payload, 0)
+                else:
+                    _kind, sub, payload, attempt = job
+                    self._deliver(sub, payload, attempt)
+            except Exception:
+                with self._lock:
+                    self._stats["failed"] += 1
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                self._queue.task_done()
+
+    def _deliver(self, sub: dict, payload: str, attempt: int) -> None:
+        try:
+            self.sender(sub, payload)
+        except PushSendError as e:
+            if e.status in _GONE_STATUS:
+                try:
+                    self.delete_subscription(sub["endpoint"])
+                finally:
+                    with self._lock:
+                        self._stats["pruned"] += 1
+                return
+            retryable = e.status is None or e.status in _RETRY_STATUS
+            with self._lock:
+                if retryable and attempt < self.max_retries:
+                    due = time.monotonic() + self.retry_base * (2 ** attempt)
+                    heapq.heappush(self._retries, (due, next(self._seq), ("sub", sub, payload, attempt + 1)))
+                    self._stats["retried"] += 1
+                else:
+                    self._stats["failed"] += 1
+            return
+        with self._lock:
+            self._stats["sent"] += 1
+
+    def status(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["in_flight"] = self._in_flight
+            out["retry_pending"] = len(self._retries)
+        out["enabled"] = self.enabled
+        out["queue"] = self._queue.qsize()
+        out["queue_max"] = self._queue.maxsize
+        out["workers"] = self.workers
+        return out
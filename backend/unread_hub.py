@@ -0,0 +1,105 @@
+"""
+Difusión en memoria del contador de notificaciones sin leer a los navegadores conectados (SSE).
+- Cada pestaña abierta se suscribe con una cola asyncio por usuario.
+- Las rutas (síncronas, en hilos del pool) publican el nuevo contador; se entrega en el bucle de eventos
+  con call_soon_threadsafe. Si una cola se llena se descarta el valor más antiguo: solo importa el último.
+- Cada valor lleva la versión del contador (notification_unread_counts.version). Dos cambios simultáneos pueden
+  publicarse en orden inverso (cada petición lee el contador en su conexión tras su commit): un valor con versión
+  no mayor que la ya entregada a esa cola se descarta, así la barra nunca se queda con un número viejo.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+
+QUEUE_SIZE = 8
+
+
+class UnreadCounterHub:
+    """Suscriptores por usuario (colas asyncio) y publicación del contador desde cualquier hilo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: dict[int, set[asyncio.Queue]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._versions: dict[asyncio.Queue, int] = {}  # última versión entregada (o leída al conectar) por cola
+        self.published = 0
+        self.stale_dropped = 0
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """Llamar desde el bucle de eventos (ruta async)."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def prime(self, queue: asyncio.Queue, version: int) -> None:
+        """
+        Llamar desde el bucle de eventos con la versión del contador leído al conectar: se quitan de la cola los
+        valores que ya llegaron y son anteriores, y a partir de aquí solo se entregan versiones posteriores.
+        """
+        with self._lock:
+            if version <= self._versions.get(queue, -1):
+                return
+            self._versions[queue] = version
+        items = []
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        newer = [item for item in items if item[0] > version]
+        for item in newer:
+            queue.put_nowait(item)
+        with self._lock:
+            self.stale_dropped += len(items) - len(newer)
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        with self._lock:
+            self._versions.pop(queue, None)
+            queues = self._subscribers.get(user_id)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id: int) -> bool:
+        with self._lock:
+            return bool(self._subscribers.get(user_id))
+
+    def _deliver(self, queue: asyncio.Queue, version: int, count: int) -> None:
+        """En el bucle de eventos. Pone (versión, contador) en la cola si es posterior al último entregado."""
+        with self._lock:
+            if version <= self._versions.get(queue, -1):
+                self.stale_dropped += 1
+                return
+            self._versions[queue] = version
+        if queue.full():
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait((version, count))
+
+    def publish(self, user_id: int, count: int, version: int) -> None:
+        """
+        Envía el contador (con su versión) a las pestañas del usuario. Seguro desde cualquier hilo; sin suscriptores
+        no hace nada. Las colas reciben tuplas (versión, contador).
+        """
+        with self._lock:
+            queues = list(self._subscribers.get(user_id, ()))
+            loop = self._loop
+            if queues:
+                self.published += 1
+        if not queues or loop is None or loop.is_closed():
+            return
+        for queue in queues:
+            loop.call_soon_threadsafe(self._deliver, queue, version, count)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._subscribers),
+                "connections": sum(len(q) for q in self._subscribers.values()),
+                "published": self.published,
+                "stale_dropped": self.stale_dropped,
+            }
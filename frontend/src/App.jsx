@@ -47,33 +47,84 @@ function AppContent() {
   const [rmaDestacado, setRmaDestacado] = useState(null)
   const [serialDestacado, setSerialDestacado] = useState(null)
   const [rmaEspecialDestacadoId, setRmaEspecialDestacadoId] = useState(null)
-  const [notifCountKey, setNotifCountKey] = useState(0)
-  const refreshNotifCount = () => setNotifCountKey((k) => k + 1)
+  const [unreadCount, setUnreadCount] = useState(0)
 
-  // Notificaciones del navegador: avisar cuando aumente el número de sin leer (polling)
+  // Contador de sin leer: lo empuja el servidor (SSE); al aumentar, aviso del navegador si hay permiso
   const prevUnreadCountRef = useRef(null)
+  const aplicarNoLeidas = (c) => {
+    if (
+      prevUnreadCountRef.current !== null &&
+      c > prevUnreadCountRef.current &&
+      typeof window !== 'undefined' &&
+      'Notification' in window &&
+      Notification.permission === 'granted'
+    ) {
+      try {
+        new Notification('SAT · Garantías', {
+          body: c === 1 ? 'Tienes 1 notificación nueva.' : `Tienes ${c} notificaciones nuevas.`,
+          icon: '/logo-aqprox.png',
+        })
+      } catch (_) {}
+    }
+    prevUnreadCountRef.current = c
+    setUnreadCount(c)
+  }
+  const refreshNotifCount = () => {
+    fetch(`${API_URL}/api/notifications/unread-count`, { headers: getAuthHeaders() })
+      .then((r) => (r.ok ? r.json() : null))
+      .then((data) => {
+        if (data) aplicarNoLeidas(data.count ?? 0)
+      })
+      .catch(() => {})
+  }
   useEffect(() => {
-    if (typeof window === 'undefined' || !('Notification' in window) || Notification.permission !== 'granted') return
-    const fetchCount = () => {
-      fetch(`${API_URL}/api/notifications/unread-count`, { headers: getAuthHeaders() })
-        .then((r) => (r.ok ? r.json() : { count: 0 }))
+    let token = null
+    try {
+      token = localStorage.getItem(AUTH_STORAGE_KEY)
+    } catch {}
+    if (!token || typeof EventSource === 'undefined') {
+      // Sin SSE: consulta periódica como antes
+      refreshNotifCount()
+      const id = setInterval(refreshNotifCount, 60000)
+      return () => clearInterval(id)
+    }
+    // El JWT de sesión no va en la URL (acaba en los logs): cada conexión pide un token de un solo uso.
+    // Por eso no se deja reconectar a EventSource con la misma URL: si se corta, se pide otro token y se vuelve
+    // a conectar. El servidor envía el contador al conectar.
+    let es = null
+    let cerrado = false
+    let reintento = null
+    const programar = () => {
+      if (!cerrado) reintento = setTimeout(conectar, 5000)
+    }
+    const conectar = () => {
+      fetch(`${API_URL}/api/notifications/unread-stream/token`, { method: 'POST', headers: getAuthHeaders() })
+        .then((r) => {
+          if (r.status === 401 || r.status === 403) return null // sesión caducada: no se reintenta
+          if (!r.ok) throw new Error(String(r.status))
+          return r.json()
+        })
         .then((data) => {
-          const c = data.count ?? 0
-          if (prevUnreadCountRef.current !== null && c > prevUnreadCountRef.current) {
+          if (!data || cerrado) return
+          es = new EventSource(`${API_URL}/api/notifications/unread-stream?token=${encodeURIComponent(data.token)}`)
+          es.addEventListener('unread', (e) => {
             try {
-              new Notification('SAT · Garantías', {
-                body: c === 1 ? 'Tienes 1 notificación nueva.' : `Tienes ${c} notificaciones nuevas.`,
-                icon: '/logo-aqprox.png',
-              })
-            } catch (_) {}
+              aplicarNoLeidas(JSON.parse(e.data).count ?? 0)
+            } catch {}
+          })
+          es.onerror = () => {
+            es.close()
+            programar()
           }
-          prevUnreadCountRef.current = c
         })
-        .catch(() => {})
+        .catch(programar)
+    }
+    conectar()
+    return () => {
+      cerrado = true
+      clearTimeout(reintento)
+      if (es) es.close()
     }
-    fetchCount()
-    const id = setInterval(fetchCount, 60000)
-    return () => clearInterval(id)
   }, [])
 
   // Atajos de teclado globales: Alt+1..8 para ir a secciones (no en inputs)
@@ -187,7 +238,7 @@ function AppContent() {
       productoDestacado={productoDestacado}
       setProductoDestacado={setProductoDestacado}
       setSerialDestacado={setSerialDestacado}
-      notifCountKey={notifCountKey}
+      unreadCount={unreadCount}
       refreshNotifCount={refreshNotifCount}
     >
       {renderVista()}
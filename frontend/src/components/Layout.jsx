@@ -23,7 +23,7 @@ function Layout({
   productoDestacado,
   setProductoDestacado,
   setSerialDestacado,
-  notifCountKey,
+  unreadCount,
   refreshNotifCount,
   children,
 }) {
@@ -37,7 +37,7 @@ function Layout({
         onClienteDestacado={setClienteDestacado}
         onProductoDestacado={setProductoDestacado}
         onSerialDestacado={setSerialDestacado}
-        notifCountKey={notifCountKey}
+        unreadCount={unreadCount}
         refreshNotifCount={refreshNotifCount}
       />
       <nav className="breadcrumbs" aria-label="Navegación">
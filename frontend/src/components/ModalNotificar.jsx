@@ -18,6 +18,7 @@ function getAuthHeaders() {
 function ModalNotificar({ open, onClose, type, referenceData, onSuccess }) {
   const [users, setUsers] = useState([])
   const [toUserId, setToUserId] = useState('')
+  const [extraIds, setExtraIds] = useState([])
   const [category, setCategory] = useState('sin_categoria')
   const [message, setMessage] = useState('')
   const [cargando, setCargando] = useState(false)
@@ -40,6 +41,7 @@ function ModalNotificar({ open, onClose, type, referenceData, onSuccess }) {
   useEffect(() => {
     if (open) {
       setMessage('')
+      setExtraIds([])
       setError(null)
       refetchUsers()
       try {
@@ -70,16 +72,18 @@ function ModalNotificar({ open, onClose, type, referenceData, onSuccess }) {
       setError('Selecciona un usuario destinatario.')
       return
     }
+    // Destinatario principal + los marcados en «También a»: una sola petición al endpoint de envío múltiple
+    const toUserIds = [uid, ...extraIds.map((id) => parseInt(id, 10)).filter((id) => id !== uid)]
     setCargando(true)
     setError(null)
-    fetch(`${API_URL}/api/notifications`, {
+    fetch(`${API_URL}/api/notifications/bulk`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
         ...getAuthHeaders(),
       },
       body: JSON.stringify({
-        to_user_id: uid,
+        to_user_ids: toUserIds,
         type: type.trim(),
         category: CATEGORIAS_ENVIO.includes(category) ? category : 'sin_categoria',
         reference_data: referenceData,
@@ -156,6 +160,30 @@ function ModalNotificar({ open, onClose, type, referenceData, onSuccess }) {
               ))}
             </select>
           </div>
+          {users.length > 1 && toUserId !== '' && (
+            <div className="modal-notificar-field">
+              <span className="modal-notificar-label">También a (opcional)</span>
+              <div className="modal-notificar-extra">
+                {users
+                  .filter((u) => String(u.id) !== String(toUserId))
+                  .map((u) => (
+                    <label key={u.id} className="modal-notificar-extra-item">
+                      <input
+                        type="checkbox"
+                        checked={extraIds.includes(String(u.id))}
+                        onChange={(e) =>
+                          setExtraIds((prev) =>
+                            e.target.checked ? [...prev, String(u.id)] : prev.filter((id) => id !== String(u.id))
+                          )
+                        }
+                        disabled={cargando}
+                      />
+                      {u.username}
+                    </label>
+                  ))}
+              </div>
+            </div>
+          )}
           <div className="modal-notificar-field">
             <label htmlFor="modal-notificar-message">Mensaje (opcional)</label>
             <textarea
@@ -2,16 +2,9 @@ import React, { useState, useRef, useEffect } from 'react'
 import { useGarantia } from '../context/GarantiaContext'
 import { useAuth } from '../context/AuthContext'
 import { useTour } from '../context/TourContext'
-import { VISTAS, ATAJO_POR_VISTA, API_URL, AUTH_STORAGE_KEY } from '../constants'
-function getAuthHeaders() {
-  try {
-    const token = localStorage.getItem(AUTH_STORAGE_KEY)
-    if (token) return { Authorization: `Bearer ${token}` }
-  } catch {}
-  return {}
-}
+import { VISTAS, ATAJO_POR_VISTA } from '../constants'
 
-function Navbar({ vista, setVista, onClienteDestacado, onProductoDestacado, onSerialDestacado, notifCountKey, refreshNotifCount }) {
+function Navbar({ vista, setVista, onClienteDestacado, onProductoDestacado, onSerialDestacado, unreadCount = 0, refreshNotifCount }) {
   const { hiddenRmas } = useGarantia()
   const { user, logout } = useAuth()
   const tour = useTour()
@@ -19,7 +12,6 @@ function Navbar({ vista, setVista, onClienteDestacado, onProductoDestacado, onSe
   const [showLogoutConfirm, setShowLogoutConfirm] = useState(false)
   const [showRmaMenu, setShowRmaMenu] = useState(false)
   const [showHamburgerMenu, setShowHamburgerMenu] = useState(false)
-  const [unreadCount, setUnreadCount] = useState(0)
   const [serialInput, setSerialInput] = useState('')
   const serialInputRef = useRef(null)
   const rmaMenuRef = useRef(null)
@@ -63,13 +55,6 @@ function Navbar({ vista, setVista, onClienteDestacado, onProductoDestacado, onSe
     return () => document.removeEventListener('mousedown', closeMenus)
   }, [])
 
-  useEffect(() => {
-    fetch(`${API_URL}/api/notifications/unread-count`, { headers: getAuthHeaders() })
-      .then((r) => (r.ok ? r.json() : { count: 0 }))
-      .then((data) => setUnreadCount(data.count ?? 0))
-      .catch(() => setUnreadCount(0))
-  }, [notifCountKey])
-
   const handleLogoutClick = () => {
     setShowHamburgerMenu(false)
     setShowLogoutConfirm(true)
@@ -377,7 +377,7 @@ function Configuracion({ setVista }) {
                 setResetMensaje(cargados != null ? `${msg} Registros cargados: ${cargados}.` : msg)
                 setResetting(false)
                 cargarEstado()
-              } else if (t.status === 'error') {
+              } else if (t.status === 'error' || t.status === 'cancelled') {
                 if (resetPollRef.current) clearInterval(resetPollRef.current)
                 resetPollRef.current = null
                 setResetError(t.message || 'Error al recargar')
@@ -1,4 +1,4 @@
-import React, { useState } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import { API_URL, AUTH_STORAGE_KEY } from '../../constants'
 
 function getAuthHeaders() {
@@ -9,6 +9,24 @@ function getAuthHeaders() {
   return {}
 }
 
+/** Lee una respuesta NDJSON (una línea = un evento JSON) y llama a onEvento según llegan. */
+async function leerNdjson(res, onEvento) {
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let pendiente = ''
+  for (;;) {
+    const { done, value } = await reader.read()
+    pendiente += decoder.decode(value || new Uint8Array(), { stream: !done })
+    const lineas = pendiente.split('\n')
+    pendiente = lineas.pop()
+    for (const linea of lineas) {
+      if (linea.trim()) onEvento(JSON.parse(linea))
+    }
+    if (done) break
+  }
+  if (pendiente.trim()) onEvento(JSON.parse(pendiente))
+}
+
 /**
  * Apartado Informes: genera informes (Atractor, etc.) y opción de descarga.
  */
@@ -18,8 +36,13 @@ function Informes() {
   const [atractorCargando, setAtractorCargando] = useState(false)
   const [atractorError, setAtractorError] = useState(null)
   const [atractorDatos, setAtractorDatos] = useState(null)
+  const [atractorCache, setAtractorCache] = useState(null)
+  const [atractorProgreso, setAtractorProgreso] = useState(null) // rangos largos: { hechos, total } meses
+  // Al salir de la vista o pedir otro informe se aborta el anterior (el servidor cancela la consulta a Atractor)
+  const atractorAbortRef = useRef(null)
+  useEffect(() => () => atractorAbortRef.current?.abort(), [])
 
-  const pedirInformeVentasAtractor = () => {
+  const pedirInformeVentasAtractor = (refrescar = false) => {
     const desde = atractorDesde.trim().slice(0, 10)
     const hasta = atractorHasta.trim().slice(0, 10)
     if (!desde || !hasta) {
@@ -28,19 +51,55 @@ function Informes() {
     }
     setAtractorError(null)
     setAtractorDatos(null)
+    setAtractorCache(null)
+    setAtractorProgreso(null)
     setAtractorCargando(true)
+    atractorAbortRef.current?.abort()
+    const controller = new AbortController()
+    atractorAbortRef.current = controller
     fetch(`${API_URL}/api/atractor/informe-ventas`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json', ...getAuthHeaders() },
-      body: JSON.stringify({ desde, hasta }),
+      body: JSON.stringify({ desde, hasta, refrescar }),
+      signal: controller.signal,
     })
-      .then((res) => res.json().catch(() => ({})))
-      .then((data) => {
-        if (data.detail) throw new Error(typeof data.detail === 'string' ? data.detail : JSON.stringify(data.detail))
-        setAtractorDatos(data.datos ?? data)
+      .then((res) => {
+        // Rango largo: el servidor lo pide por meses y envía progreso y filas sumadas en NDJSON
+        if (res.ok && (res.headers.get('Content-Type') || '').includes('application/x-ndjson')) {
+          let filas = []
+          return leerNdjson(res, (ev) => {
+            if (ev.tipo === 'inicio') setAtractorProgreso({ hechos: 0, total: ev.tramos })
+            else if (ev.tipo === 'tramo') setAtractorProgreso((p) => p && { ...p, hechos: p.hechos + 1 })
+            else if (ev.tipo === 'filas') {
+              filas = filas.concat(ev.filas)
+              setAtractorDatos(filas)
+            } else if (ev.tipo === 'datos') setAtractorDatos(ev.datos)
+            else if (ev.tipo === 'error') throw new Error(ev.detail || 'Error al obtener el informe')
+            else if (ev.tipo === 'fin') {
+              if (ev.filas === 0) setAtractorDatos([])
+              setAtractorCache(ev.cache ?? null)
+              setAtractorProgreso(null)
+            }
+          })
+        }
+        return res
+          .json()
+          .catch(() => ({}))
+          .then((data) => {
+            if (data.detail) throw new Error(typeof data.detail === 'string' ? data.detail : JSON.stringify(data.detail))
+            setAtractorDatos(data.datos ?? data)
+            setAtractorCache(data.cache ?? null)
+          })
+      })
+      .catch((err) => {
+        if (err.name !== 'AbortError') setAtractorError(err.message || 'Error al obtener el informe')
+      })
+      .finally(() => {
+        if (atractorAbortRef.current === controller) {
+          atractorAbortRef.current = null
+          setAtractorCargando(false)
+        }
       })
-      .catch((err) => setAtractorError(err.message || 'Error al obtener el informe'))
-      .finally(() => setAtractorCargando(false))
   }
 
   const renderAtractorResult = (datos) => {
@@ -113,11 +172,26 @@ function Informes() {
           <button
             type="button"
             className="btn btn-primary"
-            onClick={pedirInformeVentasAtractor}
+            onClick={() => pedirInformeVentasAtractor(false)}
             disabled={atractorCargando}
           >
-            {atractorCargando ? 'Cargando...' : 'Obtener informe'}
+            {atractorCargando
+              ? atractorProgreso
+                ? `Cargando... (${atractorProgreso.hechos}/${atractorProgreso.total} meses)`
+                : 'Cargando...'
+              : 'Obtener informe'}
           </button>
+          {atractorDatos != null && atractorCache && ['hit', 'stale'].includes(atractorCache.estado) && (
+            <button
+              type="button"
+              className="btn btn-secondary"
+              onClick={() => pedirInformeVentasAtractor(true)}
+              disabled={atractorCargando}
+              title="Vuelve a consultar Atractor sin usar la copia guardada"
+            >
+              Actualizar desde Atractor
+            </button>
+          )}
         </div>
         {atractorError && (
           <p className="error-msg informes-atractor-error" role="alert">
@@ -127,6 +201,12 @@ function Informes() {
         {atractorDatos != null && (
           <div className="informes-atractor-result">
             <h3 className="informes-atractor-result-titulo">Resultado</h3>
+            {atractorCache?.fetched_at && ['hit', 'stale'].includes(atractorCache.estado) && (
+              <p className="informes-atractor-cache">
+                Datos guardados del {new Date(atractorCache.fetched_at).toLocaleString('es-ES')}
+                {atractorCache.estado === 'stale' ? ' (actualizando en segundo plano)' : ''}.
+              </p>
+            )}
             {renderAtractorResult(atractorDatos)}
           </div>
         )}
@@ -29,6 +29,7 @@ function parseRef(ref) {
 const BANDEJA_RECIBIDOS = 'recibidos'
 const BANDEJA_ENVIADOS = 'enviados'
 const BANDEJA_BORRADOS = 'borrados'
+const NOTIFICACIONES_POR_PAGINA = 50
 
 /** Devuelve etiqueta de fecha al estilo WhatsApp: "Hoy", "Ayer" o "31 ene 2025" */
 function getDateLabel(createdAt) {
@@ -90,7 +91,10 @@ function Notificaciones({
     }
   })
   const [list, setList] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [archivados, setArchivados] = useState(false)
   const [cargando, setCargando] = useState(true)
+  const [cargandoMas, setCargandoMas] = useState(false)
   const [error, setError] = useState(null)
 
   useEffect(() => {
@@ -104,34 +108,63 @@ function Notificaciones({
     } catch (_) {}
   }, [categoria])
 
-  const refetch = useCallback(() => {
-    setCargando(true)
-    setError(null)
+  // Páginas por cursor: la primera al cambiar de bandeja/filtro, las siguientes con «Cargar más»
+  const buildUrl = useCallback((cursor) => {
+    const params = new URLSearchParams({ limit: String(NOTIFICACIONES_POR_PAGINA) })
     let base
     if (bandeja === BANDEJA_BORRADOS) {
-      base = `${API_URL}/api/notifications/sent?deleted=1`
+      base = `${API_URL}/api/notifications/sent`
+      params.set('deleted', '1')
     } else if (bandeja === BANDEJA_ENVIADOS) {
       base = `${API_URL}/api/notifications/sent`
     } else {
       base = `${API_URL}/api/notifications`
     }
-    const url = categoria && bandeja !== BANDEJA_BORRADOS
-      ? `${base}${base.includes('?') ? '&' : '?'}category=${encodeURIComponent(categoria)}`
-      : base
-    fetch(url, { headers: getAuthHeaders() })
+    if (categoria && bandeja !== BANDEJA_BORRADOS) params.set('category', categoria)
+    if (archivados && bandeja !== BANDEJA_BORRADOS) params.set('archived', '1')
+    if (cursor) params.set('cursor', cursor)
+    return `${base}?${params}`
+  }, [bandeja, categoria, archivados])
+
+  const refetch = useCallback(() => {
+    setCargando(true)
+    setError(null)
+    fetch(buildUrl(null), { headers: getAuthHeaders() })
       .then((r) => {
         if (!r.ok) throw new Error('Error al cargar notificaciones')
         return r.json()
       })
-      .then((data) => setList(Array.isArray(data) ? data : []))
+      .then((data) => {
+        setList(Array.isArray(data.items) ? data.items : [])
+        setNextCursor(data.next_cursor || null)
+      })
       .catch((err) => setError(err.message))
       .finally(() => setCargando(false))
-  }, [bandeja, categoria])
+  }, [buildUrl])
 
   useEffect(() => {
     refetch()
   }, [refetch])
 
+  const cargarMas = () => {
+    if (!nextCursor || cargandoMas) return
+    setCargandoMas(true)
+    fetch(buildUrl(nextCursor), { headers: getAuthHeaders() })
+      .then((r) => {
+        if (!r.ok) throw new Error('Error al cargar notificaciones')
+        return r.json()
+      })
+      .then((data) => {
+        const items = Array.isArray(data.items) ? data.items : []
+        setList((prev) => [...prev, ...items])
+        setNextCursor(data.next_cursor || null)
+      })
+      .catch((err) => setError(err.message))
+      .finally(() => setCargandoMas(false))
+  }
+
+  const quitarDeLista = (id) => setList((prev) => prev.filter((x) => x.id !== id))
+
   const groupedList = useMemo(() => groupByDate(list), [list])
 
   const handleBorrar = (n) => {
@@ -145,7 +178,7 @@ function Notificaciones({
         if (!r.ok) return r.json().then((d) => { throw new Error(d.detail || 'Error al borrar') })
         return r.json()
       })
-      .then(() => refetch())
+      .then(() => quitarDeLista(n.id))
       .catch((err) => setError(err.message))
       .finally(() => setActioningId(null))
   }
@@ -161,7 +194,7 @@ function Notificaciones({
         if (!r.ok) return r.json().then((d) => { throw new Error(d.detail || 'Error al restaurar') })
         return r.json()
       })
-      .then(() => refetch())
+      .then(() => quitarDeLista(n.id))
       .catch((err) => setError(err.message))
       .finally(() => setActioningId(null))
   }
@@ -203,7 +236,8 @@ function Notificaciones({
         method: 'PATCH',
         headers: getAuthHeaders(),
       }).then(() => {
-        refetch()
+        const leidaEn = new Date().toISOString()
+        setList((prev) => prev.map((x) => (x.id === n.id ? { ...x, read_at: leidaEn } : x)))
         onMarkRead?.()
       })
     }
@@ -267,6 +301,7 @@ function Notificaciones({
           : bandeja === BANDEJA_BORRADOS
             ? 'Mensajes que has borrado desde Enviados. No se eliminan de la base de datos; puedes restaurarlos.'
             : `Enviados${categoria ? ` · Filtro: ${NOTIFICATION_CATEGORIES[categoria]}` : ''}. Solo tú puedes borrarlos; pasarán a la bandeja Borrados.`}
+        {archivados && bandeja !== BANDEJA_BORRADOS && ' Mostrando mensajes archivados (leídos hace tiempo).'}
       </p>
 
       {list.length === 0 ? (
@@ -347,6 +382,19 @@ function Notificaciones({
           ))}
         </ul>
       )}
+
+      <div className="notificaciones-paginacion">
+        {nextCursor && (
+          <button type="button" className="btn btn-secondary btn-sm" onClick={cargarMas} disabled={cargandoMas}>
+            {cargandoMas ? 'Cargando…' : 'Cargar más'}
+          </button>
+        )}
+        {bandeja !== BANDEJA_BORRADOS && (
+          <button type="button" className="btn btn-secondary btn-sm" onClick={() => setArchivados((a) => !a)}>
+            {archivados ? 'Volver a los mensajes recientes' : 'Ver mensajes archivados'}
+          </button>
+        )}
+      </div>
     </>
   )
 }
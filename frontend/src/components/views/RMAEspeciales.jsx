@@ -2,6 +2,7 @@ import React, { useState, useEffect, useCallback, useRef } from 'react'
 import { API_URL, AUTH_STORAGE_KEY, OPCIONES_ESTADO } from '../../constants'
 import ProgressBar from '../ProgressBar'
 import ModalNotificar from '../ModalNotificar'
+import Paginacion from '../Paginacion'
 
 function getAuthHeaders() {
   try {
@@ -11,6 +12,17 @@ function getAuthHeaders() {
   return {}
 }
 
+/** Entradas por página del resultado del escaneo (se piden al backend ya filtradas). */
+const ESCANEO_POR_PAGINA = 50
+
+const FILTROS_ESCANEO = [
+  { value: '', label: 'Todos' },
+  { value: 'imported', label: 'Importados' },
+  { value: 'missing', label: 'Formato no reconocido' },
+  { value: 'ready', label: 'Por importar' },
+  { value: 'error', label: 'Con error' },
+]
+
 /** Nombres de mes (completos y abreviados) a número "01"-"12" para directorios tipo "Enero", "Febrero". */
 const MES_NOMBRE_A_NUM = {
   enero: '01', ene: '01',
@@ -86,10 +98,37 @@ function formatRmaFecha(r) {
   return formatCreatedAt(r.file_date || r.created_at)
 }
 
+/** Nº de líneas del RMA con barra de progreso (líneas con estado asignado / total) y desglose por estado al pasar el ratón. */
+function LineasProgreso({ rma }) {
+  const total = rma.line_count ?? 0
+  if (!total) return 0
+  const counts = rma.estado_counts || {}
+  const conEstado = total - (counts[''] || 0)
+  const detalle = Object.entries(counts)
+    .filter(([estado]) => estado)
+    .map(([estado, n]) => `${OPCIONES_ESTADO.find((o) => o.value === estado)?.label || estado}: ${n}`)
+    .join(', ')
+  return (
+    <div title={detalle || 'Ninguna línea con estado'}>
+      <ProgressBar
+        percent={(conEstado * 100) / total}
+        message={`${conEstado} / ${total}`}
+        className="rma-especiales-lineas-progreso"
+      />
+    </div>
+  )
+}
+
 function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestacadoId }) {
   const [list, setList] = useState([])
   const [detalle, setDetalle] = useState(null)
+  // Resultado del escaneo: se guarda en el backend y aquí solo está la página visible ({ items, total, counts })
+  const [scanId, setScanId] = useState(null)
   const [scanResult, setScanResult] = useState(null)
+  const [scanFiltro, setScanFiltro] = useState('')
+  const [scanPagina, setScanPagina] = useState(1)
+  const [scanRecarga, setScanRecarga] = useState(0)
+  const scanTotalRef = useRef(null)
   const [cargando, setCargando] = useState(true)
   const [scanTaskId, setScanTaskId] = useState(null)
   const [scanProgress, setScanProgress] = useState(0)
@@ -177,7 +216,11 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
 
   const handleEscanear = () => {
     setError(null)
+    setScanId(null)
     setScanResult(null)
+    setScanFiltro('')
+    setScanPagina(1)
+    scanTotalRef.current = null
     setScanProgress(0)
     setScanMessage('Iniciando...')
     fetch(`${API_URL}/api/rma-especiales/scan`, { method: 'POST', headers: getAuthHeaders() })
@@ -197,13 +240,16 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
         .then((data) => {
           setScanProgress(data.percent ?? 0)
           setScanMessage(data.message ?? '')
+          if (data.result?.scan_id && (data.status === 'done' || data.result.total !== scanTotalRef.current)) {
+            // La tarea solo trae recuentos: la página se pide aparte cuando hay entradas nuevas (también parciales)
+            scanTotalRef.current = data.result.total
+            setScanId(data.result.scan_id)
+            setScanRecarga((n) => n + 1)
+          }
           if (data.status === 'done') {
-            if (data.result?.items != null) {
-              setScanResult({ items: data.result.items, total: data.result.total ?? data.result.items.length })
-            }
             setScanTaskId(null)
             refetch()
-          } else if (data.status === 'error') {
+          } else if (data.status === 'error' || data.status === 'cancelled') {
             setError(data.message || 'Error en el escaneo')
             setScanTaskId(null)
           }
@@ -217,6 +263,25 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
     }
   }, [scanTaskId, refetch])
 
+  useEffect(() => {
+    if (!scanId) return
+    let cancelado = false
+    const params = new URLSearchParams({
+      limit: String(ESCANEO_POR_PAGINA),
+      offset: String((scanPagina - 1) * ESCANEO_POR_PAGINA),
+    })
+    if (scanFiltro) params.set('estado', scanFiltro)
+    fetch(`${API_URL}/api/rma-especiales/scan/${encodeURIComponent(scanId)}/items?${params}`, { headers: getAuthHeaders() })
+      .then((r) => (r.ok ? r.json() : null))
+      .then((data) => {
+        if (!cancelado && data) setScanResult(data)
+      })
+      .catch(() => {})
+    return () => {
+      cancelado = true
+    }
+  }, [scanId, scanFiltro, scanPagina, scanRecarga])
+
   const escaneando = !!scanTaskId
 
   const handleImportar = async (item) => {
@@ -239,7 +304,7 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
       const res = await fetch(`${API_URL}/api/rma-especiales/import`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json', ...getAuthHeaders() },
-        body: JSON.stringify({ path: item.path, rma_number: item.rma_number }),
+        body: JSON.stringify({ path: item.path, rma_number: item.rma_number, scan_id: scanId }),
       })
       const data = await res.json()
       if (!res.ok) {
@@ -260,9 +325,7 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
         throw new Error(parsed?.message || (typeof raw === 'string' ? raw : 'Error al importar'))
       }
       refetch()
-      if (scanResult && scanResult.items) {
-        setScanResult({ ...scanResult, items: scanResult.items.filter((i) => i.path !== item.path) })
-      }
+      if (scanId) setScanRecarga((n) => n + 1)
     } catch (err) {
       setError(err.message)
     } finally {
@@ -272,7 +335,6 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
 
   const handleAsignarSubmit = () => {
     if (!asignarFile) return
-    const pathJustImported = asignarFile.path
     setImportando(true)
     setError(null)
     const useGrid = Array.isArray(asignarGrid) && asignarGrid.length > 0
@@ -285,6 +347,7 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
           column_fallo_index: asignarColFalloIdx,
           column_resolucion_index: asignarColResolucionIdx,
           sheet: asignarSheet,
+          scan_id: scanId,
         }
       : {
           path: asignarFile.path,
@@ -292,6 +355,7 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
           column_serial: asignarColSerial || null,
           column_fallo: asignarColFallo || null,
           column_resolucion: asignarColResolucion || null,
+          scan_id: scanId,
         }
     fetch(`${API_URL}/api/rma-especiales/import`, {
       method: 'POST',
@@ -304,28 +368,16 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
           setAsignarOpen(false)
           setAsignarFile(null)
           refetch()
-          // Recomprobar el resto de Excels con los nuevos aliases: los que tengan las mismas columnas pasan a "Importar"
-          if (scanResult && scanResult.items) {
-            const itemsWithoutImported = scanResult.items.filter((i) => i.path !== pathJustImported)
-            const recheckPaths = itemsWithoutImported
-              .filter((i) => i.missing && i.missing.length > 0)
-              .map((i) => i.path)
-            if (recheckPaths.length > 0) {
-              fetch(`${API_URL}/api/rma-especiales/recheck`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json', ...getAuthHeaders() },
-                body: JSON.stringify({ paths: recheckPaths }),
-              })
-                .then((res) => (res.ok ? res.json() : { items: [] }))
-                .then((recheckData) => {
-                  const recheckMap = new Map((recheckData.items || []).map((r) => [r.path, r]))
-                  const updatedItems = itemsWithoutImported.map((item) => recheckMap.get(item.path) ?? item)
-                  setScanResult({ ...scanResult, items: updatedItems, total: updatedItems.length })
-                })
-                .catch(() => setScanResult({ ...scanResult, items: itemsWithoutImported, total: itemsWithoutImported.length }))
-            } else {
-              setScanResult({ ...scanResult, items: itemsWithoutImported, total: itemsWithoutImported.length })
-            }
+          // Recomprobar el resto de Excels sin formato del escaneo con los nuevos aliases/formatos (en el backend):
+          // los que tengan las mismas columnas pasan a "Importar"
+          if (scanId) {
+            fetch(`${API_URL}/api/rma-especiales/recheck`, {
+              method: 'POST',
+              headers: { 'Content-Type': 'application/json', ...getAuthHeaders() },
+              body: JSON.stringify({ scan_id: scanId }),
+            })
+              .catch(() => {})
+              .finally(() => setScanRecarga((n) => n + 1))
           }
         }
       })
@@ -432,8 +484,13 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
       .finally(() => setDeletingLineaId(null))
   }
 
-  const autoImportados = scanResult?.items?.filter((i) => i.imported === true) || []
-  const conFaltantes = scanResult?.items?.filter((i) => i.missing && i.missing.length > 0) || []
+  const scanCounts = scanResult?.counts || {}
+  const scanTotalPaginas = Math.max(1, Math.ceil((scanResult?.total || 0) / ESCANEO_POR_PAGINA))
+
+  // Tras importar la última entrada de la última página, volver a una página que exista
+  useEffect(() => {
+    if (scanPagina > scanTotalPaginas) setScanPagina(scanTotalPaginas)
+  }, [scanPagina, scanTotalPaginas])
 
   const lineasDetalleFiltradasOrdenadas = React.useMemo(() => {
     const lineas = Array.isArray(detalle?.lineas) ? detalle.lineas : []
@@ -562,7 +619,7 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
               {rmasInMonth.map((r) => (
                 <tr key={r.id}>
                   <td>{r.rma_number}</td>
-                  <td>{r.line_count ?? 0}</td>
+                  <td><LineasProgreso rma={r} /></td>
                   <td>{formatRmaFecha(r)}</td>
                   <td className="celda-acciones">
                     <div className="celda-acciones-wrap">
@@ -860,19 +917,36 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
           <h3>Resultado del escaneo</h3>
           <p>
             Solo se listan RMA que no estaban en la base de datos. Los de formato reconocido se importan automáticamente.
-            {scanResult.total === 0 && (
+            {!escaneando && !scanCounts.total && (
               <span> No hay nuevos Excel pendientes: todos los RMAs de la carpeta ya están importados.</span>
             )}
-            {autoImportados.length > 0 && (
-              <span> {autoImportados.length} importados correctamente.</span>
+            {scanCounts.imported > 0 && (
+              <span> {scanCounts.imported} importados correctamente.</span>
             )}
-            {conFaltantes.length > 0 && (
-              <span> {conFaltantes.length} con formato no reconocido: asigna columnas para guardar el formato e importar.</span>
+            {scanCounts.missing > 0 && (
+              <span> {scanCounts.missing} con formato no reconocido: asigna columnas para guardar el formato e importar.</span>
             )}
-            {(scanResult.items?.filter((i) => i.imported === false && i.error).length || 0) > 0 && (
-              <span> {(scanResult.items?.filter((i) => i.imported === false && i.error).length || 0)} con error al importar.</span>
+            {scanCounts.error > 0 && (
+              <span> {scanCounts.error} con error.</span>
             )}
           </p>
+          {scanCounts.total > 0 && (
+            <div className="rma-especiales-scan-filtros">
+              {FILTROS_ESCANEO.map((f) => (
+                <button
+                  key={f.value || 'todos'}
+                  type="button"
+                  className={`btn btn-sm ${scanFiltro === f.value ? 'btn-primary' : 'btn-secondary'}`}
+                  onClick={() => {
+                    setScanFiltro(f.value)
+                    setScanPagina(1)
+                  }}
+                >
+                  {f.label} ({f.value ? scanCounts[f.value] || 0 : scanCounts.total})
+                </button>
+              ))}
+            </div>
+          )}
           {scanResult.items && scanResult.items.length > 0 && (
             <ul className="rma-especiales-scan-list">
               {scanResult.items.map((item) => (
@@ -901,6 +975,15 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
               ))}
             </ul>
           )}
+          <Paginacion
+            inicio={(scanPagina - 1) * ESCANEO_POR_PAGINA}
+            fin={scanPagina * ESCANEO_POR_PAGINA}
+            total={scanResult.total || 0}
+            pagina={scanPagina}
+            totalPaginas={scanTotalPaginas}
+            setPagina={setScanPagina}
+            label="archivos"
+          />
         </div>
       )}
 
@@ -923,7 +1006,7 @@ function RMAEspeciales({ setVista, rmaEspecialDestacadoId, setRmaEspecialDestaca
               {list.map((r) => (
                 <tr key={r.id}>
                   <td>{r.rma_number}</td>
-                  <td>{r.line_count ?? 0}</td>
+                  <td><LineasProgreso rma={r} /></td>
                   <td>{formatRmaFecha(r)}</td>
                   <td className="celda-acciones">
                     <div className="celda-acciones-wrap">
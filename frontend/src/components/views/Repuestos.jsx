@@ -9,12 +9,14 @@ function getAuthHeaders() {
   return {}
 }
 
+const LIMITE_BUSQUEDA_PRODUCTOS = 100
+
 /**
  * Vista Repuestos: repuestos vinculados a productos del catálogo, con inventario (cantidad).
  */
 function Repuestos() {
   const [list, setList] = useState([])
-  const [catalogo, setCatalogo] = useState([])
+  const [resultadosCatalogo, setResultadosCatalogo] = useState({ productos: [], total: 0, cached: true })
   const [cargando, setCargando] = useState(true)
   const [error, setError] = useState(null)
   const [modal, setModal] = useState(null) // null | 'crear' | { tipo: 'editar', repuesto }
@@ -29,13 +31,10 @@ function Repuestos() {
   const refetch = useCallback(() => {
     setCargando(true)
     setError(null)
-    Promise.all([
-      fetch(`${API_URL}/api/repuestos`, { headers: getAuthHeaders() }).then((r) => (r.ok ? r.json() : [])),
-      fetch(`${API_URL}/api/productos-catalogo`, { headers: getAuthHeaders() }).then((r) => r.json().then((d) => d.productos || [])),
-    ])
-      .then(([repuestos, productos]) => {
+    fetch(`${API_URL}/api/repuestos`, { headers: getAuthHeaders() })
+      .then((r) => (r.ok ? r.json() : []))
+      .then((repuestos) => {
         setList(Array.isArray(repuestos) ? repuestos : [])
-        setCatalogo(Array.isArray(productos) ? productos : [])
       })
       .catch((err) => setError(err.message))
       .finally(() => setCargando(false))
@@ -45,22 +44,47 @@ function Repuestos() {
     refetch()
   }, [refetch])
 
-  const opcionesProductos = catalogo.map((p) => {
-    const brand = (p.brand || '').replace(/^PRODUCTOS\s+/i, '').trim()
-    const baseSerial = String(p.base_serial ?? '').trim()
-    const ref = [p.brand, p.base_serial].filter(Boolean).join('|') || baseSerial || '-'
+  // Búsqueda de productos en el servidor (índice del catálogo): no se descarga el catálogo entero
+  useEffect(() => {
+    if (!modal) return undefined
+    const q = (filtroProductoRef || '').trim()
+    const timer = setTimeout(() => {
+      const params = new URLSearchParams({ q, limit: String(LIMITE_BUSQUEDA_PRODUCTOS) })
+      fetch(`${API_URL}/api/productos-catalogo/buscar?${params}`, { headers: getAuthHeaders() })
+        .then((r) => (r.ok ? r.json() : { productos: [], total: 0, cached: false }))
+        .then((data) =>
+          setResultadosCatalogo({
+            productos: Array.isArray(data.productos) ? data.productos : [],
+            total: data.total ?? 0,
+            cached: data.cached ?? false,
+          })
+        )
+        .catch(() => {})
+    }, 250)
+    return () => clearTimeout(timer)
+  }, [modal, filtroProductoRef])
+
+  const opcionProducto = (brandRaw, serialRaw) => {
+    const brand = (brandRaw || '').replace(/^PRODUCTOS\s+/i, '').trim()
+    const baseSerial = String(serialRaw ?? '').trim()
+    const ref = [brandRaw, serialRaw].filter(Boolean).join('|') || baseSerial || '-'
     const label = [brand, baseSerial].filter(Boolean).join(' — ') || ref
     return { value: ref, label, base_serial: baseSerial }
-  })
+  }
 
+  const opcionesProductos = resultadosCatalogo.productos.map((p) => opcionProducto(p.brand, p.base_serial))
+
+  // Los ya vinculados se muestran siempre (aunque no salgan en la búsqueda actual)
   const opcionesProductosFiltradas = React.useMemo(() => {
-    const q = (filtroProductoRef || '').trim().toLowerCase()
-    if (!q) return opcionesProductos
-    return opcionesProductos.filter((opt) => {
-      const serie = (opt.base_serial || '').toLowerCase()
-      return serie.includes(q)
-    })
-  }, [opcionesProductos, filtroProductoRef])
+    const enResultados = new Set(opcionesProductos.map((opt) => opt.value))
+    const seleccionados = formProductos
+      .filter((ref) => !enResultados.has(ref))
+      .map((ref) => {
+        const [brand, serial] = ref.includes('|') ? ref.split('|') : ['', ref]
+        return opcionProducto(brand, serial)
+      })
+    return [...seleccionados, ...opcionesProductos]
+  }, [opcionesProductos, formProductos])
 
   const abrirCrear = () => {
     setFormNombre('')
@@ -311,7 +335,7 @@ function Repuestos() {
                 className="modal-input"
               />
               <label className="modal-label">Vinculado a productos (catálogo)</label>
-              {opcionesProductos.length > 0 && (
+              {resultadosCatalogo.cached && (
                 <div className="repuestos-productos-busqueda">
                   <input
                     type="text"
@@ -323,7 +347,7 @@ function Repuestos() {
                 </div>
               )}
               <div className="repuestos-productos-select">
-                {opcionesProductos.length === 0 ? (
+                {!resultadosCatalogo.cached ? (
                   <p className="modal-hint">Carga el catálogo en Productos para elegir productos.</p>
                 ) : opcionesProductosFiltradas.length === 0 ? (
                   <p className="modal-hint">No hay productos que coincidan con la búsqueda.</p>
@@ -340,6 +364,11 @@ function Repuestos() {
                   ))
                 )}
               </div>
+              {resultadosCatalogo.total > opcionesProductos.length && (
+                <p className="modal-hint">
+                  Mostrando {opcionesProductos.length} de {resultadosCatalogo.total} productos. Afina la búsqueda para ver más.
+                </p>
+              )}
             </div>
             <div className="modal-pie modal-pie-actions">
               <button type="button" className="btn btn-secondary" onClick={cerrarModal} disabled={guardando}>
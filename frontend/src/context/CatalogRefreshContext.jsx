@@ -74,7 +74,7 @@ export function CatalogRefreshProvider({ children }) {
             setTaskId(null)
             setStatus('done')
             setResult(t.result ?? null)
-          } else if (t.status === 'error') {
+          } else if (t.status === 'error' || t.status === 'cancelled') {
             if (pollRef.current) clearInterval(pollRef.current)
             pollRef.current = null
             setTaskId(null)